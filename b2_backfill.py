@@ -0,0 +1,182 @@
+"""
+Historical backfill from the B2 archive
+
+Re-extracts archived listing pages (br/htmls/listings/<yymmdd>/<listing_id>.html) of a date range and loads them
+into the database, e.g. after a parser change. Per day: the day's objects are listed, downloaded concurrently
+through one shared S3 client and parsed in memory by a process pool (parse_listing / parse_listing_images, no
+files on disk), then loaded in bulk with backfill_upload, which replaces the stored rows of the same listing and
+day. Listings not yet in listing_flats get their flat ids day by day in date order (assign_flat_ids), so a
+relisting joins the flat of its earlier listing; listings merged before keep their flat id.
+The properties dedup, the stats summary and the data version run once at the end. Listing presence is not
+rebuilt (update_presence only moves forward in time).
+
+Resumable: finished days are recorded in the state file (BACKFILL_STATE, default backfill_state.json) and skipped
+on the next run; a day with failed downloads is not recorded, and loading it again is safe.
+Any S3-compatible endpoint works (--endpoint-url), e.g. a local MinIO or moto_server with a copy of the archive.
+
+Usage: python b2_backfill.py 2025-01-01 2025-12-31 [--downloads 32] [--parse-workers 4] [--state FILE]
+                             [--restart] [--endpoint-url URL] [--bucket NAME] [--db-url mysql+pymysql://...]
+"""
+
+import os
+import json
+import time
+import argparse
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import pandas as pd
+from sqlalchemy import create_engine
+from backblaze_operations import b2_client, iter_object_keys, read_object
+from html_operations import parse_listing, parse_listing_images, listings_frame
+from sql_operations import with_sql_engine, backfill_upload, dedup_properties, mark_data_updated
+from merge_operations import assign_flat_ids
+from normalized_operations import is_normalized
+from stats_operations import refresh_stats_summary
+from metrics_operations import metrics
+from dotenv import load_dotenv
+load_dotenv()
+
+BACKFILL_PREFIX = "br/htmls/listings"
+BACKFILL_STATE = os.getenv("BACKFILL_STATE", "backfill_state.json")
+# Concurrent downloads, and objects in flight (downloaded but not yet parsed) at a time
+BACKFILL_DOWNLOADS = 32
+BACKFILL_WINDOW = 1000
+
+
+def days_between(start, end):
+    """yymmdd prefixes of the days from start to end (inclusive)"""
+    day = start
+    days = []
+    while day <= end:
+        days.append(day.strftime('%y%m%d'))
+        day += timedelta(days=1)
+    return days
+
+
+def load_state(path):
+    if os.path.exists(path):
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    return {'done': [], 'listings': 0}
+
+
+def save_state(path, state):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def parse_object(object_name, content):
+    """Listing record (or None) and image records of one archived listing page"""
+    day, name = object_name.split('/')[-2:]
+    # Archived pages are named by listing id; the record gets a <yymmdd>_<listing_id> source file name
+    filename = f"{day}_{os.path.splitext(name)[0]}"
+    return parse_listing(content, filename), parse_listing_images(content)
+
+
+def backfill_day(s3_client, bucket, day, download_pool, parse_pool):
+    """Downloads and parses the listings of one day; returns (listings, images, failed downloads)"""
+    keys = list(iter_object_keys(s3_client, bucket, f"{BACKFILL_PREFIX}/{day}/"))
+    listings, images, failed = [], [], 0
+    for start in range(0, len(keys), BACKFILL_WINDOW):
+        window = keys[start:start + BACKFILL_WINDOW]
+        downloads = {download_pool.submit(read_object, s3_client, bucket, key): key for key in window}
+        parses = []
+        # Each page goes to the parser as soon as it arrives
+        for future in as_completed(downloads):
+            try:
+                content = future.result()
+            except Exception as e:
+                print(f"Download of {downloads[future]} failed: {e}")
+                metrics.inc('backfill_download_errors')
+                failed += 1
+                continue
+            if parse_pool:
+                parses.append(parse_pool.submit(parse_object, downloads[future], content))
+            else:
+                parses.append(parse_object(downloads[future], content))
+        for parse in parses:
+            try:
+                listing, listing_images = parse.result() if parse_pool else parse
+            except Exception:
+                metrics.inc('parse_errors')
+                continue
+            if listing:
+                listings.append(listing)
+                images.extend(listing_images)
+    return listings, images, failed
+
+
+@metrics.reported("backfill")
+def backfill(start, end, downloads=BACKFILL_DOWNLOADS, parse_workers=None, state_path=BACKFILL_STATE,
+             restart=False, endpoint_url=None, bucket=None, engine=None):
+    endpoint_url = endpoint_url or os.getenv("B2_ENDPOINT_URL")
+    bucket = bucket or os.getenv("B2_BUCKET_NAME")
+    s3_client = b2_client(endpoint_url, os.getenv("B2_KEY_ID"), os.getenv("B2_APPLICATION_KEY"),
+                          max_connections=downloads)
+
+    state = {'done': [], 'listings': 0} if restart else load_state(state_path)
+    days = [day for day in days_between(start, end) if day not in state['done']]
+    print(f"Backfilling {len(days)} days from {bucket}/{BACKFILL_PREFIX} "
+          f"({len(state['done'])} days already done according to {state_path})")
+
+    parse_workers = os.cpu_count() if parse_workers is None else parse_workers
+    total_listings = 0
+    started = time.perf_counter()
+    download_pool = ThreadPoolExecutor(downloads)
+    parse_pool = ProcessPoolExecutor(parse_workers) if parse_workers else None
+    try:
+        for day in days:
+            day_started = time.perf_counter()
+            with metrics.stage("backfill_day"):
+                listings, images, failed = backfill_day(s3_client, bucket, day, download_pool, parse_pool)
+                if listings:
+                    df_listings, df_images = listings_frame(listings), pd.DataFrame(images)
+                    backfill_upload(engine, df_listings, df_images)
+                    assign_flat_ids(engine, df_listings, df_images)
+            seconds = time.perf_counter() - day_started
+            total_listings += len(listings)
+            metrics.inc('backfill_listings', len(listings))
+            print(f"Day {day}: {len(listings)} listings, {len(images)} images in {seconds:.1f}s "
+                  f"({len(listings) / seconds if seconds else 0:.1f} listings/s)"
+                  + (f", {failed} downloads failed, day left for the next run" if failed else ""))
+
+            if not failed:
+                state['done'].append(day)
+                state['listings'] += len(listings)
+                save_state(state_path, state)
+    finally:
+        download_pool.shutdown()
+        if parse_pool:
+            parse_pool.shutdown()
+
+    if total_listings:
+        if not is_normalized(engine):
+            dedup_properties(engine)
+        refresh_stats_summary(engine)
+        mark_data_updated(engine)
+
+    seconds = time.perf_counter() - started
+    print(f"Backfill finished: {total_listings} listings from {len(days)} days in {seconds:.1f}s "
+          f"({total_listings / seconds if seconds else 0:.1f} listings/s)")
+    return total_listings
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-extract archived listing pages of a date range from B2 into the database.")
+    parser.add_argument("start", type=lambda s: datetime.strptime(s, '%Y-%m-%d'), help="First day, YYYY-MM-DD")
+    parser.add_argument("end", type=lambda s: datetime.strptime(s, '%Y-%m-%d'), help="Last day, YYYY-MM-DD")
+    parser.add_argument("--downloads", type=int, default=BACKFILL_DOWNLOADS, help="Concurrent downloads")
+    parser.add_argument("--parse-workers", type=int, help="Parser processes (default: CPU count, 0: parse in the main process)")
+    parser.add_argument("--state", default=BACKFILL_STATE, help="Progress file of finished days")
+    parser.add_argument("--restart", action="store_true", help="Ignore the progress file and redo every day")
+    parser.add_argument("--endpoint-url", help="S3 endpoint (default: B2_ENDPOINT_URL)")
+    parser.add_argument("--bucket", help="Bucket (default: B2_BUCKET_NAME)")
+    parser.add_argument("--db-url", help="Database URL instead of the DB_* settings (e.g. a scratch database)")
+    args = parser.parse_args()
+
+    run = backfill if args.db_url else with_sql_engine(backfill)
+    kwargs = {'engine': create_engine(args.db_url)} if args.db_url else {}
+    run(args.start, args.end, downloads=args.downloads, parse_workers=args.parse_workers, state_path=args.state,
+        restart=args.restart, endpoint_url=args.endpoint_url, bucket=args.bucket, **kwargs)
@@ -1,6 +1,8 @@
 import boto3
 import os
+from botocore.config import Config
 from botocore.exceptions import NoCredentialsError, ClientError
+from metrics_operations import metrics
 
 
 def upload_file(file_path, ENDPOINT_URL, KEY_ID, APPLICATION_KEY, BUCKET_NAME, object_name=None):
@@ -43,14 +45,18 @@ def upload_file(file_path, ENDPOINT_URL, KEY_ID, APPLICATION_KEY, BUCKET_NAME, o
         try: 
             s3_client.head_object(Bucket=BUCKET_NAME, Key=object_name)
             print(f"File {object_name} already exists in bucket {BUCKET_NAME}. Skipping upload.")
+            metrics.inc('b2_uploads', result='skipped')
             return True
         except ClientError:
             # File not found, proceed with upload
             pass
 
         print(f"Starting upload: {file_path} -> {BUCKET_NAME}/{object_name} ({content_type})")
-        s3_client.upload_file(file_path, BUCKET_NAME, object_name, ExtraArgs=extra_args)
+        with metrics.timer('b2_upload_seconds'):
+            s3_client.upload_file(file_path, BUCKET_NAME, object_name, ExtraArgs=extra_args)
         print(f"Upload Successful: {object_name}")
+        metrics.inc('b2_uploads', result='uploaded')
+        metrics.inc('b2_upload_bytes', os.path.getsize(file_path))
         return True
     except FileNotFoundError:
         print(f"The file {file_path} was not found for Backblaze upload")
@@ -58,3 +64,35 @@ def upload_file(file_path, ENDPOINT_URL, KEY_ID, APPLICATION_KEY, BUCKET_NAME, o
         print("Backblaze credentials not available")
     except Exception as e:
         print(f"An error with Backblaze occurred: {e}")
+    metrics.inc('b2_uploads', result='error')
+    return False
+
+
+def b2_client(ENDPOINT_URL, KEY_ID, APPLICATION_KEY, max_connections=10):
+    """
+    S3 client for the bucket, meant to be created once and shared: boto3 clients are thread-safe, and
+    max_connections sizes the connection pool for that many concurrent requests.
+    """
+    return boto3.client(
+        's3',
+        endpoint_url=ENDPOINT_URL,
+        aws_access_key_id=KEY_ID,
+        aws_secret_access_key=APPLICATION_KEY,
+        config=Config(max_pool_connections=max_connections, retries={'max_attempts': 5, 'mode': 'adaptive'})
+    )
+
+
+def iter_object_keys(s3_client, BUCKET_NAME, prefix):
+    """Yields the keys of the objects under prefix"""
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=prefix):
+        for obj in page.get('Contents', []):
+            yield obj['Key']
+
+
+def read_object(s3_client, BUCKET_NAME, object_name):
+    """Content of an object, in memory"""
+    with metrics.timer('b2_download_seconds'):
+        body = s3_client.get_object(Bucket=BUCKET_NAME, Key=object_name)['Body'].read()
+    metrics.inc('b2_download_bytes', len(body))
+    return body
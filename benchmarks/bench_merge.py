@@ -0,0 +1,128 @@
+"""
+Benchmark of the flat merge engine (merge_operations) on a synthetic year of daily batches.
+
+Each day brings new listings; a share of them are relistings of an earlier flat (same place and area,
+lightly edited description, some reused photos) or the same flat posted twice on one day.
+The engine runs incrementally, one batch per day against the blocks of the accumulated listing_flats rows,
+and the result is checked against the known ground truth.
+
+Usage: python benchmarks/bench_merge.py [--days 365] [--per-day 300] [--relist-share 0.15]
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from merge_operations import prepare_listings, match_batch  # noqa: E402
+
+VOCABULARY = np.array([f"slovo{i}" for i in range(3000)])
+DISPOSITIONS = ['1+kk', '1+1', '2+kk', '2+1', '3+kk', '3+1', '4+kk']
+
+
+def random_description(rng, n_words=80):
+    return ' '.join(rng.choice(VOCABULARY, n_words))
+
+
+def edit_description(rng, description, share=0.1):
+    """Replaces a share of the words, like a landlord updating a listing"""
+    words = np.array(description.split())
+    changed = rng.choice(len(words), max(1, int(len(words) * share)), replace=False)
+    words[changed] = rng.choice(VOCABULARY, len(changed))
+    return ' '.join(words)
+
+
+def synthetic_year(days, per_day, relist_share, seed=0):
+    """Yields (day, df_today, df_images, true flat per listing_id) batches"""
+    rng = np.random.default_rng(seed)
+    flats = []  # (lat, lng, area, disposition, description, images)
+    next_listing = 1
+    for day in range(days):
+        rows, images, truth = [], [], {}
+        for _ in range(per_day):
+            if flats and rng.random() < relist_share:
+                flat = int(rng.integers(len(flats)))
+                lat, lng, area, disposition, description, photos = flats[flat]
+                lat += rng.normal(0, 0.00005)
+                lng += rng.normal(0, 0.00005)
+                area += int(rng.integers(-1, 2))
+                description = edit_description(rng, description)
+                photos = [p for p in photos if rng.random() < 0.5]
+            else:
+                flat = len(flats)
+                lat = 50.0 + rng.random() * 0.2
+                lng = 14.3 + rng.random() * 0.3
+                area = float(rng.integers(20, 120))
+                disposition = str(rng.choice(DISPOSITIONS))
+                description = random_description(rng)
+                photos = [f"{flat}_{k}" for k in range(int(rng.integers(3, 12)))]
+                flats.append((lat, lng, area, disposition, description, photos))
+
+            listing_id = next_listing
+            next_listing += 1
+            truth[listing_id] = flat
+            rows.append({'listing_id': listing_id, 'Latitude': round(lat, 5), 'Longitude': round(lng, 5),
+                         'Area (m2)': area, 'Disposition': disposition, 'Description': description})
+            images.extend({'listing_id': listing_id, 'filename': f"{p}.webp"} for p in photos)
+        yield day, pd.DataFrame(rows), pd.DataFrame(images), truth
+
+
+def pair_counts(labels_a, labels_b):
+    """Number of listing pairs grouped together by both labelings, and by each one"""
+    df = pd.DataFrame({'a': labels_a, 'b': labels_b})
+
+    def pairs(sizes):
+        return int((sizes * (sizes - 1) // 2).sum())
+
+    return pairs(df.groupby(['a', 'b']).size()), pairs(df.groupby('a').size()), pairs(df.groupby('b').size())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--per-day", type=int, default=300)
+    parser.add_argument("--relist-share", type=float, default=0.15)
+    args = parser.parse_args()
+
+    existing = None
+    truth = {}
+    next_flat_id = 1
+    prepare_time = match_time = 0.0
+    started = time.perf_counter()
+
+    for day, df_today, df_images, day_truth in synthetic_year(args.days, args.per_day, args.relist_share):
+        t0 = time.perf_counter()
+        new = prepare_listings(df_today, df_images)
+        t1 = time.perf_counter()
+        if existing is None:
+            existing = new.iloc[:0].assign(flat_id=pd.Series(dtype=np.int64))
+        merged, next_flat_id = match_batch(new, existing, next_flat_id)
+        t2 = time.perf_counter()
+        prepare_time += t1 - t0
+        match_time += t2 - t1
+
+        existing = pd.concat([existing, merged[existing.columns]], ignore_index=True)
+        truth.update(day_truth)
+        if (day + 1) % 30 == 0:
+            print(f"day {day + 1}: {len(existing)} listings, {existing['flat_id'].nunique()} flats")
+
+    total = time.perf_counter() - started
+    true_flats = existing['listing_id'].map(truth).to_numpy()
+    both, predicted, actual = pair_counts(existing['flat_id'].to_numpy(), true_flats)
+    precision = both / predicted if predicted else 1.0
+    recall = both / actual if actual else 1.0
+
+    print(f"\nListings: {len(existing)}, true flats: {len(set(true_flats))}, assigned flats: {existing['flat_id'].nunique()}")
+    print(f"Pair precision: {precision:.3f}, pair recall: {recall:.3f}")
+    engine_time = prepare_time + match_time
+    print(f"Time: {total:.1f}s total incl. data generation, merge engine {engine_time:.1f}s "
+          f"({prepare_time:.1f}s signatures/blocking keys, {match_time:.1f}s matching)")
+    print(f"Throughput: {len(existing) / engine_time:.0f} listings/s, "
+          f"{1000 * match_time / args.days:.1f} ms matching per daily batch")
+
+
+if __name__ == "__main__":
+    main()
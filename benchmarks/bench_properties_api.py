@@ -0,0 +1,91 @@
+"""
+Micro-benchmark of the post-query stage of /api/properties (MySQL path).
+
+Compares the previous per-listing groupby/iterrows loop (which also built every history inline)
+with the vectorized summarize_listings on synthetic frames shaped like the result of the properties query.
+
+Usage: python benchmarks/bench_properties_api.py [--rows 2000 20000 200000] [--repeat 3] [--skip-legacy]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "web"))
+os.environ.setdefault("LISTING_INDEX", "false")
+from bottle_app import summarize_listings  # noqa: E402
+
+
+def synthetic_rows(n_rows, rows_per_listing=4, seed=0):
+    """Frame with the columns returned by query_properties_sql, ~rows_per_listing observations per listing"""
+    rng = np.random.default_rng(seed)
+    n_listings = max(n_rows // rows_per_listing, 1)
+    today = datetime.now().date()
+    return pd.DataFrame({
+        'listing_id': rng.integers(0, n_listings, n_rows).astype(str),
+        'Latitude': np.round(50.0 + rng.random(n_rows) * 0.2, 5),
+        'Longitude': np.round(14.3 + rng.random(n_rows) * 0.3, 5),
+        'Date obtained': [today - timedelta(days=int(d)) for d in rng.integers(0, 365, n_rows)],
+        'Rent (CZK)': rng.integers(8, 40, n_rows) * 1000.0,
+        'Utilities (CZK)': np.where(rng.random(n_rows) < 0.2, np.nan, 2500.0),
+        'Services (CZK)': np.where(rng.random(n_rows) < 0.5, np.nan, 800.0),
+    })
+
+
+def legacy_group_loop(df, today):
+    """The per-listing loop get_properties_api used before vectorization"""
+    properties = []
+    for listing_id, group in df.groupby('listing_id'):
+        group = group.sort_values('Date obtained', ascending=False)
+        latest = group.iloc[0]
+        latest_date = latest['Date obtained']
+        if isinstance(latest_date, pd.Timestamp):
+            latest_date = latest_date.date()
+        is_available = (latest_date == today)
+        history = []
+        if len(group) > 1:
+            chart_group = group.sort_values('Date obtained', ascending=True)
+            for _, row in chart_group.iterrows():
+                price = (row['Rent (CZK)'] if pd.notna(row['Rent (CZK)']) else 0) \
+                    + (row['Utilities (CZK)'] if pd.notna(row['Utilities (CZK)']) else 0) \
+                    + (row['Services (CZK)'] if pd.notna(row['Services (CZK)']) else 0)
+                history.append({'date': row['Date obtained'].strftime('%d.%m.%Y'), 'price': int(price)})
+        properties.append({'lat': float(latest['Latitude']), 'lng': float(latest['Longitude']),
+                           'is_available': is_available, 'history': history})
+    return properties
+
+
+def best_of(func, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--rows", type=int, nargs="+", default=[2000, 20000, 200000])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--skip-legacy", action="store_true", help="Only time the vectorized stage")
+    args = parser.parse_args()
+
+    today = datetime.now().date()
+    print(f"{'rows':>8} {'listings':>9} {'legacy ms':>10} {'vectorized ms':>14} {'speedup':>8}")
+    for n_rows in args.rows:
+        df = synthetic_rows(n_rows)
+        vectorized = best_of(lambda: json.dumps(summarize_listings(df, today)), args.repeat)
+        legacy = None if args.skip_legacy else best_of(lambda: json.dumps(legacy_group_loop(df, today)), 1)
+        legacy_ms = f"{legacy * 1e3:10.1f}" if legacy is not None else f"{'-':>10}"
+        speedup = f"{legacy / vectorized:7.1f}x" if legacy is not None else f"{'-':>8}"
+        print(f"{n_rows:>8} {df['listing_id'].nunique():>9} {legacy_ms} {vectorized * 1e3:14.1f} {speedup}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Load test of the scraper (download_br, download_br_images) against the local replay server.
+
+Starts benchmarks/replay_server.py in-process, points NordVPNSession at it (SCRAPE_REPLAY_URL) and runs
+both downloaders once per concurrency setting, reporting pages/s and images/s with the response mix,
+retries, proxy rotations and requests that failed after all retries. Latency, error rate and 429 bursts are
+the replay server options; with faults injected, failures at concurrency > 1 show whether a rotation
+disturbs the requests still in flight.
+
+Usage: python benchmarks/load_test_scraper.py [--concurrency 1 4 8 16] [--listings 300] [--images 300]
+                                              [--latency-ms 150] [--error-rate 0.01] [--burst-rate 0.005]
+"""
+import argparse
+import asyncio
+import glob
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import pandas as pd
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+sys.path.insert(1, BENCH_DIR)
+os.environ.setdefault("METRICS_DIR", os.path.join(tempfile.gettempdir(), "housing_bench_metrics"))
+
+import replay_server  # noqa: E402
+
+RESULTS_DIR = os.path.join(BENCH_DIR, "results")
+
+
+def image_rows(n_images):
+    """images rows as download_br_images receives them, pointing at the replay server's image route"""
+    listing_ids = [100000 + i // 8 for i in range(n_images)]
+    return pd.DataFrame({
+        'id': range(1, n_images + 1),
+        'listing_id': [str(lid) for lid in listing_ids],
+        'filename': [f"{lid}{i % 8:02d}.webp" for i, lid in enumerate(listing_ids)],
+        'url': [f"https://api.bezrealitky.cz/media/cache/record_main/data/images/advert/{lid}/{lid}{i % 8:02d}.jpg"
+                for i, lid in enumerate(listing_ids)],
+        'downloaded': 0
+    })
+
+
+def http_summary(report):
+    counters = report['counters']
+    statuses = {key.split('"')[1]: value for key, value in counters.items() if key.startswith('http_requests{')}
+    rotations = sum(value for key, value in counters.items() if key.startswith('proxy_rotations'))
+    return {'responses': statuses, 'retries': counters.get('http_retries', 0),
+            'rotations': rotations, 'failures': counters.get('http_failures', 0)}
+
+
+def run_listings(concurrency, workdir):
+    from downloadsV2 import download_br
+    from metrics_operations import metrics
+    mains, listings = os.path.join(workdir, "mains"), os.path.join(workdir, "listings")
+    os.makedirs(mains)
+    os.makedirs(listings)
+    os.environ["FILE_MANIFEST"] = os.path.join(workdir, "file_manifest.sqlite")
+    metrics.reset()
+    started = time.perf_counter()
+    asyncio.run(download_br(mains, listings, concurrency=concurrency))
+    seconds = time.perf_counter() - started
+    # The first search page is fetched twice (page count, then saved)
+    pages = (len(glob.glob(os.path.join(mains, "*", "*"))) + 1
+             + len(glob.glob(os.path.join(listings, "*", "*"))))
+    return {'seconds': seconds, 'items': pages, 'unit': 'pages', **http_summary(metrics.report())}
+
+
+def run_images(concurrency, workdir, n_images):
+    from downloadsV2 import download_br_images
+    from metrics_operations import metrics
+    images = os.path.join(workdir, "images")
+    os.makedirs(images)
+    rows = image_rows(n_images)
+    metrics.reset()
+    started = time.perf_counter()
+    asyncio.run(download_br_images(rows, images, concurrency=concurrency))
+    seconds = time.perf_counter() - started
+    return {'seconds': seconds, 'items': int((rows['downloaded'] == 1).sum()), 'unit': 'images',
+            **http_summary(metrics.report())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    parser.add_argument("--images", type=int, default=300, help="Images downloaded per run")
+    parser.add_argument("--no-save", action="store_true", help="Do not store the results")
+    replay_server.add_arguments(parser)
+    args = parser.parse_args()
+    # download_br only fetches the first search page, so every listing goes on it
+    args.per_page = max(args.per_page, args.listings)
+
+    content, faults = replay_server.from_arguments(args)
+    server, url = replay_server.start_server(0, content, faults)
+    os.environ["SCRAPE_REPLAY_URL"] = url
+    print(f"Replay server on {url}")
+
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            with tempfile.TemporaryDirectory() as workdir:
+                print(f"Concurrency {concurrency}: listings...")
+                listings = run_listings(concurrency, workdir)
+                print(f"Concurrency {concurrency}: images...")
+                images = run_images(concurrency, workdir, args.images)
+            for stage, result in (('download_br', listings), ('download_br_images', images)):
+                result.update(stage=stage, concurrency=concurrency,
+                              per_second=result['items'] / result['seconds'] if result['seconds'] else None)
+                results.append(result)
+    finally:
+        server.shutdown()
+
+    print(f"\n{'stage':<20} {'conc':>5} {'seconds':>9} {'rate':>16} {'retries':>8} {'rotations':>9} {'failures':>8}  responses")
+    for r in results:
+        rate = f"{r['per_second']:.1f} {r['unit']}/s" if r['per_second'] else '-'
+        print(f"{r['stage']:<20} {r['concurrency']:>5} {r['seconds']:9.2f} {rate:>16} {r['retries']:>8} "
+              f"{r['rotations']:>9} {r['failures']:>8}  "
+              f"{json.dumps(r['responses'])}")
+
+    if not args.no_save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        path = os.path.join(RESULTS_DIR, f"load_test_scraper_{datetime.now():%Y%m%d_%H%M%S}.json")
+        params = {k: getattr(args, k) for k in ('listings', 'images', 'latency_ms', 'jitter_ms', 'error_rate',
+                                                'burst_rate', 'burst_length', 'noise_kb', 'corpus')}
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({'created_at': datetime.now().isoformat(timespec='seconds'), 'params': params,
+                       'results': results}, f, indent=2)
+        print(f"Results stored in {path}")
+
+
+if __name__ == "__main__":
+    main()
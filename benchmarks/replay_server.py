@@ -0,0 +1,206 @@
+"""
+Local stand-in for bezrealitky.cz and its image CDN, for benchmarking the scraper without network access.
+
+NordVPNSession sends every request here when SCRAPE_REPLAY_URL is set (e.g. http://127.0.0.1:8765),
+as <replay url>/<original host><original path>. Served content:
+  /www.bezrealitky.cz/vyhledat?...&page=N          search page N
+  /www.bezrealitky.cz/nemovitosti-byty-domy/<uri>  listing page of the listing id the uri starts with
+  /<image host>/...                                a JPEG image
+Pages come from a recorded corpus (--corpus, folders 'mains' and 'listings' as saved by download_br)
+when given, otherwise they are generated (benchmarks/synthetic.py).
+
+Faults: response latency (mean and jitter), a share of 500 errors, and bursts of 429 responses
+(each request starts a burst with --burst-rate, the burst answers the next --burst-length requests with 429).
+
+Usage: python benchmarks/replay_server.py [--port 8765] [--listings 300] [--latency-ms 150] [--error-rate 0.01]
+                                          [--burst-rate 0.005] [--burst-length 20] [--corpus DIR]
+"""
+import argparse
+import glob
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import synthetic  # noqa: E402
+
+
+class ReplayContent:
+    """Search pages, listing pages and image bytes, recorded or synthetic"""
+
+    def __init__(self, listings=300, per_page=15, noise_kb=120, corpus=None):
+        self.per_page = per_page
+        self.noise_kb = noise_kb
+        self.n_listings = listings
+        self.recorded_search = {}
+        self.recorded_listings = {}
+        if corpus:
+            self._load_corpus(corpus)
+        self.image = self._jpeg()
+
+    def _load_corpus(self, corpus):
+        # Flat folders or per-day subdirectories
+        for path in sorted(glob.glob(os.path.join(corpus, "mains", "**", "*_*"), recursive=True)):
+            page = int(re.search(r"_(\d+)", os.path.basename(path)).group(1))
+            with open(path, "rb") as f:
+                self.recorded_search[page] = f.read()
+        for path in glob.glob(os.path.join(corpus, "listings", "**", "*_*"), recursive=True):
+            with open(path, "rb") as f:
+                content = f.read()
+            match = re.search(rb'"uri":\s*"(\d+)', content)
+            if match:
+                self.recorded_listings[int(match.group(1))] = content
+        print(f"Corpus: {len(self.recorded_search)} search pages, {len(self.recorded_listings)} listing pages")
+
+    @staticmethod
+    def _jpeg():
+        from PIL import Image
+        rng = np.random.default_rng(0)
+        pixels = rng.integers(0, 255, (480, 640, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, "JPEG", quality=80)
+        return buffer.getvalue()
+
+    def search_page(self, page):
+        if self.recorded_search:
+            return self.recorded_search.get(page)
+        first = (page - 1) * self.per_page
+        ids = range(100000 + first, 100000 + min(first + self.per_page, self.n_listings))
+        return synthetic.search_page(ids, self.n_listings, seed=page).encode("utf-8")
+
+    def listing_page(self, listing_id):
+        if self.recorded_listings:
+            return self.recorded_listings.get(listing_id)
+        rng = np.random.default_rng(listing_id)
+        return synthetic.listing_page(rng, listing_id, self.noise_kb).encode("utf-8")
+
+
+class FaultInjector:
+    """Latency, random 500 errors and 429 bursts, shared by all handler threads"""
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, burst_rate=0.0, burst_length=0, seed=0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.burst_rate = burst_rate
+        self.burst_length = burst_length
+        self._rng = np.random.default_rng(seed)
+        self._lock = threading.Lock()
+        self._burst_left = 0
+        self.counts = {}
+
+    def decide(self):
+        """Returns (delay seconds, forced status or None)"""
+        with self._lock:
+            delay = max(0.0, self.latency_ms + self._rng.normal(0, self.jitter_ms)) / 1000 if self.latency_ms else 0.0
+            if self._burst_left == 0 and self._rng.random() < self.burst_rate:
+                self._burst_left = self.burst_length
+            if self._burst_left:
+                self._burst_left -= 1
+                status = 429
+            elif self._rng.random() < self.error_rate:
+                status = 500
+            else:
+                status = None
+            return delay, status
+
+    def count(self, status):
+        with self._lock:
+            self.counts[status] = self.counts.get(status, 0) + 1
+
+
+def make_handler(content, faults):
+    class ReplayHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status, body=b"", content_type="text/html; charset=utf-8"):
+            faults.count(status)
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            if status == 429:
+                self.send_header("Retry-After", "1")
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            delay, status = faults.decide()
+            if delay:
+                time.sleep(delay)
+            if status:
+                return self._send(status, f"Simulated {status}".encode())
+
+            parts = urlsplit(self.path)
+            host, _, path = parts.path.lstrip("/").partition("/")
+            body = None
+            content_type = "text/html; charset=utf-8"
+            if host == "www.bezrealitky.cz" and path.startswith("vyhledat"):
+                page = int(parse_qs(parts.query).get("page", ["1"])[0])
+                body = content.search_page(page)
+            elif host == "www.bezrealitky.cz" and path.startswith("nemovitosti-byty-domy/"):
+                match = re.match(r"(\d+)", path.split("/", 1)[1])
+                body = content.listing_page(int(match.group(1))) if match else None
+            elif re.search(r"\.(jpe?g|png|webp)$", path):
+                body, content_type = content.image, "image/jpeg"
+            if body is None:
+                return self._send(404, b"Not found")
+            self._send(200, body, content_type)
+
+    return ReplayHandler
+
+
+def start_server(port=0, content=None, faults=None):
+    """Starts the server in a daemon thread; returns (server, base url)"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(content or ReplayContent(), faults or FaultInjector()))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def add_arguments(parser):
+    parser.add_argument("--listings", type=int, default=300, help="Listings in the synthetic search results")
+    parser.add_argument("--per-page", type=int, default=15)
+    parser.add_argument("--noise-kb", type=int, default=120)
+    parser.add_argument("--corpus", help="Folder with recorded 'mains' and 'listings' pages")
+    parser.add_argument("--latency-ms", type=float, default=150)
+    parser.add_argument("--jitter-ms", type=float, default=50)
+    parser.add_argument("--error-rate", type=float, default=0.01)
+    parser.add_argument("--burst-rate", type=float, default=0.005)
+    parser.add_argument("--burst-length", type=int, default=20)
+
+
+def from_arguments(args):
+    content = ReplayContent(args.listings, args.per_page, args.noise_kb, args.corpus)
+    faults = FaultInjector(args.latency_ms, args.jitter_ms, args.error_rate, args.burst_rate, args.burst_length)
+    return content, faults
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    content, faults = from_arguments(args)
+    server, url = start_server(args.port, content, faults)
+    print(f"Replay server on {url} (set SCRAPE_REPLAY_URL={url})")
+    try:
+        while True:
+            time.sleep(10)
+            print(f"Responses so far: {json.dumps(faults.counts)}")
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
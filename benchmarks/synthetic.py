@@ -0,0 +1,211 @@
+"""
+Synthetic fixtures for the offline benchmarks: bezrealitky-style pages and a properties/images dataset.
+
+Listing pages carry a __NEXT_DATA__ script with the origAdvert and apolloCache structure extract_detail and
+extract_images read, wrapped in the header, navigation, inline SVG, styles and scripts trim_html removes.
+Search pages carry the apolloCache Advert entries get_listing_urls reads and the totalCount get_page_n reads.
+The dataset generator produces properties rows (several observations per listing) and images rows in
+chunks, so SQLite databases from 10k to 10M rows can be built without holding them in memory.
+"""
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+DISPOSITIONS = ['DISP_1_KK', 'DISP_1_1', 'DISP_2_KK', 'DISP_2_1', 'DISP_3_KK', 'DISP_3_1', 'DISP_4_KK']
+STREETS = ['Vinohradská', 'Korunní', 'Francouzská', 'Slezská', 'Táborská', 'Na Pankráci', 'Bělehradská',
+           'Milady Horákové', 'Jugoslávských partyzánů', 'Plzeňská', 'Sokolovská', 'Koněvova']
+WORDS = np.array([f"slovo{i}" for i in range(3000)])
+TAGS = ['Balkón', 'Výtah', 'Sklep', 'Parkování', 'Terasa', 'Novostavba', 'Vybavený']
+
+# Prague-sized area the listings are spread over
+LAT_RANGE = (49.95, 50.15)
+LNG_RANGE = (14.25, 14.65)
+
+
+def _noise(rng, size_kb):
+    """Markup like the parts of a real page trim_html strips: header, nav, svg icons, styles, scripts"""
+    blocks = [
+        "<header><div class='Header_headerLogo__4edC_'><svg viewBox='0 0 10 10'><path d='M0 0L10 10'/></svg></div>"
+        "<nav><a href='/'>Hledat</a><a href='/vlozit'>Vložit inzerát</a></nav></header>"
+    ]
+    written = 0
+    while written < size_kb * 1024:
+        kind = rng.integers(4)
+        if kind == 0:
+            block = "<svg viewBox='0 0 24 24'>" + "".join(
+                f"<path d='M{rng.integers(100)} {rng.integers(100)}L{rng.integers(100)} {rng.integers(100)}'/>" for _ in range(20)) + "</svg>"
+        elif kind == 1:
+            block = "<style>" + "".join(f".c{rng.integers(10**6)}{{margin:{rng.integers(40)}px}}" for _ in range(30)) + "</style>"
+        elif kind == 2:
+            block = "<script>window.__x" + str(rng.integers(10**6)) + "=" + json.dumps(list(map(int, rng.integers(0, 1000, 60)))) + "</script>"
+        else:
+            block = f"<div style='background:url(data:image/png;base64,{'A' * 200})' class='PromoCard_x'>Promo</div>"
+        blocks.append(block)
+        written += len(block)
+    blocks.append("<section><h2>Podobné nemovitosti</h2>" + "<div class='card'>x</div>" * 20 + "</section>")
+    blocks.append("<section id='mapa'><h2>V okolí nemovitosti najdete</h2></section>")
+    blocks.append("<footer><div class='Footer_footerLogo__mHj_P'></div><div class='ContactBox_x'>Rádi vám poradíme</div></footer>")
+    return "".join(blocks)
+
+
+def synthetic_advert(rng, listing_id, n_images=8):
+    """origAdvert dict and the apolloCache image entries it references"""
+    disposition = str(rng.choice(DISPOSITIONS))
+    uri = f"{listing_id}-nabidka-pronajem-bytu-{STREETS[listing_id % len(STREETS)].lower().replace(' ', '-')}-praha"
+    images = {f"Image:{listing_id}{n:02d}": {"__typename": "Image",
+                                            "url": f"https://api.bezrealitky.cz/media/cache/record_main/data/images/advert/{listing_id}/{listing_id}{n:02d}.jpg"}
+              for n in range(n_images)}
+    advert = {
+        "id": str(listing_id),
+        "uri": uri,
+        "price": int(rng.integers(8, 45)) * 1000,
+        "utilityCharges": int(rng.integers(1, 6)) * 500 if rng.random() < 0.8 else None,
+        "serviceCharges": int(rng.integers(1, 5)) * 400 if rng.random() < 0.6 else None,
+        "fee": int(rng.integers(0, 2)) * 10000,
+        "description": ' '.join(rng.choice(WORDS, int(rng.integers(60, 200)))),
+        "surface": int(rng.integers(18, 140)),
+        "disposition": disposition,
+        "address": f"{STREETS[listing_id % len(STREETS)]} {int(rng.integers(1, 200))}, Praha",
+        "tags": list(rng.choice(TAGS, int(rng.integers(0, 4)), replace=False)),
+        "availableFrom": int((datetime(2026, 1, 1) + timedelta(days=int(rng.integers(0, 120)))).timestamp()),
+        "gps": {"lat": float(rng.uniform(*LAT_RANGE)), "lng": float(rng.uniform(*LNG_RANGE))},
+        "publicImages": [{"__ref": key} for key in images]
+    }
+    return advert, images
+
+
+def listing_page(rng, listing_id, noise_kb=120):
+    """Full listing page HTML as downloaded (before trim_html)"""
+    advert, images = synthetic_advert(rng, listing_id)
+    next_data = {"props": {"pageProps": {"origAdvert": advert, "apolloCache": images}}, "page": "/nemovitosti-byty-domy/[uri]"}
+    return ("<!DOCTYPE html><html><head><title>Pronájem bytu</title>"
+            "<link rel='stylesheet' href='/_next/static/css/app.css'><link rel='apple-touch-icon' href='/icon.png'></head><body>"
+            f"{_noise(rng, noise_kb)}"
+            f"<main><h1>Pronájem bytu {advert['disposition']}</h1><p>{advert['description']}</p></main>"
+            f"<script id=\"__NEXT_DATA__\" type=\"application/json\">{json.dumps(next_data)}</script>"
+            "</body></html>")
+
+
+def search_page(listing_ids, total_count, noise_kb=60, seed=0):
+    """Search results page: apolloCache with one Advert entry per listing and the result count"""
+    rng = np.random.default_rng(seed)
+    cache = {
+        "ROOT_QUERY": {
+            "__typename": "Query",
+            "me": None,
+            'listAdverts({"offerType":"PRONAJEM","estateType":"BYT"})': {"totalCount": total_count, "list": [
+                {"__ref": f"Advert:{lid}"} for lid in listing_ids]}
+        }
+    }
+    for lid in listing_ids:
+        cache[f"Advert:{lid}"] = {"__typename": "Advert", "id": str(lid),
+                                  "uri": f"{lid}-nabidka-pronajem-bytu-praha"}
+    next_data = {"props": {"pageProps": {"apolloCache": cache}}}
+    return (f"<!DOCTYPE html><html><body>{_noise(rng, noise_kb)}"
+            f"<script id=\"__NEXT_DATA__\" type=\"application/json\">{json.dumps(next_data)}</script></body></html>")
+
+
+def write_listing_corpus(folder, n_pages, day=None, noise_kb=120, seed=0):
+    """Writes n_pages listing pages named like the downloader does (<yymmdd>_<n>), returns their paths"""
+    rng = np.random.default_rng(seed)
+    day = day or datetime.today()
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(1, n_pages + 1):
+        path = os.path.join(folder, f"{day.strftime('%y%m%d')}_{i}")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(listing_page(rng, 900000 + i, noise_kb))
+        paths.append(path)
+    return paths
+
+
+def properties_chunks(n_rows, rows_per_listing=4, chunk_rows=500000, days=365, seed=0):
+    """
+    Yields (properties, images) DataFrame chunks totalling n_rows properties rows.
+    Each listing has about rows_per_listing observations over the last `days` days, the newest one today
+    for roughly a third of the listings (available).
+    """
+    rng = np.random.default_rng(seed)
+    today = datetime.now().date()
+    n_listings = max(n_rows // rows_per_listing, 1)
+    # Static attributes per listing
+    lat = np.round(rng.uniform(*LAT_RANGE, n_listings), 5)
+    lng = np.round(rng.uniform(*LNG_RANGE, n_listings), 5)
+    area = rng.integers(18, 140, n_listings).astype(float)
+    disposition = rng.choice([d.replace('DISP_', '').replace('_', '+').replace('KK', 'kk') for d in DISPOSITIONS], n_listings)
+    rent = rng.integers(8, 45, n_listings) * 1000
+    last_day = np.where(rng.random(n_listings) < 0.33, 0, rng.integers(1, days, n_listings))
+
+    produced = 0
+    next_image = 1
+    while produced < n_rows:
+        size = min(chunk_rows, n_rows - produced)
+        listing = rng.integers(0, n_listings, size)
+        # Newest observation of a listing on its last_day, others spread before it
+        age = last_day[listing] + np.where(rng.random(size) < 1.0 / rows_per_listing, 0, rng.integers(0, days, size))
+        dates = pd.to_datetime(today) - pd.to_timedelta(age, unit='D')
+        ids = (100000 + listing).astype(np.int64)
+        price_change = rng.integers(-2, 3, size) * 500
+        props = pd.DataFrame({
+            'listing_id': ids.astype(str),
+            'URL': [f"https://www.bezrealitky.cz/nemovitosti-byty-domy/{i}-nabidka" for i in ids],
+            'Address': np.char.add(np.array(STREETS)[listing % len(STREETS)], ", Praha"),
+            'Disposition': disposition[listing],
+            'Area (m2)': area[listing],
+            'Rent (CZK)': (rent[listing] + price_change).astype(float),
+            'Utilities (CZK)': np.where(rng.random(size) < 0.2, np.nan, 2500.0),
+            'Services (CZK)': np.where(rng.random(size) < 0.5, np.nan, 800.0),
+            'Fee': np.where(rng.random(size) < 0.7, 0.0, 10000.0),
+            'Available from': None,
+            'Tags': '',
+            'Description': None,
+            'Latitude': lat[listing],
+            'Longitude': lng[listing],
+            'Source file': [f"{d:%y%m%d}_{n}" for d, n in zip(dates, range(size))],
+            'bb_object_name': [f"br/htmls/listings/{d:%y%m%d}/{i}.html" for d, i in zip(dates, ids)],
+            'Date obtained': dates.date,
+            'Description hash': None
+        })
+        # About two images per properties row, so the images table scales with the dataset
+        n_img = size * 2
+        img_listing = ids[rng.integers(0, size, n_img)]
+        images = pd.DataFrame({
+            'id': np.arange(next_image, next_image + n_img),
+            'listing_id': img_listing.astype(str),
+            'filename': [f"{i}{n % 100:02d}.webp" for i, n in zip(img_listing, range(n_img))],
+            'object_name': [f"br/images/{str(i)[:3]}/{i}/{i}{n % 100:02d}.webp" for i, n in zip(img_listing, range(n_img))],
+            'url': [f"https://api.bezrealitky.cz/media/{i}{n % 100:02d}.jpg" for i, n in zip(img_listing, range(n_img))],
+            'downloaded': np.where(rng.random(n_img) < 0.9, 3, 0)
+        })
+        next_image += n_img
+        produced += size
+        yield props, images
+
+
+def build_sqlite_db(path, n_rows, rows_per_listing=4, seed=0):
+    """Creates (or reuses) a SQLite file with properties, images and an empty descriptions table"""
+    from sqlalchemy import create_engine, text, inspect
+
+    engine = create_engine(f"sqlite:///{path}")
+    if os.path.exists(path) and inspect(engine).has_table('properties'):
+        with engine.connect() as conn:
+            if conn.execute(text("SELECT COUNT(*) FROM properties")).scalar() == n_rows:
+                return engine
+        engine.dispose()
+        os.remove(path)
+        engine = create_engine(f"sqlite:///{path}")
+
+    for props, images in properties_chunks(n_rows, rows_per_listing, seed=seed):
+        props.to_sql('properties', engine, if_exists='append', index=False)
+        images.to_sql('images', engine, if_exists='append', index=False)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS descriptions (description_hash TEXT PRIMARY KEY, Description TEXT)"))
+        # Same composite indexes as schema_operations.PROPERTIES_INDEXES (SQLite has no functional key parts here)
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_id_date ON properties (listing_id, `Date obtained`)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_coords_date ON properties (Latitude, Longitude, `Date obtained`)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_disposition ON properties (Disposition)"))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS idx_images_listing ON images (listing_id)"))
+    return engine
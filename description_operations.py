@@ -0,0 +1,257 @@
+import hashlib
+import re
+import zlib
+import numpy as np
+import pandas as pd
+from sqlalchemy import text, inspect
+from sqlalchemy.types import LargeBinary
+
+### Description store ###
+# Description text is kept once per distinct text in the 'descriptions' table, keyed by its SHA-1.
+# properties rows carry only `Description hash`; readers join descriptions to get the text.
+# Every description also gets a MinHash signature and LSH buckets ('description_lsh'), so near-duplicate
+# descriptions (re-posted adverts with small edits) are found by bucket lookups instead of pairwise comparison.
+
+# MinHash: word 3-shingles hashed with crc32, 64 permutations of the form (a * h + b) mod p.
+# The seed is fixed so signatures stored in the database stay comparable across runs.
+MINHASH_PERMUTATIONS = 64
+SHINGLE_WORDS = 3
+_MERSENNE_PRIME = (1 << 31) - 1
+_permutation_rng = np.random.default_rng(31337)
+_MINHASH_A = _permutation_rng.integers(1, _MERSENNE_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+_MINHASH_B = _permutation_rng.integers(0, _MERSENNE_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+# Signature of an empty description, no real shingle hashes to this value
+EMPTY_MINHASH = _MERSENNE_PRIME
+
+# LSH: 16 bands of 4 rows. Pairs with Jaccard similarity 0.5 share a bucket with probability ~64%, at 0.8 ~99.9%
+LSH_BANDS = 16
+LSH_ROWS = MINHASH_PERMUTATIONS // LSH_BANDS
+# Bucket collisions are confirmed against the full signatures
+NEAR_DUPLICATE_MIN_SIMILARITY = 0.8
+
+MIGRATION_CHUNK_SIZE = 10000
+
+
+def description_hash(description):
+    """SHA-1 hex digest of a description, None for missing text"""
+    if not isinstance(description, str):
+        return None
+    return hashlib.sha1(description.encode('utf-8')).hexdigest()
+
+
+def description_signature(description):
+    """MinHash signature (uint32 array of MINHASH_PERMUTATIONS) of a description's word shingles"""
+    words = re.findall(r'\w+', description.lower()) if isinstance(description, str) else []
+    if not words:
+        return np.full(MINHASH_PERMUTATIONS, EMPTY_MINHASH, dtype=np.uint32)
+    if len(words) < SHINGLE_WORDS:
+        shingles = {' '.join(words)}
+    else:
+        shingles = {' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+    hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), np.uint64, len(shingles)) % _MERSENNE_PRIME
+    signature = ((_MINHASH_A[:, None] * hashes[None, :] + _MINHASH_B[:, None]) % _MERSENNE_PRIME).min(axis=1)
+    return signature.astype(np.uint32)
+
+
+def signature_bytes(description):
+    """MinHash signature serialized for storage"""
+    return description_signature(description).astype('<u4').tobytes()
+
+
+def signature_matrix(blobs):
+    """Stacks signatures stored as bytes into an (n, MINHASH_PERMUTATIONS) uint32 array"""
+    if len(blobs) == 0:
+        return np.empty((0, MINHASH_PERMUTATIONS), dtype=np.uint32)
+    return np.frombuffer(b''.join(blobs), dtype='<u4').reshape(len(blobs), MINHASH_PERMUTATIONS)
+
+
+def signature_similarity(a, b):
+    """Estimated Jaccard similarity of paired signature rows, 0 where either description is empty"""
+    similarity = (a == b).mean(axis=1)
+    empty = (a[:, 0] == EMPTY_MINHASH) | (b[:, 0] == EMPTY_MINHASH)
+    return np.where(empty, 0.0, similarity)
+
+
+def lsh_buckets(hashes, blobs):
+    """LSH rows (description_hash, band, bucket) for signatures, empty descriptions get no buckets"""
+    signatures = signature_matrix(blobs)
+    keep = signatures[:, 0] != EMPTY_MINHASH
+    signatures = signatures[keep]
+    hashes = np.asarray(hashes, dtype=object)[keep]
+    rows = []
+    for band in range(LSH_BANDS):
+        band_values = np.ascontiguousarray(signatures[:, band * LSH_ROWS:(band + 1) * LSH_ROWS])
+        buckets = [zlib.crc32(row.tobytes()) for row in band_values]
+        rows.append(pd.DataFrame({'description_hash': hashes, 'band': band, 'bucket': buckets}))
+    return pd.concat(rows, ignore_index=True) if rows else pd.DataFrame(columns=['description_hash', 'band', 'bucket'])
+
+
+def add_description_columns(df):
+    """Adds `Description hash` and `Description minhash` columns to extracted listing rows"""
+    df['Description hash'] = [description_hash(d) for d in df['Description']]
+    df['Description minhash'] = [signature_bytes(d) if isinstance(d, str) else None for d in df['Description']]
+    return df
+
+
+def _create_description_tables(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS descriptions (
+            description_hash CHAR(40) NOT NULL PRIMARY KEY,
+            Description MEDIUMTEXT NOT NULL,
+            minhash BLOB,
+            first_seen DATE,
+            near_duplicate_of CHAR(40),
+            near_duplicate_similarity DOUBLE
+        );
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS description_lsh (
+            band TINYINT NOT NULL,
+            bucket INT UNSIGNED NOT NULL,
+            description_hash CHAR(40) NOT NULL,
+            PRIMARY KEY (band, bucket, description_hash)
+        );
+    """))
+
+
+def ensure_description_schema(engine):
+    """Creates the description tables and the `Description hash` column of properties if missing"""
+    with engine.begin() as conn:
+        _create_description_tables(conn)
+    inspector = inspect(engine)
+    if not inspector.has_table('properties'):
+        return
+    columns = [col['name'] for col in inspector.get_columns('properties')]
+    if 'Description hash' not in columns:
+        print("Adding column `Description hash` to properties")
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE properties ADD COLUMN `Description hash` CHAR(40) NULL"))
+
+
+def _link_near_duplicates(conn, lsh_table):
+    """
+    For every description with buckets in lsh_table, finds the most similar other description sharing
+    an LSH bucket and records it in near_duplicate_of when the full signatures confirm the match.
+    Only bucket mates are compared, so the cost grows with the number of collisions rather than n².
+    """
+    candidates = pd.read_sql(text(f"""
+        SELECT c.a, c.b, da.minhash AS minhash_a, db.minhash AS minhash_b
+        FROM (
+            SELECT DISTINCT s.description_hash AS a, l.description_hash AS b
+            FROM {lsh_table} s
+            INNER JOIN description_lsh l ON l.band = s.band AND l.bucket = s.bucket
+            WHERE l.description_hash != s.description_hash
+        ) c
+        INNER JOIN descriptions da ON da.description_hash = c.a
+        INNER JOIN descriptions db ON db.description_hash = c.b
+    """), conn)
+    if candidates.empty:
+        return 0
+
+    candidates['similarity'] = signature_similarity(signature_matrix(candidates['minhash_a'].map(bytes).to_list()),
+                                                    signature_matrix(candidates['minhash_b'].map(bytes).to_list()))
+    best = (candidates[candidates['similarity'] >= NEAR_DUPLICATE_MIN_SIMILARITY]
+            .sort_values('similarity', ascending=False, kind='stable').drop_duplicates('a'))
+    if not best.empty:
+        conn.execute(text("""
+            UPDATE descriptions SET near_duplicate_of = :b, near_duplicate_similarity = :similarity
+            WHERE description_hash = :a
+        """), [{'a': a, 'b': b, 'similarity': float(sim)} for a, b, sim in best[['a', 'b', 'similarity']].itertuples(index=False)])
+    return len(best)
+
+
+def _stage_new_descriptions(engine, staging):
+    """Writes staging rows and returns those whose hash is not yet in descriptions, with their LSH rows staged"""
+    staging.to_sql("descriptions_staging", engine, if_exists="replace", index=False, dtype={'minhash': LargeBinary})
+    with engine.connect() as conn:
+        stored = pd.read_sql(text("""
+            SELECT s.description_hash FROM descriptions_staging s
+            INNER JOIN descriptions d ON d.description_hash = s.description_hash
+        """), conn)
+    new = staging[~staging['description_hash'].isin(stored['description_hash'])]
+    lsh_buckets(new['description_hash'], new['minhash'].to_list()).to_sql(
+        "description_lsh_staging", engine, if_exists="replace", index=False)
+    return new
+
+
+def store_descriptions(engine, df_today):
+    """
+    Daily step: stores each distinct description of df_today once, with its MinHash signature and LSH buckets,
+    and links new descriptions to near-duplicates already stored (or among today's).
+    Expects the columns added by add_description_columns.
+    """
+    df = df_today.dropna(subset=['Description hash']).drop_duplicates('Description hash')
+    staging = pd.DataFrame({
+        'description_hash': df['Description hash'],
+        'Description': df['Description'],
+        'minhash': df['Description minhash'],
+        'first_seen': df['Date obtained']
+    })
+    new = _stage_new_descriptions(engine, staging)
+
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT IGNORE INTO descriptions (description_hash, Description, minhash, first_seen)
+            SELECT description_hash, Description, minhash, first_seen FROM descriptions_staging;
+        """))
+        conn.execute(text("""
+            INSERT IGNORE INTO description_lsh (band, bucket, description_hash)
+            SELECT band, bucket, description_hash FROM description_lsh_staging;
+        """))
+        linked = _link_near_duplicates(conn, "description_lsh_staging")
+    print(f"Descriptions: {len(staging)} distinct today, {len(new)} new, {linked} near-duplicates of stored text")
+
+
+def migrate_descriptions(engine):
+    """
+    One-off migration of an existing properties table to the description store:
+    hashes every stored description (MySQL SHA1 over the utf8mb4 text equals hashlib.sha1 over UTF-8),
+    copies each distinct text into descriptions, computes signatures and LSH buckets in chunks,
+    links near-duplicates, and finally clears the duplicated text from properties.
+    """
+    ensure_description_schema(engine)
+    print("Hashing descriptions in properties")
+    with engine.begin() as conn:
+        conn.execute(text("""
+            UPDATE properties SET `Description hash` = SHA1(Description)
+            WHERE `Description hash` IS NULL AND Description IS NOT NULL;
+        """))
+        conn.execute(text("""
+            INSERT IGNORE INTO descriptions (description_hash, Description, first_seen)
+            SELECT `Description hash`, ANY_VALUE(Description), MIN(`Date obtained`)
+            FROM properties
+            WHERE `Description hash` IS NOT NULL AND Description IS NOT NULL
+            GROUP BY `Description hash`;
+        """))
+
+    total = 0
+    while True:
+        with engine.connect() as conn:
+            chunk = pd.read_sql(text("SELECT description_hash, Description FROM descriptions WHERE minhash IS NULL LIMIT :n"),
+                                conn, params={'n': MIGRATION_CHUNK_SIZE})
+        if chunk.empty:
+            break
+        chunk['minhash'] = [signature_bytes(d) for d in chunk['Description']]
+        chunk[['description_hash', 'minhash']].to_sql("descriptions_staging", engine, if_exists="replace", index=False,
+                                                      dtype={'minhash': LargeBinary})
+        lsh_buckets(chunk['description_hash'], chunk['minhash'].to_list()).to_sql(
+            "description_lsh_staging", engine, if_exists="replace", index=False)
+        with engine.begin() as conn:
+            conn.execute(text("""
+                UPDATE descriptions d
+                INNER JOIN descriptions_staging s ON s.description_hash = d.description_hash
+                SET d.minhash = s.minhash;
+            """))
+            conn.execute(text("""
+                INSERT IGNORE INTO description_lsh (band, bucket, description_hash)
+                SELECT band, bucket, description_hash FROM description_lsh_staging;
+            """))
+        total += len(chunk)
+        print(f"Signed {total} descriptions")
+
+    with engine.begin() as conn:
+        linked = _link_near_duplicates(conn, "description_lsh")
+        result = conn.execute(text("UPDATE properties SET Description = NULL WHERE `Description hash` IS NOT NULL"))
+    print(f"Description store migrated: {total} descriptions, {linked} near-duplicates, "
+          f"text cleared from {result.rowcount} properties rows")
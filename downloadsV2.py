@@ -2,7 +2,9 @@
 
 import asyncio
 from nord_session import with_nord_session
+from metrics_operations import metrics
 from html_operations import get_listing_urls, trim_html
+from file_manifest_operations import get_manifest, day_folder
 # from bezrealitky import get_page_n
 from pathlib import Path
 from datetime import datetime
@@ -12,6 +14,19 @@ from bs4 import BeautifulSoup
 from PIL import Image
 import io
 
+# Requests in flight at once when downloading listings and images (one session, shared)
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "1"))
+
+
+async def gather_limited(coroutines, concurrency):
+    """Runs the coroutines with at most 'concurrency' of them awaiting at a time"""
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def limited(coroutine):
+        async with semaphore:
+            return await coroutine
+    return await asyncio.gather(*(limited(c) for c in coroutines), return_exceptions=True)
+
 def get_page_n(content):
     soup = BeautifulSoup(content.content,"html.parser") #! Need to add content.html.html to extract directly from a request.
     # soup = BeautifulSoup(content, "html.parser") # Temp for offline file parsing
@@ -25,8 +40,9 @@ def get_page_n(content):
     pages_n = int(total_ads/15) + (total_ads%15>0)
     return pages_n
 
+@metrics.timed_stage('download_br')
 @with_nord_session
-async def download_br(f_mains, f_listings, nord=None):
+async def download_br(f_mains, f_listings, nord=None, concurrency=None):
 
     page_n=0
     try:
@@ -42,6 +58,9 @@ async def download_br(f_mains, f_listings, nord=None):
         print(f"Number of pages to get: {page_n}")
 
     if page_n:
+        manifest = get_manifest()
+        mains_day = day_folder(f_mains)
+        listings_day = day_folder(f_listings)
         try:
             for page in range(
                     1 # FOR TESTING if I want to run only 1 page. Otherwise use below.
@@ -51,8 +70,11 @@ async def download_br(f_mains, f_listings, nord=None):
                 url = template_url+str(page)
                 page_raw = await nord.get(url)
                 if page_raw:
-                    with open(f"{f_mains}/{datetime.today().strftime('%y%m%d')}_{page}", "wb+") as f:
+                    path = f"{mains_day}/{datetime.today().strftime('%y%m%d')}_{page}"
+                    with open(path, "wb+") as f:
                         f.write(page_raw.content)
+                    manifest.register(path, f_mains)
+                    metrics.inc('pages_downloaded')
                     print(f"Page {page} saved")
         except Exception as e:
             print(f"Error: {e}")
@@ -63,24 +85,34 @@ async def download_br(f_mains, f_listings, nord=None):
         print(f"There are {len(urls)} within f_main htmls that will be processed.")
 
         if urls:
+            def save_listing(i, content):
+                path = f"{listings_day}/{datetime.today().strftime('%y%m%d')}_{i}"
+                try:
+                    soup = BeautifulSoup(content, "html.parser")
+                    soup = trim_html(soup)
+
+                    with open(path, "w", encoding="utf-8") as f:
+                        f.write(str(soup))
+                except Exception as e:
+                    print(f"Error processing HTML for listing {i}: {e}. Saving raw content.")
+                    with open(path, "wb+") as f:
+                        f.write(content)
+                manifest.register(path, f_listings)
+
+            async def download_listing(i, url):
+                page_raw = await nord.get(url)
+                if page_raw:
+                    # Parsing off the event loop, so other requests keep going meanwhile
+                    await asyncio.to_thread(save_listing, i, page_raw.content)
+                    metrics.inc('listings_downloaded')
+                    print(f"Listing {i} saved")
+
             try:
-                for i, url in enumerate(urls, 1):
-                    page_raw = await nord.get(url)
-                    if page_raw:
-                        try:
-                            soup = BeautifulSoup(page_raw.content, "html.parser")
-                            soup = trim_html(soup)
-
-                            with open(f"{f_listings}/{datetime.today().strftime('%y%m%d')}_{i}", "w", encoding="utf-8") as f:
-                                f.write(str(soup))
-                        except Exception as e:
-                            print(f"Error processing HTML for listing {i}: {e}. Saving raw content.")
-                            with open(f"{f_listings}/{datetime.today().strftime('%y%m%d')}_{i}", "wb+") as f:
-                                f.write(page_raw.content)
-
-                        print(f"Listing {i} saved")
-            except Exception as e:
-                print(f"Error {e}")
+                results = await gather_limited((download_listing(i, url) for i, url in enumerate(urls, 1)),
+                                               concurrency or DOWNLOAD_CONCURRENCY)
+                for result in results:
+                    if isinstance(result, Exception):
+                        print(f"Error {result}")
             finally:
                 print("Listings job complete")
 
@@ -96,9 +128,9 @@ def compress_and_save_webp(image_bytes, target_path):
     img.save(target_path, "WEBP", quality=70, method=4) # SET THE TARGET FORMAT OUTPUT (PLACE 2/2)
 
 @with_nord_session
-async def download_br_images(undownloaded_images, f_images, nord=None):
+async def download_br_images(undownloaded_images, f_images, nord=None, status_writer=None, concurrency=None):
 
-    for index in undownloaded_images.index:
+    async def download_image(index):
         url=undownloaded_images.at[index,"url"]
         filename=undownloaded_images.at[index,"filename"]
         listing_id=undownloaded_images.at[index,"listing_id"]
@@ -110,11 +142,22 @@ async def download_br_images(undownloaded_images, f_images, nord=None):
                     await asyncio.to_thread(compress_and_save_webp, image.content, save_path)
                     # Mark as locally downloaded in df (1)
                     undownloaded_images.at[index, "downloaded"] = 1
+                    metrics.inc('images_downloaded')
                     print(f"Image {listing_id}-{filename} saved")
                 else:
                     # Mark error'd downloads as 9 in sql
                     undownloaded_images.at[index, "downloaded"] = 9
+                    metrics.inc('images_failed')
+                    if status_writer:
+                        status_writer.record(undownloaded_images.at[index, "id"], 9)
                     print(f"Image {listing_id}-{filename} HAD AN ERROR DOWNLOADING. Marked as 9 in sql.")
             except Exception as e:
                 print(f"Error downloading {url}: {e}")
+                metrics.inc('images_failed')
+                undownloaded_images.at[index, "downloaded"] = 9
+                if status_writer:
+                    status_writer.record(undownloaded_images.at[index, "id"], 9)
+
+    await gather_limited((download_image(index) for index in undownloaded_images.index),
+                         concurrency or DOWNLOAD_CONCURRENCY)
     print("Images download job complete")
@@ -0,0 +1,135 @@
+import os
+import sqlite3
+import threading
+from datetime import datetime
+
+### File manifest ###
+# Downloaded pages are stored in per-day subdirectories (<folder>/<yymmdd>/<yymmdd>_<n>) and recorded in a local
+# SQLite manifest with their day and status, so the stages ask the manifest for "today's listings" or "mains not
+# yet uploaded" instead of globbing the whole folder and filtering by filename prefix.
+# Statuses: downloaded -> parsed (extracted) -> uploaded (in B2) -> deleted (removed locally after upload).
+# Files already on disk when a folder is first used (flat legacy layout included) are registered once by
+# ensure_scanned; after that the manifest is the source of truth and folders are never listed again.
+
+FILE_MANIFEST = "file_manifest.sqlite"
+STATUSES = ('downloaded', 'parsed', 'uploaded', 'deleted')
+ON_DISK = ('downloaded', 'parsed', 'uploaded')
+
+
+def today():
+    return datetime.today().strftime('%y%m%d')
+
+
+def day_folder(folder, day=None):
+    """<folder>/<yymmdd>, created if missing"""
+    path = os.path.join(folder, day or today())
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class FileManifest:
+    def __init__(self, path=None):
+        self.path = path or os.getenv("FILE_MANIFEST", FILE_MANIFEST)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    folder TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    updated_at TEXT NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_folder_day_status ON files (folder, day, status)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_folder_status ON files (folder, status)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS scanned_folders (folder TEXT PRIMARY KEY, scanned_at TEXT)")
+
+    @staticmethod
+    def _folder(folder):
+        return os.path.abspath(folder)
+
+    def register(self, path, folder, status='downloaded'):
+        """Records a file written into folder (day taken from its <yymmdd>_ name); re-registering resets it"""
+        self.register_many([path], folder, status)
+
+    def register_many(self, paths, folder, status='downloaded'):
+        now = datetime.now().isoformat(timespec='seconds')
+        rows = [(os.path.abspath(p), self._folder(folder), os.path.basename(p)[:6], status, now) for p in paths]
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO files (path, folder, day, status, updated_at) "
+                                   "VALUES (?, ?, ?, ?, ?)", rows)
+
+    def set_status(self, paths, status, only_from=None):
+        """Sets the status of paths (only of those currently in one of the only_from statuses, if given)"""
+        if status not in STATUSES:
+            raise ValueError(f"Unknown file status {status}")
+        now = datetime.now().isoformat(timespec='seconds')
+        query = "UPDATE files SET status = ?, updated_at = ? WHERE path = ?"
+        if only_from:
+            query += f" AND status IN ({','.join('?' * len(only_from))})"
+        with self._lock, self._conn:
+            self._conn.executemany(query, [(status, now, os.path.abspath(p), *(only_from or ())) for p in paths])
+
+    def files(self, folder, day=None, statuses=ON_DISK):
+        """Paths of the files of folder (of one day, if given) with one of the statuses, in download order"""
+        self.ensure_scanned(folder)
+        query = f"SELECT path FROM files WHERE folder = ? AND status IN ({','.join('?' * len(statuses))})"
+        params = [self._folder(folder), *statuses]
+        if day:
+            query += " AND day = ?"
+            params.append(day)
+        with self._lock:
+            paths = [row[0] for row in self._conn.execute(query, params)]
+        return sorted(paths, key=_download_order)
+
+    def ensure_scanned(self, folder):
+        """Registers the files already in folder (and its day subdirectories) the first time folder is used"""
+        key = self._folder(folder)
+        with self._lock:
+            if self._conn.execute("SELECT 1 FROM scanned_folders WHERE folder = ?", (key,)).fetchone():
+                return
+        found = []
+        if os.path.isdir(folder):
+            for entry in os.scandir(folder):
+                if entry.name.startswith('.'):
+                    continue
+                if entry.is_file():
+                    found.append(entry.path)
+                elif entry.is_dir() and entry.name.isdigit() and len(entry.name) == 6:
+                    found.extend(e.path for e in os.scandir(entry.path) if e.is_file() and not e.name.startswith('.'))
+        if found:
+            print(f"File manifest: registering {len(found)} existing files in {folder}")
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT OR IGNORE INTO files (path, folder, day, status, updated_at) "
+                                   "VALUES (?, ?, ?, 'downloaded', ?)",
+                                   [(os.path.abspath(p), key, os.path.basename(p)[:6],
+                                     datetime.now().isoformat(timespec='seconds')) for p in found])
+            self._conn.execute("INSERT INTO scanned_folders (folder, scanned_at) VALUES (?, ?)",
+                               (key, datetime.now().isoformat(timespec='seconds')))
+
+    def counts(self, folder):
+        """{(day, status): files} of folder"""
+        with self._lock:
+            rows = self._conn.execute("SELECT day, status, COUNT(*) FROM files WHERE folder = ? GROUP BY day, status",
+                                      (self._folder(folder),)).fetchall()
+        return {(day, status): n for day, status, n in rows}
+
+
+def _download_order(path):
+    """<yymmdd>_<n> names sorted by day, then by n as a number"""
+    name = os.path.basename(path)
+    day, _, n = name.partition('_')
+    return (day, int(n) if n.isdigit() else 0, name)
+
+
+_manifests = {}
+
+
+def get_manifest(path=None):
+    """Process-wide FileManifest for path (default: FILE_MANIFEST env or ./file_manifest.sqlite)"""
+    path = path or os.getenv("FILE_MANIFEST", FILE_MANIFEST)
+    if path not in _manifests:
+        _manifests[path] = FileManifest(path)
+    return _manifests[path]
@@ -1,9 +1,11 @@
 import json
-import glob
 import os
 from bs4 import BeautifulSoup
 import pandas as pd
 from datetime import datetime
+from description_operations import add_description_columns
+from metrics_operations import metrics
+from file_manifest_operations import get_manifest, today
 
 def trim_html(soup: BeautifulSoup) -> BeautifulSoup:
     """
@@ -99,13 +101,9 @@ def get_listing_urls(f_mains) -> list:
     Extracts all unique listing URLs from the HTML files in the specified directory.
     """
     urls = set()
-    files = glob.glob(os.path.join(f_mains, '*'))
-    files = [file for file in files if os.path.basename(file).startswith(f"{datetime.today().strftime('%y%m%d')}")] # These urls are used for download. I only want to download listings from today's mains.
-    
+    files = get_manifest().files(f_mains, day=today()) # These urls are used for download. I only want to download listings from today's mains.
+
     for filepath in files:
-        if not os.path.isfile(filepath) or os.path.basename(filepath).startswith('.'):
-            continue
-            
         try:
             with open(filepath, 'r', encoding='utf-8') as f:
                 soup = BeautifulSoup(f, 'html.parser')
@@ -124,114 +122,128 @@ def get_listing_urls(f_mains) -> list:
             
     return list(urls)
 
-def extract_detail(f_listings, process_today_only) -> pd.DataFrame:
-    # Skip directories or hidden files
+def parse_listing(content, filename) -> dict:
+    """
+    Listing record from the content (text, bytes or file object) of a listing page, or None if it has no advert.
+    filename is the downloaded file's name (<yymmdd>_<n>); it gives the date obtained.
+    """
+    soup = BeautifulSoup(content, 'html.parser')
+    script_tag = soup.find("script", {"id": "__NEXT_DATA__"})
+    if not script_tag or not script_tag.string:
+        return None
+    
 
-    files = glob.glob(os.path.join(f_listings, '*'))
-    files = [file for file in files
-             if os.path.isfile(file)
-             and not os.path.basename(file).startswith('.')]
+    json_data = json.loads(script_tag.string)
+    props = json_data.get('props', {}).get('pageProps', {})
+    advert = props.get('origAdvert')
     
-    if process_today_only:
-        files = [file for file in files if os.path.basename(file).startswith(f"{datetime.today().strftime('%y%m%d')}")]
+    if not advert:
+        return None
         
+    # Extract basic identifiers
+    listing_id = advert.get('id')
+    uri = advert.get('uri')
+    url = f"https://www.bezrealitky.cz/nemovitosti-byty-domy/{uri}" if uri else None
+    
+    # Financials
+    price_rent = advert.get('price')
+    utility_charges = advert.get('utilityCharges')
+    service_charges = advert.get('serviceCharges')
+    fee = advert.get('fee') # Provize
+    
+    # Property Details
+    description = advert.get('description')
+    surface = advert.get('surface')
+    
+    disposition_raw = advert.get('disposition')
+    disposition = disposition_raw
+    if disposition_raw and disposition_raw.startswith('DISP_'):
+         disposition = disposition_raw.replace('DISP_', '').replace('_', '+').replace('KK', 'kk')
+    
+    address = advert.get('address')
+    
+    # Tags / Highlights
+    tags = advert.get('tags', [])
+    tags_str = ", ".join(tags) if tags else ""
+    
+    # Availability
+    available_ts = advert.get('availableFrom')
+    available_date = datetime.fromtimestamp(available_ts).strftime('%Y-%m-%d') if available_ts else None
+    
+    # Coordinates
+    gps = advert.get('gps', {})
+    lat = gps.get('lat') if gps else None
+    lng = gps.get('lng') if gps else None
+
+
+    if lat is not None:
+        lat = round(lat, 5)
+    if lng is not None:
+        lng = round(lng, 5)
+    
+    filename_date = filename.split('_')[0]
+    return {
+        'listing_id': listing_id,
+        'URL': url,
+        'Address': address,
+        'Disposition': disposition,
+        'Area (m2)': surface,
+        'Rent (CZK)': price_rent,
+        'Utilities (CZK)': utility_charges,
+        'Services (CZK)': service_charges,
+        'Fee': fee,
+        'Available from': available_date,
+        'Tags': tags_str,
+        'Description': description,
+        'Latitude': lat,
+        'Longitude': lng,
+        'Source file': filename,
+        'bb_object_name': f"br/htmls/listings/{filename_date}/{listing_id}.html",
+        'Date obtained': datetime.strptime(filename[:6], '%y%m%d').date()
+    }
+
+
+def listings_frame(data) -> pd.DataFrame:
+    """DataFrame of parse_listing records with the description columns"""
+    df = pd.DataFrame(data)
+    # Content hash and MinHash signature of each description, used by the description store and flat merging
+    return add_description_columns(df)
+
+
+@metrics.timed_stage('extract_detail')
+def extract_detail(f_listings, process_today_only) -> pd.DataFrame:
+    # Listing files still on disk, from the file manifest
+    manifest = get_manifest()
+    files = manifest.files(f_listings, day=today() if process_today_only else None)
+
     print(f"Scanning {len(files)} files in {f_listings}...")
+    metrics.inc('files_scanned', len(files))
 
     data = []
+    parsed = []
     for file in files:
         try:
             with open(file, 'r', encoding='utf-8') as f:
-                soup = BeautifulSoup(f, 'html.parser')
-                script_tag = soup.find("script", {"id": "__NEXT_DATA__"})
-                if not script_tag or not script_tag.string:
-                    continue
-                
-
-                json_data = json.loads(script_tag.string)
-                props = json_data.get('props', {}).get('pageProps', {})
-                advert = props.get('origAdvert')
-                
-                if not advert:
-                    continue
-                    
-                # Extract basic identifiers
-                listing_id = advert.get('id')
-                uri = advert.get('uri')
-                url = f"https://www.bezrealitky.cz/nemovitosti-byty-domy/{uri}" if uri else None
-                
-                # Financials
-                price_rent = advert.get('price')
-                utility_charges = advert.get('utilityCharges')
-                service_charges = advert.get('serviceCharges')
-                fee = advert.get('fee') # Provize
-                
-                # Property Details
-                description = advert.get('description')
-                surface = advert.get('surface')
-                
-                disposition_raw = advert.get('disposition')
-                disposition = disposition_raw
-                if disposition_raw and disposition_raw.startswith('DISP_'):
-                     disposition = disposition_raw.replace('DISP_', '').replace('_', '+').replace('KK', 'kk')
-                
-                address = advert.get('address')
-                
-                # Tags / Highlights
-                tags = advert.get('tags', [])
-                tags_str = ", ".join(tags) if tags else ""
-                
-                # Availability
-                available_ts = advert.get('availableFrom')
-                available_date = datetime.fromtimestamp(available_ts).strftime('%Y-%m-%d') if available_ts else None
-                
-                # Coordinates
-                gps = advert.get('gps', {})
-                lat = gps.get('lat') if gps else None
-                lng = gps.get('lng') if gps else None
-
-
-                if lat is not None:
-                    lat = round(lat, 5)
-                if lng is not None:
-                    lng = round(lng, 5)
-                
-                filename = os.path.basename(file)
-                filename_date = filename.split('_')[0]
-                res = {
-                    'listing_id': listing_id,
-                    'URL': url,
-                    'Address': address,
-                    'Disposition': disposition,
-                    'Area (m2)': surface,
-                    'Rent (CZK)': price_rent,
-                    'Utilities (CZK)': utility_charges,
-                    'Services (CZK)': service_charges,
-                    'Fee': fee,
-                    'Available from': available_date,
-                    'Tags': tags_str,
-                    'Description': description,
-                    'Latitude': lat,
-                    'Longitude': lng,
-                    'Source file': filename,
-                    'bb_object_name': f"br/htmls/listings/{filename_date}/{listing_id}.html",
-                    'Date obtained': datetime.strptime(os.path.basename(file)[:6], '%y%m%d').date()
-                }
-
-                if res:
-                    data.append(res)
-                else:
-                    print("No valid listing details found.")
-                    continue
+                res = parse_listing(f, os.path.basename(file))
+
+            if res:
+                data.append(res)
+                parsed.append(file)
             
         except Exception as e:
             # Fail silently for individual file errors to keep processing others
             # print(f"Error parsing {file}: {e}")
+            metrics.inc('parse_errors')
             continue
         
+    # Files already uploaded keep their status
+    manifest.set_status(parsed, 'parsed', only_from=('downloaded',))
+
     if data:
 
-        df = pd.DataFrame(data)
+        df = listings_frame(data)
         print(f"Successfully extracted {len(df)} detailed records.")
+        metrics.inc('listings_extracted', len(df))
 
         #        output_file = 'listings_details.csv'
         #        df.to_csv(output_file, index=False)
@@ -246,79 +258,75 @@ def extract_detail(f_listings, process_today_only) -> pd.DataFrame:
         print("No data extracted.")
 
 
+def parse_listing_images(content) -> list:
+    """Image records (listing_id, filename, object_name, url) from the content of a listing page"""
+    soup = BeautifulSoup(content, 'html.parser')
+    script_tag = soup.find("script", {"id": "__NEXT_DATA__"})
+    if not script_tag or not script_tag.string:
+        return []
+    
+    json_data = json.loads(script_tag.string)
+    page_props = json_data.get('props', {}).get('pageProps', {})
+    advert = page_props.get('origAdvert')
+    
+    if not advert:
+        return []
+    
+    listing_id = advert.get('id')
+    try:
+        folder_group = f"{str(listing_id)[:3]}/"
+    except:
+        folder_group=""
+    public_images = advert.get('publicImages', [])
+    cache = page_props.get('apolloCache', {})
+    
+    data = []
+    for img_ref in public_images:
+        img_obj = None
+        if '__ref' in img_ref:
+            img_obj = cache.get(img_ref['__ref'])
+        else:
+            img_obj = img_ref
+        
+        if not img_obj:
+            continue
+            
+        url = img_obj.get('url')
+        if not url:
+            # Search for any key starting with 'url'
+            for k, v in img_obj.items():
+                if k.startswith('url'):
+                    url = v
+                    break
+        
+        if url:
+            # print(f"DEBUG: URL = {url}")
+            filename = os.path.basename(url)
+            # print(f"DEBUG: filename = {filename}, type = {type(filename)}")
+            filename = f"{os.path.splitext(filename)[0]}.webp" # SET IMAGE EXTENSION HERE (1/2 PLACES)
+            # print(f"DEBUG: filename second = {filename}, type = {type(filename)}")
+            data.append({
+                'listing_id': listing_id,
+                'filename': filename,
+                'object_name': f"br/images/{folder_group}{listing_id}/{filename}",
+                'url': url
+            })
+    return data
+
+
 # The below is very inefficient - it should be done along with the rest of the extraction
 # START MODIFICATION: Add extract_images function
+@metrics.timed_stage('extract_images')
 def extract_images(f_listings, process_today_only) -> pd.DataFrame:
-    files = glob.glob(os.path.join(f_listings, '*'))
-    files = [file for file in files
-             if os.path.isfile(file)
-             and not os.path.basename(file).startswith('.')]
-    
-    if process_today_only:
-        files = [file for file in files if os.path.basename(file).startswith(f"{datetime.today().strftime('%y%m%d')}")]
-        
+    files = get_manifest().files(f_listings, day=today() if process_today_only else None)
+
     print(f"Scanning {len(files)} files for images in {f_listings}...")
 
     data = []
     for file in files:
         try:
             with open(file, 'r', encoding='utf-8') as f:
-                soup = BeautifulSoup(f, 'html.parser')
-                script_tag = soup.find("script", {"id": "__NEXT_DATA__"})
-                if not script_tag or not script_tag.string:
-                    continue
-                
-                json_data = json.loads(script_tag.string)
-                page_props = json_data.get('props', {}).get('pageProps', {})
-                advert = page_props.get('origAdvert')
-                
-                if not advert:
-                    continue
-                
-                listing_id = advert.get('id')
-                try:
-                    folder_group = f"{str(listing_id)[:3]}/"
-                except:
-                    folder_group=""
-                public_images = advert.get('publicImages', [])
-                cache = page_props.get('apolloCache', {})
-                
-                # Extract date from filename: br_htmls_listings_260114_138.html
-                # Split by '_' gives ['br', 'htmls', 'listings', '260114', '138.html']
-                filename_parts = os.path.basename(file).split('_')
-                date_obtained = None
-                
-                for img_ref in public_images:
-                    img_obj = None
-                    if '__ref' in img_ref:
-                        img_obj = cache.get(img_ref['__ref'])
-                    else:
-                        img_obj = img_ref
-                    
-                    if not img_obj:
-                        continue
-                        
-                    url = img_obj.get('url')
-                    if not url:
-                        # Search for any key starting with 'url'
-                        for k, v in img_obj.items():
-                            if k.startswith('url'):
-                                url = v
-                                break
-                    
-                    if url:
-                        # print(f"DEBUG: URL = {url}")
-                        filename = os.path.basename(url)
-                        # print(f"DEBUG: filename = {filename}, type = {type(filename)}")
-                        filename = f"{os.path.splitext(filename)[0]}.webp" # SET IMAGE EXTENSION HERE (1/2 PLACES)
-                        # print(f"DEBUG: filename second = {filename}, type = {type(filename)}")
-                        data.append({
-                            'listing_id': listing_id,
-                            'filename': filename,
-                            'object_name': f"br/images/{folder_group}{listing_id}/{filename}",
-                            'url': url
-                        })
-
+                data.extend(parse_listing_images(f))
         except Exception:
             continue
     
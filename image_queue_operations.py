@@ -0,0 +1,84 @@
+from sqlalchemy import text, inspect
+
+### Image job queue ###
+# The images table doubles as the work queue for image downloads. A worker leases a batch of rows by setting
+# lease_owner/lease_expires under SELECT ... FOR UPDATE SKIP LOCKED, so concurrent workers (processes or machines)
+# never take the same rows. A lease is not released explicitly: the worker writes the final status (3 uploaded,
+# 9 failed), and rows of a crashed worker become available again once their lease expires.
+# Failed downloads (9) are retried until they reach IMAGE_MAX_ATTEMPTS; the lease expiry doubles as the retry delay.
+# Every lease counts as an attempt.
+
+IMAGE_LEASE_SECONDS = 1800
+IMAGE_MAX_ATTEMPTS = 3
+IMAGE_BATCH_SIZE = 200
+
+QUEUE_COLUMNS = {
+    'lease_owner': "VARCHAR(64) NULL",
+    'lease_expires': "DATETIME NULL",
+    'attempts': "INT NOT NULL DEFAULT 0"
+}
+
+
+def ensure_image_queue_schema(engine):
+    """Adds the lease and attempt columns and the queue index to images if missing"""
+    inspector = inspect(engine)
+    columns = {c['name'] for c in inspector.get_columns('images')}
+    indexes = {i['name'] for i in inspector.get_indexes('images')}
+    changes = [f"ADD COLUMN {name} {definition}" for name, definition in QUEUE_COLUMNS.items() if name not in columns]
+    if 'idx_queue' not in indexes:
+        changes.append("ADD INDEX idx_queue (downloaded, lease_expires)")
+    if changes:
+        print("Adding job queue columns to 'images'")
+        with engine.begin() as conn:
+            conn.execute(text("ALTER TABLE images " + ", ".join(changes)))
+
+
+def lease_image_jobs(engine, worker_id, batch_size=IMAGE_BATCH_SIZE, lease_seconds=IMAGE_LEASE_SECONDS,
+                     max_attempts=IMAGE_MAX_ATTEMPTS):
+    """
+    Leases up to batch_size images that are not downloaded yet (0) or failed (9), have attempts left and
+    whose lease is free or expired. Every lease counts as an attempt, so rows that keep crashing a worker
+    are given up on as well. Returns the leased rows as a list of dicts.
+    """
+    with engine.begin() as conn:
+        ids = conn.execute(text("""
+            SELECT id FROM images
+            WHERE downloaded IN (0, 9) AND attempts < :max_attempts
+              AND (lease_expires IS NULL OR lease_expires < NOW())
+            ORDER BY id
+            LIMIT :batch_size
+            FOR UPDATE SKIP LOCKED;
+        """), {'max_attempts': max_attempts, 'batch_size': batch_size}).scalars().all()
+        if not ids:
+            return []
+
+        params = {f"id{n}": image_id for n, image_id in enumerate(ids)}
+        in_list = ', '.join(f":id{n}" for n in range(len(ids)))
+        conn.execute(text(f"""
+            UPDATE images
+            SET lease_owner = :worker_id,
+                lease_expires = NOW() + INTERVAL :lease_seconds SECOND,
+                attempts = attempts + 1
+            WHERE id IN ({in_list});
+        """), {**params, 'worker_id': worker_id, 'lease_seconds': lease_seconds})
+        rows = conn.execute(text(f"""
+            SELECT id, url, filename, listing_id, downloaded, object_name
+            FROM images WHERE id IN ({in_list});
+        """), params).mappings().all()
+    return [dict(row) for row in rows]
+
+
+def image_queue_status(engine, max_attempts=IMAGE_MAX_ATTEMPTS):
+    """Counts of pending, leased, retryable, failed and done images"""
+    with engine.connect() as conn:
+        row = conn.execute(text("""
+            SELECT
+                SUM(downloaded = 0 AND attempts < :max_attempts
+                    AND (lease_expires IS NULL OR lease_expires < NOW())) AS pending,
+                SUM(downloaded = 0 AND lease_expires >= NOW()) AS leased,
+                SUM(downloaded = 9 AND attempts < :max_attempts) AS retryable,
+                SUM(downloaded IN (0, 9) AND attempts >= :max_attempts) AS failed,
+                SUM(downloaded = 3) AS done
+            FROM images;
+        """), {'max_attempts': max_attempts}).mappings().first()
+    return {key: int(value or 0) for key, value in row.items()}
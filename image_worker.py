@@ -0,0 +1,105 @@
+"""
+Image download workers
+
+Each worker leases batches of image jobs from the images table (see image_queue_operations), downloads them
+through its own NordVPN session, uploads them to B2 and writes the final statuses, until the queue is empty.
+Several workers, in processes here or on other machines, can drain the queue at the same time.
+
+Usage: python image_worker.py [workers]
+"""
+
+import os
+import sys
+import socket
+import asyncio
+import multiprocessing
+from nord_session import with_nord_session
+from downloadsV2 import download_br_images
+from backblaze_operations import upload_file
+from sql_operations import open_sql_engine, prepare_image_queue, lease_images, ImageStatusWriter
+from image_queue_operations import IMAGE_BATCH_SIZE
+from metrics_operations import metrics
+from dotenv import load_dotenv
+load_dotenv()
+
+
+def upload_image_batch(batch, f_images, status_writer):
+    """Uploads the downloaded images (status 1) of a batch to B2 and records them as done (3)"""
+    ENDPOINT_URL = os.getenv("B2_ENDPOINT_URL")
+    KEY_ID = os.getenv("B2_KEY_ID")
+    APPLICATION_KEY = os.getenv("B2_APPLICATION_KEY")
+    BUCKET_NAME = os.getenv("B2_BUCKET_NAME")
+
+    for index in batch.index:
+        if batch.at[index,"downloaded"]==1:
+            listing_id=batch.at[index,"listing_id"]
+            filename=batch.at[index,"filename"]
+            object_name=batch.at[index,"object_name"]
+            file_path = f"{f_images}/{listing_id}-{filename}"
+
+            if not os.path.exists(file_path):
+                print(f"File {file_path} not found, skipping upload.")
+                continue
+
+            if upload_file(file_path, ENDPOINT_URL, KEY_ID, APPLICATION_KEY, BUCKET_NAME, object_name):
+                batch.at[index,"downloaded"] = 3
+                status_writer.record(batch.at[index,"id"], 3)
+                os.remove(file_path)
+
+
+@with_nord_session
+async def drain_image_queue(f_images, worker_id, batch_size=IMAGE_BATCH_SIZE, max_batches=None, engine=None, nord=None):
+    """Leases and processes batches until the queue is empty (or max_batches were processed), all through engine"""
+    processed = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        batch = await asyncio.to_thread(lease_images, worker_id, batch_size, engine=engine)
+        if batch.empty:
+            break
+        # Rows retried after a failure come in as 9
+        batch["downloaded"] = 0
+
+        status_writer = ImageStatusWriter(engine=engine)
+        await download_br_images(batch, f_images, nord=nord, status_writer=status_writer)
+        await asyncio.to_thread(upload_image_batch, batch, f_images, status_writer)
+        await asyncio.to_thread(status_writer.flush)
+
+        batches += 1
+        processed += len(batch)
+        print(f"Worker {worker_id}: batch {batches} done, {processed} images processed")
+    print(f"Worker {worker_id}: queue drained")
+    return processed
+
+
+def run_image_worker(f_images, batch_size=IMAGE_BATCH_SIZE, max_batches=None):
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    # One tunnel and engine for the whole run, shared by leasing and status writes
+    with open_sql_engine() as engine:
+        asyncio.run(drain_image_queue(f_images, worker_id, batch_size=batch_size, max_batches=max_batches,
+                                      engine=engine))
+
+
+def run_reported_image_worker(n, f_images, batch_size=IMAGE_BATCH_SIZE):
+    """Worker process entry point: its metrics are written as image_worker_<n>"""
+    metrics.reported(f"image_worker_{n}")(run_image_worker)(f_images, batch_size)
+
+
+def run_image_workers(f_images, workers=1, batch_size=IMAGE_BATCH_SIZE):
+    """Prepares the queue columns once, then drains the queue with the given number of worker processes"""
+    status = prepare_image_queue()
+    print(f"Image queue: {status}")
+    if workers <= 1:
+        run_image_worker(f_images, batch_size)
+        return
+
+    processes = [multiprocessing.Process(target=run_reported_image_worker, args=(n, f_images, batch_size))
+                 for n in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else int(os.getenv("IMAGE_WORKERS", "1"))
+    run_image_workers(os.getenv("FOLDER_IMAGES"), workers)
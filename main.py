@@ -1,6 +1,9 @@
 """
 Notes
 - Currently only bezrealitky
+- Usage: python main.py [--stages download processing sql backblaze images] [--skip STAGE ...] [--all-days]
+                        [--profile [STAGE ...]] [--profile-dir DIR]
+         python main.py --maintenance TASK   (one-off migrations and rebuilds instead of the pipeline, see MAINTENANCE)
 
 Pseudocode
 - Downloads mains and listings htmls into separate folders
@@ -9,26 +12,48 @@ Pseudocode
 """
 
 # My files
-from downloadsV2 import download_br, download_br_images
+from downloadsV2 import download_br
 from html_operations import extract_detail, extract_images
-from sql_operations import perform_and_upload, get_undownloaded_images, update_undownloaded_images
+from sql_operations import (perform_and_upload, migrate_properties_types, migrate_description_store,
+                            migrate_normalized_storage, rebuild_price_index_table, rebuild_presence_table,
+                            explain_properties_queries)
+from image_worker import run_image_workers
 from backblaze_operations import upload_file
+from metrics_operations import metrics
+from profile_operations import StageProfiler
+from file_manifest_operations import get_manifest
 
 # Not my files
 import os
-import glob
+import argparse
 import asyncio
 from pathlib import Path
 from datetime import datetime
 from dotenv import load_dotenv
 load_dotenv()
 
+STAGES = ["download", "processing", "sql", "backblaze", "images"]
+# One-off database tasks run with --maintenance
+MAINTENANCE = {
+    "migrate-types": migrate_properties_types,
+    "migrate-descriptions": migrate_description_store,
+    "migrate-normalized": migrate_normalized_storage,
+    "rebuild-price-index": rebuild_price_index_table,
+    "rebuild-presence": rebuild_presence_table,
+    "explain-queries": explain_properties_queries,
+}
+
+@metrics.reported("pipeline")
 def main(run_download=True,
          run_processing=True,
          process_today_only=True,
          run_sql=True,
          run_backblaze=True,
-         download_images=True):
+         download_images=True,
+         profiler=None):
+
+    # Stages not enabled in the profiler run unprofiled
+    profiler = profiler or StageProfiler()
 
     print("Making sure folders exist")
     f_mains = os.getenv("FOLDER_MAINS")
@@ -45,23 +70,26 @@ def main(run_download=True,
     print("Folders exist")
 
     if run_download:
-        asyncio.run(download_br(f_mains, f_listings)) # This downloads all htmls for the day
+        with profiler.stage("download"):
+            asyncio.run(download_br(f_mains, f_listings)) # This downloads all htmls for the day
 
     df_today = None
     df_today_images = None
     if run_processing:
-        print(f"Extracting (today's={process_today_only}) listings information from htmls.")
-        df_today = extract_detail(f_listings, process_today_only)
-        print("Listings information from htmls extracted successfully.")
-        print("Extracting image information from htmls")
-        df_today_images = extract_images(f_listings, process_today_only)
+        with profiler.stage("processing"):
+            print(f"Extracting (today's={process_today_only}) listings information from htmls.")
+            df_today = extract_detail(f_listings, process_today_only)
+            print("Listings information from htmls extracted successfully.")
+            print("Extracting image information from htmls")
+            df_today_images = extract_images(f_listings, process_today_only)
 
     ### SQL operations ###
 
     if run_sql:
         if df_today is not None and df_today_images is not None:
             print("Initiating sql upload")
-            perform_and_upload(df_today, df_today_images)
+            with metrics.stage("sql"), profiler.stage("sql"):
+                perform_and_upload(df_today, df_today_images)
             print("sql upload completed")
         else:
             print("Skipping SQL upload: No data available (run_processing might be False or failed).")
@@ -73,71 +101,78 @@ def main(run_download=True,
     APPLICATION_KEY = os.getenv("B2_APPLICATION_KEY")
     BUCKET_NAME = os.getenv("B2_BUCKET_NAME")
 
-    DB_IS_LOCAL = os.getenv("DB_IS_LOCAL")
-
     if run_backblaze:
-
-        daily_files_mains = glob.glob(os.path.join(f_mains, '*'))
-        daily_files_mains = [file for file in daily_files_mains
-                 if os.path.isfile(file)
-   and not os.path.basename(file).startswith('.')]
-        #daily_files_mains = [file for file in daily_files_mains if os.path.basename(file).startswith(f"{datetime.today().strftime('%y%m%d')}")]
-
-        for file in daily_files_mains:
-            # Extract date from filename (assuming YYMMDD_suffix format)
-            file_date = os.path.basename(file).split('_')[0]
-            if upload_file(file, ENDPOINT_URL, KEY_ID, APPLICATION_KEY, BUCKET_NAME, object_name=f"br/htmls/mains/{file_date}/{os.path.basename(file)}.html"):
-                os.remove(file)
-                print(f"Uploaded and deleted file {file}.html.")
-
-        for index, listing in df_today.iterrows():
-            if DB_IS_LOCAL=="true":
-                file = f"./housing_V2/listings/{listing['Source file']}"
-            else:
-                file = f"listings/{listing['Source file']}"
-            file_date=file.split('_')[0]
-            # Extract date from filename (assuming YYMMDD_suffix format)
-            if upload_file(file, ENDPOINT_URL, KEY_ID, APPLICATION_KEY, BUCKET_NAME, object_name=listing['bb_object_name']):
-                os.remove(file)
-                print(f"Uploaded and deleted file {file}.html.")
+        with metrics.stage("backblaze_htmls"), profiler.stage("backblaze"):
+            manifest = get_manifest()
+
+            # Every mains file still on disk, from the file manifest
+            for file in manifest.files(f_mains):
+                # Extract date from filename (assuming YYMMDD_suffix format)
+                file_date = os.path.basename(file).split('_')[0]
+                if upload_file(file, ENDPOINT_URL, KEY_ID, APPLICATION_KEY, BUCKET_NAME, object_name=f"br/htmls/mains/{file_date}/{os.path.basename(file)}.html"):
+                    manifest.set_status([file], 'uploaded', only_from=('downloaded', 'parsed'))
+                    os.remove(file)
+                    manifest.set_status([file], 'deleted')
+                    print(f"Uploaded and deleted file {file}.html.")
+
+            # Listing files parsed in this run, for the days it covered, matched to their object names by file name
+            object_names = {}
+            if df_today is not None:
+                object_names = dict(zip(df_today['Source file'], df_today['bb_object_name']))
+            for day in sorted({name[:6] for name in object_names}):
+                for file in manifest.files(f_listings, day=day, statuses=('parsed',)):
+                    object_name = object_names.get(os.path.basename(file))
+                    if object_name and upload_file(file, ENDPOINT_URL, KEY_ID, APPLICATION_KEY, BUCKET_NAME, object_name=object_name):
+                        # Recorded before the delete, so a file left behind by a failed delete is not uploaded again
+                        manifest.set_status([file], 'uploaded', only_from=('parsed',))
+                        os.remove(file)
+                        manifest.set_status([file], 'deleted')
+                        print(f"Uploaded and deleted file {file}.html.")
 
     # Image operations
 
     if download_images:
 
-        ## Get a table of images, filtered for download == 0
-        undownloaded_images = get_undownloaded_images()
-
-        # FOR TESTING
-        # undownloaded_images = undownloaded_images[:10]
-        ###
-
-        ## Download those images
-        asyncio.run(download_br_images(undownloaded_images, f_images))
-
-        ## Upload those images to B2
-        for index in undownloaded_images.index:
-            if undownloaded_images.at[index,"downloaded"]==1:
-                listing_id=undownloaded_images.at[index,"listing_id"]
-                filename=undownloaded_images.at[index,"filename"]
-                object_name=undownloaded_images.at[index,"object_name"]
-                file_path = f"{f_images}/{listing_id}-{filename}"
-
-                if not os.path.exists(file_path):
-                    print(f"File {file_path} not found, skipping upload.")
-                    continue
-
-                if upload_file(file_path, ENDPOINT_URL, KEY_ID, APPLICATION_KEY, BUCKET_NAME, object_name):
-                    undownloaded_images.at[index,"downloaded"] = 3
-                    os.remove(file_path)
-            else:
-                pass
-
-        ## Update sql with image download statuses
-        update_undownloaded_images(undownloaded_images)
+        ## Drain the image job queue: lease batches of undownloaded (0) and retryable (9) images, download them,
+        ## upload them to B2 and write the statuses. IMAGE_WORKERS processes work in parallel.
+        with metrics.stage("images"), profiler.stage("images"):
+            run_image_workers(f_images, workers=int(os.getenv("IMAGE_WORKERS", "1")))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Daily pipeline: download listings, extract them, upload to SQL and B2, download images.")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=STAGES, help="Stages to run (default: all)")
+    parser.add_argument("--skip", nargs="+", choices=STAGES, default=[], help="Stages to leave out")
+    parser.add_argument("--all-days", action="store_true", help="Process every listing file, not only today's")
+    parser.add_argument("--profile", nargs="*", choices=STAGES, metavar="STAGE",
+                        help="Profile stages with cProfile and tracemalloc (no STAGE: every stage that runs)")
+    parser.add_argument("--profile-dir", help="Where profiles are written (default: PROFILE_DIR or ./profiles)")
+    parser.add_argument("--maintenance", choices=MAINTENANCE, metavar="TASK",
+                        help=f"Run one database task instead of the pipeline: {', '.join(MAINTENANCE)}")
+    return parser.parse_args(argv)
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+    if args.maintenance:
+        print(f"Running maintenance task: {args.maintenance}")
+        MAINTENANCE[args.maintenance]()
+        return
 
+    stages = [stage for stage in args.stages if stage not in args.skip]
+    profiled = []
+    if args.profile is not None:
+        profiled = [stage for stage in (args.profile or stages) if stage in stages]
+    print(f"Running stages: {', '.join(stages)}" + (f"; profiling: {', '.join(profiled)}" if profiled else ""))
 
+    main(run_download="download" in stages,
+         run_processing="processing" in stages,
+         process_today_only=not args.all_days,
+         run_sql="sql" in stages,
+         run_backblaze="backblaze" in stages,
+         download_images="images" in stages,
+         profiler=StageProfiler(profiled, profile_dir=args.profile_dir))
 
 
 if __name__ == "__main__":
-    main()
+    cli()
@@ -0,0 +1,248 @@
+import numpy as np
+import pandas as pd
+from datetime import datetime
+from sqlalchemy import text
+from sqlalchemy.types import LargeBinary
+from description_operations import signature_bytes, signature_matrix, signature_similarity
+
+### Flat merging ###
+# Listings of the same flat (relisted after a while, or posted on several sites) share a persistent flat_id
+# in the 'listing_flats' table. Candidate pairs come from a blocking index (nearby grid cells, area bucket,
+# disposition) instead of comparing every pair, and are scored on description (MinHash) and image similarity.
+
+# Blocking: ~280 m x ~180 m cells, a listing is compared with listings in its own and the 8 neighbouring cells
+BLOCK_CELL_DEG = 0.0025
+AREA_BUCKET_M2 = 5
+
+# Match rules: close, same disposition, nearly the same area, and a similar description or shared images
+MATCH_MAX_DISTANCE_M = 150
+MATCH_MAX_AREA_DIFF_M2 = 3
+MATCH_MIN_DESCRIPTION_SIMILARITY = 0.5
+MATCH_MIN_IMAGE_SIMILARITY = 0.3
+
+
+def image_keys(df_images):
+    """Per listing, the space separated sorted set of image file stems"""
+    if df_images is None or df_images.empty:
+        return pd.Series(dtype=object)
+    stems = df_images['filename'].astype(str).str.rsplit('.', n=1).str[0]
+    return stems.groupby(pd.to_numeric(df_images['listing_id']).astype('int64')).agg(lambda s: ' '.join(sorted(set(s))))
+
+
+def prepare_listings(df, df_images=None):
+    """
+    Latest row per listing mapped to the listing_flats columns: coordinates, area, disposition,
+    blocking keys, description MinHash (bytes) and image keys.
+    """
+    df = df.drop_duplicates('listing_id', keep='last')
+    if 'Description minhash' in df.columns:
+        # Computed during extraction
+        minhashes = [m if isinstance(m, bytes) else signature_bytes(None) for m in df['Description minhash']]
+    else:
+        minhashes = [signature_bytes(d) for d in df['Description']]
+    prepared = pd.DataFrame({
+        'listing_id': pd.to_numeric(df['listing_id']).to_numpy(np.int64),
+        'latitude': pd.to_numeric(df['Latitude'], errors='coerce').to_numpy(np.float64),
+        'longitude': pd.to_numeric(df['Longitude'], errors='coerce').to_numpy(np.float64),
+        'area': pd.to_numeric(df['Area (m2)'], errors='coerce').to_numpy(np.float64),
+        'disposition': df['Disposition'].fillna('').astype(str).to_numpy(),
+        'description_minhash': minhashes
+    })
+    prepared['block_row'] = np.floor(prepared['latitude'] / BLOCK_CELL_DEG).astype('Int64')
+    prepared['block_col'] = np.floor(prepared['longitude'] / BLOCK_CELL_DEG).astype('Int64')
+    prepared['area_bucket'] = np.floor(prepared['area'] / AREA_BUCKET_M2).astype('Int64')
+    prepared['image_keys'] = prepared['listing_id'].map(image_keys(df_images)).fillna('')
+    return prepared
+
+
+def candidate_pairs(left, right):
+    """
+    Blocking index join: positions (i, j) of rows in left and right that share a disposition and lie in
+    neighbouring cells and area buckets. Rows without coordinates or area never become candidates.
+    """
+    keys = ['block_row', 'block_col', 'area_bucket', 'disposition']
+    offsets = pd.DataFrame(
+        [(dr, dc, da) for dr in (-1, 0, 1) for dc in (-1, 0, 1) for da in (-1, 0, 1)],
+        columns=['dr', 'dc', 'da']
+    )
+    probe = left[keys].assign(left=np.arange(len(left))).dropna(subset=keys[:3]).merge(offsets, how='cross')
+    probe['block_row'] += probe.pop('dr')
+    probe['block_col'] += probe.pop('dc')
+    probe['area_bucket'] += probe.pop('da')
+    index = right[keys].assign(right=np.arange(len(right))).dropna(subset=keys[:3])
+    pairs = probe.merge(index, on=keys)
+    return pairs['left'].to_numpy(np.int64), pairs['right'].to_numpy(np.int64)
+
+
+def score_pairs(left, right, li, rj):
+    """Similarity features and the match decision for candidate pairs"""
+    lat_a, lat_b = left['latitude'].to_numpy()[li], right['latitude'].to_numpy()[rj]
+    dy = (lat_a - lat_b) * 110570.0
+    dx = (left['longitude'].to_numpy()[li] - right['longitude'].to_numpy()[rj]) * 111320.0 * np.cos(np.radians(lat_a))
+    distance = np.hypot(dx, dy)
+    area_diff = np.abs(left['area'].to_numpy()[li] - right['area'].to_numpy()[rj])
+
+    description = signature_similarity(signature_matrix(left['description_minhash'].to_numpy()[li]),
+                                       signature_matrix(right['description_minhash'].to_numpy()[rj]))
+
+    left_images = left['image_keys'].to_numpy()
+    right_images = right['image_keys'].to_numpy()
+    images = np.zeros(len(li))
+    for n, (i, j) in enumerate(zip(li, rj)):
+        if left_images[i] and right_images[j]:
+            a, b = set(left_images[i].split()), set(right_images[j].split())
+            images[n] = len(a & b) / len(a | b)
+
+    accepted = ((distance <= MATCH_MAX_DISTANCE_M) & (area_diff <= MATCH_MAX_AREA_DIFF_M2)
+                & ((description >= MATCH_MIN_DESCRIPTION_SIMILARITY) | (images >= MATCH_MIN_IMAGE_SIMILARITY)))
+    return pd.DataFrame({
+        'left': li, 'right': rj,
+        'distance_m': distance, 'area_diff': area_diff,
+        'description_similarity': description, 'image_similarity': images,
+        'score': np.maximum(description, images),
+        'accepted': accepted
+    })
+
+
+def match_batch(new, existing, next_flat_id):
+    """
+    Assigns flat ids to a batch of new listings (prepared rows) given candidate rows already in listing_flats.
+    A new listing joins the flat of its best scoring existing match. New listings matching only each other
+    (e.g. the same flat posted twice on one day) are grouped and share a fresh flat id.
+    Existing flats are never merged with each other, so a flat_id once assigned stays stable.
+    Returns (new with flat_id, matched_listing_id and match_score columns, next free flat id).
+    """
+    new = new.reset_index(drop=True)
+    existing = existing.reset_index(drop=True)
+    n_existing = len(existing)
+    combined = pd.concat([existing, new], ignore_index=True)
+
+    li, rj = candidate_pairs(new, combined)
+    # Each new-new pair once and no self pairs
+    keep = (rj < n_existing) | (rj - n_existing > li)
+    pairs = score_pairs(new, combined, li[keep], rj[keep])
+    pairs = pairs[pairs['accepted']].sort_values('score', ascending=False, kind='stable')
+
+    flat_id = np.full(len(new), -1, dtype=np.int64)
+    matched = np.full(len(new), None, dtype=object)
+    score = np.full(len(new), np.nan)
+    combined_ids = combined['listing_id'].to_numpy()
+
+    to_existing = pairs[pairs['right'] < n_existing].drop_duplicates('left')
+    existing_flats = existing['flat_id'].to_numpy(np.int64) if n_existing else np.empty(0, np.int64)
+    flat_id[to_existing['left'].to_numpy()] = existing_flats[to_existing['right'].to_numpy()]
+    matched[to_existing['left'].to_numpy()] = combined_ids[to_existing['right'].to_numpy()]
+    score[to_existing['left'].to_numpy()] = to_existing['score'].to_numpy()
+
+    # Group new listings linked to each other (union-find over accepted new-new pairs)
+    within = pairs[pairs['right'] >= n_existing]
+    parent = np.arange(len(new))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b, s in zip(within['left'], within['right'] - n_existing, within['score']):
+        if matched[b] is None and flat_id[b] < 0:
+            matched[b], score[b] = combined_ids[n_existing + a], s
+        elif matched[a] is None and flat_id[a] < 0:
+            matched[a], score[a] = combined_ids[n_existing + b], s
+        parent[find(a)] = find(b)
+
+    roots = np.array([find(i) for i in range(len(new))], dtype=np.int64)
+    for root in np.unique(roots):
+        members = np.flatnonzero(roots == root)
+        unassigned = members[flat_id[members] < 0]
+        if len(unassigned) == 0:
+            continue
+        assigned = members[flat_id[members] >= 0]
+        if len(assigned):
+            # Join the flat of the group member with the strongest existing match
+            flat_id[unassigned] = flat_id[assigned[np.nanargmax(score[assigned])]]
+        else:
+            flat_id[unassigned] = next_flat_id
+            next_flat_id += 1
+
+    new = new.assign(flat_id=flat_id, matched_listing_id=matched, match_score=score)
+    return new, next_flat_id
+
+
+def _create_listing_flats_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS listing_flats (
+            listing_id BIGINT NOT NULL PRIMARY KEY,
+            flat_id BIGINT NOT NULL,
+            latitude DOUBLE,
+            longitude DOUBLE,
+            area DOUBLE,
+            disposition VARCHAR(32) NOT NULL,
+            block_row INT,
+            block_col INT,
+            area_bucket INT,
+            description_minhash BLOB,
+            image_keys TEXT,
+            matched_listing_id BIGINT,
+            match_score DOUBLE,
+            assigned_on DATE NOT NULL,
+            INDEX idx_flat (flat_id),
+            INDEX idx_block (block_row, block_col)
+        );
+    """))
+
+
+LISTING_FLATS_COLUMNS = [
+    'listing_id', 'flat_id', 'latitude', 'longitude', 'area', 'disposition',
+    'block_row', 'block_col', 'area_bucket', 'description_minhash', 'image_keys'
+]
+
+
+def assign_flat_ids(engine, df_today, df_today_images):
+    """
+    Incremental merge step of the daily load: listings seen for the first time get a flat_id,
+    either of a matching listing already in listing_flats or a new one.
+    Only listing_flats rows in the blocks around today's listings are read.
+    """
+    prepared = prepare_listings(df_today, df_today_images)
+
+    with engine.begin() as conn:
+        _create_listing_flats_table(conn)
+    prepared.to_sql("listing_flats_staging", engine, if_exists="replace", index=False,
+                    dtype={'description_minhash': LargeBinary})
+
+    with engine.connect() as conn:
+        known = pd.read_sql(text("""
+            SELECT s.listing_id FROM listing_flats_staging s
+            INNER JOIN listing_flats f ON f.listing_id = s.listing_id
+        """), conn)
+        existing = pd.read_sql(text(f"""
+            SELECT {', '.join(LISTING_FLATS_COLUMNS)} FROM listing_flats
+            WHERE listing_id IN (
+                SELECT f.listing_id FROM listing_flats f
+                INNER JOIN listing_flats_staging s
+                    ON f.block_row BETWEEN s.block_row - 1 AND s.block_row + 1
+                    AND f.block_col BETWEEN s.block_col - 1 AND s.block_col + 1
+                    AND f.disposition = s.disposition
+            )
+        """), conn)
+        next_flat_id = conn.execute(text("SELECT COALESCE(MAX(flat_id), 0) + 1 FROM listing_flats")).scalar()
+
+    new = prepared[~prepared['listing_id'].isin(known['listing_id'])]
+    if new.empty:
+        print("No new listings to merge")
+        return
+
+    for col in ('block_row', 'block_col', 'area_bucket'):
+        existing[col] = existing[col].astype('Int64')
+    existing['description_minhash'] = existing['description_minhash'].map(bytes)
+    existing['image_keys'] = existing['image_keys'].fillna('')
+
+    merged, _ = match_batch(new, existing, int(next_flat_id))
+    merged['assigned_on'] = datetime.now().date()
+    merged.to_sql("listing_flats", engine, if_exists="append", index=False,
+                  dtype={'description_minhash': LargeBinary})
+
+    n_matched = int(merged['matched_listing_id'].notna().sum())
+    print(f"Merged listings: {len(merged)} new, {n_matched} matched to an existing flat or to each other, "
+          f"{merged['flat_id'].nunique()} flats")
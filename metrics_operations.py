@@ -0,0 +1,191 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+
+### Pipeline metrics ###
+# One process-wide registry of counters (pages, listings, bytes, retries, rows, ...), latency histograms
+# (HTTP requests, B2 uploads) and stage timers. main writes it at the end of a run as a JSON report and as a
+# Prometheus text file (node_exporter textfile collector format) in METRICS_DIR.
+# Labels are passed as keyword arguments: metrics.inc('http_requests', status=200).
+
+METRICS_DIR = os.getenv("METRICS_DIR", "metrics")
+
+# Histogram bucket upper bounds in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 1800)
+REPORT_PERCENTILES = (50, 90, 99)
+
+
+def _key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+
+def _prometheus_name(key):
+    name, labels = key
+    if not labels:
+        return f"housing_{name}"
+    label_str = ','.join(f'{k}="{v}"' for k, v in labels)
+    return f"housing_{name}{{{label_str}}}"
+
+
+class PipelineMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started_at = datetime.now()
+            self._start = time.perf_counter()
+            self.counters = {}
+            self.samples = {}
+            self.stages = {}
+
+    def inc(self, name, value=1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self.samples.setdefault(key, []).append(seconds)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """Observes the duration of the block in the histogram 'name'"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    @contextmanager
+    def stage(self, name):
+        """Adds the duration of the block to stage 'name', also counting failures"""
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stage = self.stages.setdefault(name, {'seconds': 0.0, 'runs': 0, 'failures': 0})
+                stage['seconds'] += elapsed
+                stage['runs'] += 1
+                stage['failures'] += failed
+
+    def timed_stage(self, name):
+        """Decorator form of stage(), for plain and async functions"""
+        def decorator(func):
+            if asyncio.iscoroutinefunction(func):
+                @wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self.stage(name):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reported(self, run_name):
+        """Decorator for a run's entry point: starts a fresh registry and writes it when the run ends or fails"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                self.reset()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.write(run_name)
+            return wrapper
+        return decorator
+
+    def report(self):
+        """Run report as a JSON-serializable dict"""
+        with self._lock:
+            histograms = {}
+            for key, values in self.samples.items():
+                values = np.asarray(values)
+                summary = {'count': int(len(values)), 'sum': round(float(values.sum()), 4),
+                           'max': round(float(values.max()), 4)}
+                for p in REPORT_PERCENTILES:
+                    summary[f'p{p}'] = round(float(np.percentile(values, p)), 4)
+                histograms[_prometheus_name(key).removeprefix('housing_')] = summary
+            return {
+                'started_at': self.started_at.isoformat(timespec='seconds'),
+                'duration_seconds': round(time.perf_counter() - self._start, 2),
+                'stages': {name: {**stage, 'seconds': round(stage['seconds'], 3)} for name, stage in self.stages.items()},
+                'counters': {_prometheus_name(key).removeprefix('housing_'): value for key, value in self.counters.items()},
+                'histograms': histograms
+            }
+
+    def prometheus_text(self):
+        """Prometheus text exposition of counters, stage durations and histograms"""
+        lines = []
+        with self._lock:
+            lines.append("# TYPE housing_run_timestamp_seconds gauge")
+            lines.append(f"housing_run_timestamp_seconds {self.started_at.timestamp():.0f}")
+            lines.append("# TYPE housing_run_duration_seconds gauge")
+            lines.append(f"housing_run_duration_seconds {time.perf_counter() - self._start:.3f}")
+
+            lines.append("# TYPE housing_stage_seconds gauge")
+            for name, stage in self.stages.items():
+                lines.append(f'housing_stage_seconds{{stage="{name}"}} {stage["seconds"]:.3f}')
+            lines.append("# TYPE housing_stage_failures gauge")
+            for name, stage in self.stages.items():
+                lines.append(f'housing_stage_failures{{stage="{name}"}} {stage["failures"]}')
+
+            typed = set()
+            for key, value in sorted(self.counters.items()):
+                if key[0] not in typed:
+                    lines.append(f"# TYPE housing_{key[0]}_total counter")
+                    typed.add(key[0])
+                lines.append(f"{_prometheus_name((key[0] + '_total', key[1]))} {value}")
+
+            for key, values in sorted(self.samples.items()):
+                name, labels = key
+                if name not in typed:
+                    lines.append(f"# TYPE housing_{name} histogram")
+                    typed.add(name)
+                values = np.asarray(values)
+                for bound in LATENCY_BUCKETS:
+                    bucket_labels = labels + (('le', str(bound)),)
+                    lines.append(f"{_prometheus_name((name + '_bucket', bucket_labels))} {int((values <= bound).sum())}")
+                lines.append(f"{_prometheus_name((name + '_bucket', labels + (('le', '+Inf'),)))} {len(values)}")
+                lines.append(f"{_prometheus_name((name + '_sum', labels))} {values.sum():.4f}")
+                lines.append(f"{_prometheus_name((name + '_count', labels))} {len(values)}")
+        return '\n'.join(lines) + '\n'
+
+    def write(self, run_name="pipeline", directory=None):
+        """
+        Writes <run_name>_<timestamp>.json and <run_name>.prom to directory (METRICS_DIR by default).
+        The .prom file is replaced atomically so a collector never reads a partial file.
+        """
+        directory = directory or METRICS_DIR
+        os.makedirs(directory, exist_ok=True)
+        report_path = os.path.join(directory, f"{run_name}_{self.started_at.strftime('%y%m%d_%H%M%S')}.json")
+        with open(report_path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=2)
+
+        prom_path = os.path.join(directory, f"{run_name}.prom")
+        with open(prom_path + ".tmp", "w", encoding="utf-8") as f:
+            f.write(self.prometheus_text())
+        os.replace(prom_path + ".tmp", prom_path)
+        print(f"Metrics written to {report_path} and {prom_path}")
+        return report_path
+
+
+metrics = PipelineMetrics()
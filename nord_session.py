@@ -2,7 +2,10 @@ from requests_html import AsyncHTMLSession
 from requests.exceptions import RequestException
 import asyncio
 import os
+from urllib.parse import urlsplit
 from functools import wraps
+from contextlib import asynccontextmanager
+from metrics_operations import metrics
 from dotenv import load_dotenv
 load_dotenv()
 
@@ -19,6 +22,13 @@ class ProxySetupError(Exception):
     pass
 
 class NordVPNSession:
+    """
+    Session that routes every request through a NordVPN SOCKS proxy, rotating proxies on failure.
+    Concurrent requests share the current session; a rotation replaces it for new requests, and the old one
+    is closed once the requests still running on it have finished.
+    With SCRAPE_REPLAY_URL set (e.g. http://127.0.0.1:8765, see benchmarks/replay_server.py) requests go
+    directly to that server instead, as <replay url>/<host><path>, and no NordVPN credentials are needed.
+    """
 
     def __init__(self, max_retries = 10):
         self.addresses = [
@@ -30,13 +40,17 @@ class NordVPNSession:
             "chicago.us.socks.nordhold.net", "phoenix.us.socks.nordhold.net"
         ]
         self.proxy_index: int = 0
+        self.replay_url = os.getenv("SCRAPE_REPLAY_URL", "").rstrip("/") or None
         self.nord_user = os.getenv("NORD_USER")
         self.nord_pass = os.getenv("NORD_PASS")
-        if not self.nord_user or not self.nord_pass:
+        if not self.replay_url and (not self.nord_user or not self.nord_pass):
             raise ValueError("Environment variables NORD_USER and NORD_PASS must be set.")
         self.session = AsyncHTMLSession()
         self.naked_ip: str = None
         self.max_retries = max_retries
+        # Requests in flight per session, and replaced sessions waiting for theirs to finish before closing
+        self._in_flight = {}
+        self._retired = set()
 
     def __getattr__(self, name):
         """
@@ -47,15 +61,25 @@ class NordVPNSession:
 
 
     async def create_and_configure_session(self):
-        if self.session:
-            await self.session.close()
+        old_session = self.session
         self.session = AsyncHTMLSession()
         self.session.headers.update({'user-agent': USER_AGENT})
+        if old_session:
+            if self._in_flight.get(old_session):
+                self._retired.add(old_session)
+            else:
+                await old_session.close()
+        if self.replay_url:
+            return
         proxy_address = self.addresses[self.proxy_index]
         proxy_url = f"socks5://{self.nord_user}:{self.nord_pass}@{proxy_address}:1080"
         self.session.proxies.update({"http": proxy_url, "https": proxy_url})
 
     async def initialize(self):
+        if self.replay_url:
+            print(f"Replay mode: requests go to {self.replay_url}, no proxy.")
+            await self.create_and_configure_session()
+            return
         self.naked_ip = await self.get_ip(use_proxy=False)
         if not self.naked_ip:
             print("Can't verify naked IP. Aborting.")
@@ -67,10 +91,26 @@ class NordVPNSession:
                 print(f"Proxy IP is different from naked IP. \\ Proxy IP: {proxy_ip} \\ Naked IP: {self.naked_ip} \\ That's fine, continuing process.")
                 return
             self.proxy_index = (self.proxy_index + 1) % len(self.addresses) # Rotating proxy
+            metrics.inc('proxy_rotations', reason='setup')
             print(f"Proxy check failed or IP is naked. Rotating to index {self.proxy_index}...")
 
         raise ProxySetupError(f"Failed to establish a working proxy after {self.max_retries} attempts.")
 
+    @asynccontextmanager
+    async def _lease(self):
+        """The current session, counted as in use until the block ends (a retired session closes after its last lease)"""
+        session = self.session
+        self._in_flight[session] = self._in_flight.get(session, 0) + 1
+        try:
+            yield session
+        finally:
+            self._in_flight[session] -= 1
+            if not self._in_flight[session]:
+                del self._in_flight[session]
+                if session in self._retired:
+                    self._retired.discard(session)
+                    await session.close()
+
     async def get_ip(self, use_proxy: bool) -> str:
         active_session = self.session if use_proxy else AsyncHTMLSession()
         try:
@@ -90,10 +130,20 @@ class NordVPNSession:
         """
         Performs a GET request with automatic retry and proxy rotation on failure.
         """
+        if self.replay_url:
+            parts = urlsplit(url)
+            url = f"{self.replay_url}/{parts.netloc}{parts.path}" + (f"?{parts.query}" if parts.query else "")
         for attempt in range(self.max_retries):
+            if attempt:
+                metrics.inc('http_retries')
+            session = self.session
             try:
-                response = await self.session.get(url, **kwargs)
+                async with self._lease() as session:
+                    with metrics.timer('http_request_seconds'):
+                        response = await session.get(url, **kwargs)
+                metrics.inc('http_requests', status=response.status_code)
                 if response.status_code == 200:
+                    metrics.inc('bytes_downloaded', len(response.content))
                     return response
                 elif response.status_code == 404:
                     print(f"Error 404 recieved on {url}.")
@@ -106,21 +156,28 @@ class NordVPNSession:
                 else:
                     print(f"Request failed with status {response.status_code}. Rotating proxy and retrying ({attempt + 1}/{self.max_retries})...")
             except Exception as e:
+                metrics.inc('http_requests', status='error')
                 print(f"Request failed with error: {e}. Rotating proxy and retrying ({attempt + 1}/{self.max_retries})...")
             
-            # Rotate proxy
-            self.proxy_index = (self.proxy_index + 1) % len(self.addresses)
-            await self.create_and_configure_session()
+            # Rotate proxy, unless a concurrent request already replaced the session this one used
+            if session is self.session:
+                self.proxy_index = (self.proxy_index + 1) % len(self.addresses)
+                metrics.inc('proxy_rotations', reason='request')
+                await self.create_and_configure_session()
             
+        metrics.inc('http_failures')
         raise Exception(f"Failed to fetch {url} after {self.max_retries} attempts.")
 
 def with_nord_session(func):
     """
     Async decorator that initializes a NordVPNSession, passes it
     to the decorated function as the 'nord' argument, and closes it afterwards.
+    A session passed in by the caller as 'nord' is used as is and left open.
     """
     @wraps(func)
     async def wrapper(*args,**kwargs):
+        if kwargs.get('nord') is not None:
+            return await func(*args,**kwargs)
         print("Wrapper initializing NordSession...")
         nord = NordVPNSession()
         await nord.initialize()
@@ -0,0 +1,207 @@
+import hashlib
+import numbers
+import pandas as pd
+from sqlalchemy import text, inspect
+from description_operations import migrate_descriptions
+from stream_operations import read_keyset_pages
+from metrics_operations import metrics
+
+### Normalized storage ###
+# listings:     one row per distinct version of a listing's static attributes (address, coordinates, area, ...),
+#               keyed by (listing_id, attributes_hash)
+# observations: one narrow row per kept sighting (prices, source file) pointing at the attributes version
+# properties:   after migrate_to_normalized, a view joining the two (plus descriptions) with the original
+#               column names, so every reader of properties keeps working. The old table is kept as properties_legacy.
+
+STATIC_COLUMNS = [
+    'URL', 'Address', 'Disposition', 'Area (m2)', 'Available from', 'Tags',
+    'Description hash', 'Latitude', 'Longitude'
+]
+PRICE_COLUMNS = ['Rent (CZK)', 'Utilities (CZK)', 'Services (CZK)', 'Fee']
+OBSERVATION_COLUMNS = ['listing_id', 'Date obtained'] + PRICE_COLUMNS + ['attributes_hash', 'Source file', 'bb_object_name']
+
+MIGRATION_CHUNK_SIZE = 50000
+
+PROPERTIES_VIEW = """
+    SELECT
+        o.listing_id, l.URL, l.Address, l.Disposition, l.`Area (m2)`,
+        o.`Rent (CZK)`, o.`Utilities (CZK)`, o.`Services (CZK)`, o.Fee,
+        l.`Available from`, l.Tags, d.Description,
+        l.Latitude, l.Longitude,
+        o.`Source file`, o.bb_object_name, o.`Date obtained`,
+        l.`Description hash`
+    FROM observations o
+    INNER JOIN listings l ON l.listing_id = o.listing_id AND l.attributes_hash = o.attributes_hash
+    LEFT JOIN descriptions d ON d.description_hash = l.`Description hash`
+"""
+
+
+def hash_value(value):
+    """String form of a value for row hashes: numbers hash the same from JSON (int) and from the database (float)"""
+    if value is None or (isinstance(value, float) and value != value):
+        return ''
+    if isinstance(value, numbers.Number):
+        return repr(float(value))
+    return str(value)
+
+
+def attributes_hash(df):
+    """SHA-1 per row over the static attribute columns"""
+    columns = [df[col].tolist() if col in df.columns else [None] * len(df) for col in STATIC_COLUMNS]
+    return [
+        hashlib.sha1('\x1f'.join(hash_value(v) for v in values).encode('utf-8')).hexdigest()
+        for values in zip(*columns)
+    ]
+
+
+def is_normalized(engine):
+    """True once migrate_to_normalized has replaced the properties table by the compatibility view"""
+    return 'properties' in inspect(engine).get_view_names()
+
+
+def _create_normalized_tables(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS listings (
+            listing_id BIGINT NOT NULL,
+            attributes_hash CHAR(40) NOT NULL,
+            URL VARCHAR(512),
+            Address VARCHAR(512),
+            Disposition VARCHAR(32),
+            `Area (m2)` DOUBLE,
+            `Available from` VARCHAR(10),
+            Tags TEXT,
+            `Description hash` CHAR(40),
+            Latitude DOUBLE,
+            Longitude DOUBLE,
+            first_seen DATE NOT NULL,
+            PRIMARY KEY (listing_id, attributes_hash)
+        );
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS observations (
+            listing_id BIGINT NOT NULL,
+            `Date obtained` DATE NOT NULL,
+            `Rent (CZK)` INT,
+            `Utilities (CZK)` INT,
+            `Services (CZK)` INT,
+            Fee INT,
+            attributes_hash CHAR(40) NOT NULL,
+            `Source file` VARCHAR(255),
+            bb_object_name VARCHAR(255),
+            PRIMARY KEY (listing_id, `Date obtained`)
+        );
+    """))
+
+
+def _stage(engine, df):
+    """Writes rows with properties columns to the listings/observations staging tables"""
+    df = df.assign(listing_id=pd.to_numeric(df['listing_id']).astype('int64'), attributes_hash=attributes_hash(df))
+    listings = df[['listing_id', 'attributes_hash'] + [c for c in STATIC_COLUMNS if c in df.columns]]
+    listings = listings.assign(first_seen=df['Date obtained'])
+    listings = listings.sort_values('first_seen').drop_duplicates(['listing_id', 'attributes_hash'])
+    listings.to_sql("listings_staging", engine, if_exists="replace", index=False)
+    df[[c for c in OBSERVATION_COLUMNS if c in df.columns]].to_sql("observations_staging", engine, if_exists="replace", index=False)
+    return len(listings), len(df)
+
+
+def _insert_staged(conn):
+    static = ', '.join(f"`{c}`" for c in STATIC_COLUMNS)
+    observed = ', '.join(f"`{c}`" for c in OBSERVATION_COLUMNS)
+    conn.execute(text(f"""
+        INSERT INTO listings (listing_id, attributes_hash, {static}, first_seen)
+        SELECT listing_id, attributes_hash, {static}, first_seen FROM listings_staging
+        ON DUPLICATE KEY UPDATE first_seen = LEAST(first_seen, VALUES(first_seen));
+    """))
+    conn.execute(text(f"""
+        INSERT IGNORE INTO observations ({observed})
+        SELECT {observed} FROM observations_staging;
+    """))
+
+
+def dedup_observations(conn):
+    """
+    Same SCD rule as the properties dedup (keep first appearance, changes and the latest sighting),
+    applied to the narrow observations table and only to the listings in observations_staging.
+    """
+    comparison = " AND ".join(f"o.`{c}` <=> prev.`{c}`" for c in PRICE_COLUMNS + ['attributes_hash'])
+    result = conn.execute(text(f"""
+        DELETE o
+        FROM observations o
+        INNER JOIN (
+            SELECT
+                listing_id,
+                `Date obtained`,
+                LAG(`Date obtained`) OVER (PARTITION BY listing_id ORDER BY `Date obtained` ASC) AS prev_date,
+                ROW_NUMBER() OVER (PARTITION BY listing_id ORDER BY `Date obtained` DESC) AS rn_desc
+            FROM observations
+            WHERE listing_id IN (SELECT listing_id FROM observations_staging)
+        ) navigation ON o.listing_id = navigation.listing_id AND o.`Date obtained` = navigation.`Date obtained`
+        INNER JOIN observations prev
+            ON prev.listing_id = navigation.listing_id AND prev.`Date obtained` = navigation.prev_date
+        WHERE ( {comparison} )
+          AND navigation.rn_desc > 1
+    """))
+    return result.rowcount
+
+
+def upload_normalized(engine, df_today):
+    """Daily write path once the properties table is normalized: upsert versions, insert sightings, dedup"""
+    n_versions, n_rows = _stage(engine, df_today)
+    with engine.begin() as conn:
+        _insert_staged(conn)
+        deleted = dedup_observations(conn)
+    print(f"✅ Uploaded {n_rows} observations ({n_versions} attribute versions) to normalized storage")
+    print(f"🗑️ Removed {deleted} redundant intermediate observations.")
+    metrics.inc('rows_deleted', deleted, table='observations')
+
+
+def replace_normalized(engine, df):
+    """Backfill write path: replaces the observations of the staged listings and days, then dedups them"""
+    n_versions, n_rows = _stage(engine, df)
+    with engine.begin() as conn:
+        conn.execute(text("""
+            DELETE o
+            FROM observations o
+            INNER JOIN observations_staging s ON o.listing_id = s.listing_id AND o.`Date obtained` = s.`Date obtained`
+        """))
+        _insert_staged(conn)
+        deleted = dedup_observations(conn)
+    print(f"✅ Replaced {n_rows} observations ({n_versions} attribute versions) in normalized storage")
+    metrics.inc('rows_deleted', deleted, table='observations')
+
+
+def migrate_to_normalized(engine):
+    """
+    One-off migration: copies properties into listings/observations in chunks, then renames the table to
+    properties_legacy and creates the properties compatibility view in its place.
+    Description text is moved to the descriptions table first (migrate_descriptions).
+    Revert with: DROP VIEW properties; RENAME TABLE properties_legacy TO properties;
+    """
+    if is_normalized(engine):
+        print("properties is already normalized")
+        return
+
+    migrate_descriptions(engine)
+    with engine.begin() as conn:
+        _create_normalized_tables(conn)
+
+    columns = ', '.join(f"`{c}`" for c in ['listing_id', 'Date obtained'] + STATIC_COLUMNS + PRICE_COLUMNS
+                        + ['Source file', 'bb_object_name'])
+    total = 0
+    # Keyset pages over idx_id_date: one page of properties in memory, and no read left open while the
+    # page is staged and inserted (observations is keyed on the same two columns)
+    for chunk in read_keyset_pages(engine, columns, "properties", ('listing_id', 'Date obtained'),
+                                   page_size=MIGRATION_CHUNK_SIZE):
+        _stage(engine, chunk)
+        with engine.begin() as conn:
+            _insert_staged(conn)
+        total += len(chunk)
+        print(f"Migrated {total} rows")
+
+    with engine.begin() as conn:
+        conn.execute(text("RENAME TABLE properties TO properties_legacy"))
+        conn.execute(text(f"CREATE VIEW properties AS {PROPERTIES_VIEW}"))
+        versions = conn.execute(text("SELECT COUNT(*) FROM listings")).scalar()
+        observations = conn.execute(text("SELECT COUNT(*) FROM observations")).scalar()
+    print(f"Normalized storage ready: {observations} observations, {versions} listing versions "
+          f"(from {total} properties rows, kept as properties_legacy)")
@@ -0,0 +1,152 @@
+import hashlib
+import pandas as pd
+from sqlalchemy import text
+from normalized_operations import attributes_hash, PRICE_COLUMNS, hash_value
+from stream_operations import read_key_pages
+
+### Presence intervals ###
+# listing_presence holds one row per (listing_id, version): a stretch of days a listing was on offer with
+# unchanged data. The daily load extends the open interval of every listing seen again with one set-based
+# UPDATE (last_seen = today) and opens a new version only when the data changed or the listing came back
+# after a gap. "Available today" is then last_seen = today on an index, and a listing's timeline is a
+# primary key range instead of a scan over its observation rows.
+
+# A listing missing for up to this many days (failed downloads, skipped runs) still extends its interval
+PRESENCE_MAX_GAP_DAYS = 3
+# Listings per page read by rebuild_presence
+PRESENCE_REBUILD_LISTINGS = 20000
+
+
+def state_hash(df):
+    """SHA-1 per row over the static attributes and the price columns"""
+    prices = [df[col].tolist() for col in PRICE_COLUMNS]
+    return [
+        hashlib.sha1((attributes + '\x1f' + '\x1f'.join(hash_value(v) for v in values)).encode('utf-8')).hexdigest()
+        for attributes, values in zip(attributes_hash(df), zip(*prices))
+    ]
+
+
+def _create_presence_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS listing_presence (
+            listing_id BIGINT NOT NULL,
+            version INT NOT NULL,
+            first_seen DATE NOT NULL,
+            last_seen DATE NOT NULL,
+            state_hash CHAR(40) NOT NULL,
+            `Rent (CZK)` INT,
+            `Utilities (CZK)` INT,
+            `Services (CZK)` INT,
+            PRIMARY KEY (listing_id, version),
+            INDEX idx_last_seen (last_seen)
+        );
+    """))
+
+
+def _presence_rows(df):
+    return pd.DataFrame({
+        'listing_id': pd.to_numeric(df['listing_id']).astype('int64').to_numpy(),
+        'seen': pd.to_datetime(df['Date obtained']).dt.date.to_numpy(),
+        'state_hash': state_hash(df),
+        'Rent (CZK)': df['Rent (CZK)'].to_numpy(),
+        'Utilities (CZK)': df['Utilities (CZK)'].to_numpy(),
+        'Services (CZK)': df['Services (CZK)'].to_numpy()
+    })
+
+
+def update_presence(engine, df_today):
+    """
+    Daily step: extends the latest interval of each listing in df_today when its state is unchanged and the
+    gap since last_seen is at most PRESENCE_MAX_GAP_DAYS, otherwise appends the next version.
+    Safe to rerun for the same day.
+    """
+    rows = _presence_rows(df_today).drop_duplicates('listing_id', keep='last')
+    with engine.begin() as conn:
+        _create_presence_table(conn)
+    rows.to_sql("presence_staging", engine, if_exists="replace", index=False)
+
+    with engine.begin() as conn:
+        extended = conn.execute(text("""
+            UPDATE listing_presence p
+            INNER JOIN (
+                SELECT listing_id, MAX(version) AS version
+                FROM listing_presence
+                WHERE listing_id IN (SELECT listing_id FROM presence_staging)
+                GROUP BY listing_id
+            ) latest ON latest.listing_id = p.listing_id AND latest.version = p.version
+            INNER JOIN presence_staging s ON s.listing_id = p.listing_id
+            SET p.last_seen = s.seen
+            WHERE p.state_hash = s.state_hash
+              AND s.seen > p.last_seen
+              AND DATEDIFF(s.seen, p.last_seen) <= :max_gap
+        """), {'max_gap': PRESENCE_MAX_GAP_DAYS + 1}).rowcount
+
+        opened = conn.execute(text("""
+            INSERT INTO listing_presence
+                (listing_id, version, first_seen, last_seen, state_hash, `Rent (CZK)`, `Utilities (CZK)`, `Services (CZK)`)
+            SELECT
+                s.listing_id, COALESCE(latest.version, 0) + 1, s.seen, s.seen, s.state_hash,
+                s.`Rent (CZK)`, s.`Utilities (CZK)`, s.`Services (CZK)`
+            FROM presence_staging s
+            LEFT JOIN (
+                SELECT listing_id, MAX(version) AS version, MAX(last_seen) AS last_seen
+                FROM listing_presence
+                WHERE listing_id IN (SELECT listing_id FROM presence_staging)
+                GROUP BY listing_id
+            ) latest ON latest.listing_id = s.listing_id
+            WHERE latest.last_seen IS NULL OR latest.last_seen < s.seen
+        """)).rowcount
+    print(f"Presence intervals: {extended} extended, {opened} opened")
+
+
+def _history_versions(df):
+    """
+    listing_presence rows of complete listing histories (properties rows). Each kept row lasts until the
+    day before the listing's next row, consecutive rows with the same state form one version.
+    """
+    df = df.sort_values(['listing_id', 'Date obtained'], kind='stable')
+    rows = _presence_rows(df)
+
+    seen = pd.to_datetime(rows['seen'])
+    next_seen = seen.groupby(rows['listing_id']).shift(-1)
+    rows['first_seen'] = rows.pop('seen')
+    rows['last_seen'] = (next_seen - pd.Timedelta(days=1)).fillna(seen).dt.date
+
+    # Consecutive rows with the same state (the kept latest sighting repeats the previous row) form one version
+    starts = (rows['listing_id'] != rows['listing_id'].shift()) | (rows['state_hash'] != rows['state_hash'].shift())
+    rows['version'] = starts.astype(int).groupby(rows['listing_id']).cumsum()
+    rows = rows.groupby(['listing_id', 'version'], as_index=False, sort=False).agg({
+        'first_seen': 'first', 'last_seen': 'last', 'state_hash': 'first',
+        'Rent (CZK)': 'first', 'Utilities (CZK)': 'first', 'Services (CZK)': 'first'
+    })
+    return rows[['listing_id', 'version', 'first_seen', 'last_seen', 'state_hash',
+                 'Rent (CZK)', 'Utilities (CZK)', 'Services (CZK)']]
+
+
+def rebuild_presence(engine):
+    """
+    Backfills listing_presence from the deduplicated properties history.
+    Dedup keeps first appearances, changes and the latest sighting only, so each kept row is taken to
+    last until the day before the listing's next row (the last row ends on its own date); gaps in the
+    past cannot be recovered and are not split into separate versions.
+    properties is read in pages of PRESENCE_REBUILD_LISTINGS whole listings (read_key_pages), each page is
+    written before the next one is read.
+    Rows stored before migrate_descriptions have no `Description hash` yet; it is computed in the query the
+    same way the migration does (SHA1 of the text, equal to description_hash of the daily rows), so the
+    rebuilt state hashes match the next daily update_presence whichever of the two runs first.
+    """
+    with engine.begin() as conn:
+        _create_presence_table(conn)
+        conn.execute(text("DELETE FROM listing_presence"))
+
+    columns = """listing_id, `Date obtained`, URL, Address, Disposition, `Area (m2)`, `Available from`, Tags,
+        COALESCE(`Description hash`, SHA1(Description)) AS `Description hash`,
+        Latitude, Longitude, `Rent (CZK)`, `Utilities (CZK)`, `Services (CZK)`, Fee"""
+    n_versions = n_listings = 0
+    for df in read_key_pages(engine, columns, "properties", "listing_id",
+                             keys_per_page=PRESENCE_REBUILD_LISTINGS, order_by="`Date obtained`"):
+        rows = _history_versions(df)
+        rows.to_sql("listing_presence", engine, if_exists="append", index=False, chunksize=10000)
+        n_versions += len(rows)
+        n_listings += rows['listing_id'].nunique()
+    print(f"Presence intervals rebuilt: {n_versions} versions of {n_listings} listings")
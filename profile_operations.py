@@ -0,0 +1,84 @@
+"""
+Per-stage CPU and memory profiling for pipeline runs
+
+StageProfiler.stage(name) wraps a stage in cProfile and tracemalloc when that stage is enabled, and writes to
+PROFILE_DIR (default "profiles"):
+  <run>_<stage>.prof        cProfile stats (snakeviz, `python -m pstats`, ...)
+  <run>_<stage>.txt         top functions by cumulative time, and the biggest allocation sites at the peak
+  <run>_memory.json         seconds and peak traced memory of every profiled stage
+cProfile only sees the thread that runs the stage; work done in asyncio.to_thread and in worker processes
+(image workers) is not in the .prof. tracemalloc covers every thread of the process.
+"""
+import cProfile
+import io
+import json
+import os
+import pstats
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Lines of the text summaries
+TOP_FUNCTIONS = 40
+TOP_ALLOCATIONS = 25
+
+
+class StageProfiler:
+    def __init__(self, stages=(), profile_dir=None, run_name=None):
+        self.stages = set(stages)
+        self.profile_dir = profile_dir or PROFILE_DIR
+        self.run_name = run_name or datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.results = {}
+
+    def enabled(self, name):
+        return name in self.stages
+
+    @contextmanager
+    def stage(self, name):
+        """Profiles the block as stage 'name' if enabled, otherwise runs it as is"""
+        if not self.enabled(name):
+            yield
+            return
+
+        started_tracing = not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start(10)
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        profile = cProfile.Profile()
+        start = time.perf_counter()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            seconds = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            if started_tracing:
+                tracemalloc.stop()
+            self._write(name, profile, snapshot, seconds, peak, baseline)
+
+    def _write(self, name, profile, snapshot, seconds, peak, baseline):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        base = os.path.join(self.profile_dir, f"{self.run_name}_{name}")
+        profile.dump_stats(f"{base}.prof")
+
+        summary = io.StringIO()
+        summary.write(f"Stage {name}: {seconds:.2f}s, peak traced memory {peak / 2**20:.1f} MiB "
+                      f"(+{(peak - baseline) / 2**20:.1f} MiB over the start of the stage)\n\n")
+        pstats.Stats(profile, stream=summary).sort_stats('cumulative').print_stats(TOP_FUNCTIONS)
+        summary.write("\nLargest allocation sites still held at the end of the stage:\n")
+        for stat in snapshot.statistics('lineno')[:TOP_ALLOCATIONS]:
+            summary.write(f"{stat.size / 2**20:9.2f} MiB {stat.count:9d} blocks  {stat.traceback}\n")
+        with open(f"{base}.txt", "w", encoding="utf-8") as f:
+            f.write(summary.getvalue())
+
+        self.results[name] = {'seconds': round(seconds, 3), 'peak_memory_bytes': peak,
+                              'stage_memory_bytes': peak - baseline}
+        with open(os.path.join(self.profile_dir, f"{self.run_name}_memory.json"), "w", encoding="utf-8") as f:
+            json.dump(self.results, f, indent=2)
+        print(f"Profile of stage {name} written to {base}.prof / .txt "
+              f"({seconds:.1f}s, peak {peak / 2**20:.1f} MiB)")
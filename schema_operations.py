@@ -0,0 +1,173 @@
+import pandas as pd
+from sqlalchemy import text, inspect
+
+### Schema management for the properties table ###
+# to_sql used to create properties with inferred types (TEXT ids and dates, DOUBLE prices), which forced the
+# prefix index listing_id(255) and made every index on dates or ids larger and slower than needed.
+# The typed definition below is used to create the table and to migrate an existing one in place.
+
+PROPERTIES_COLUMNS = [
+    ('listing_id', 'BIGINT NOT NULL'),
+    ('URL', 'VARCHAR(512)'),
+    ('Address', 'VARCHAR(512)'),
+    ('Disposition', 'VARCHAR(32)'),
+    ('Area (m2)', 'DOUBLE'),
+    ('Rent (CZK)', 'INT'),
+    ('Utilities (CZK)', 'INT'),
+    ('Services (CZK)', 'INT'),
+    ('Fee', 'INT'),
+    ('Available from', 'DATE'),
+    ('Tags', 'TEXT'),
+    ('Description', 'MEDIUMTEXT'),
+    # DOUBLE rather than DECIMAL: values are rounded to 5 decimals at extraction and pandas reads DECIMAL as
+    # Python Decimal objects, which the numeric code paths do not accept
+    ('Latitude', 'DOUBLE'),
+    ('Longitude', 'DOUBLE'),
+    ('Source file', 'VARCHAR(255)'),
+    ('bb_object_name', 'VARCHAR(255)'),
+    ('Date obtained', 'DATE NOT NULL'),
+    ('Description hash', 'CHAR(40)')
+]
+
+# Same expression as the price filter of the map API, so the functional index part matches it
+TOTAL_PRICE_EXPRESSION = "COALESCE(`Rent (CZK)`,0) + COALESCE(`Utilities (CZK)`,0) + COALESCE(`Services (CZK)`,0)"
+
+PROPERTIES_INDEXES = {
+    # Dedup window (PARTITION BY listing_id ORDER BY date), its self-joins and the detail endpoint
+    'idx_id_date': "(listing_id, `Date obtained`)",
+    # Viewport queries: latitude range, longitude checked in the index, date for ordering
+    'idx_coords_date': "(Latitude, Longitude, `Date obtained`)",
+    # Disposition filter combined with the total price filter
+    'idx_disposition_price': f"(Disposition, ({TOTAL_PRICE_EXPRESSION}))"
+}
+# The same indexes on an untyped to_sql table, where listing_id and Disposition are TEXT columns
+# that MySQL can only index by prefix (error 1170 otherwise)
+LEGACY_PROPERTIES_INDEXES = {
+    **PROPERTIES_INDEXES,
+    'idx_id_date': "(`listing_id`(255), `Date obtained`)",
+    'idx_disposition_price': f"(`Disposition`(32), ({TOTAL_PRICE_EXPRESSION}))"
+}
+
+# Representative queries and the index each should use
+PLAN_CHECKS = [
+    ('dedup previous-row lookup', 'idx_id_date',
+     "SELECT * FROM properties WHERE listing_id = :listing_id AND `Date obtained` = :date"),
+    ('listing detail', 'idx_id_date',
+     "SELECT * FROM properties WHERE listing_id = :listing_id"),
+    ('map viewport', 'idx_coords_date',
+     """SELECT p.listing_id, p.Latitude, p.Longitude, p.`Date obtained`
+        FROM properties p
+        WHERE p.Latitude BETWEEN :lat_min AND :lat_max AND p.Longitude BETWEEN :lng_min AND :lng_max
+        ORDER BY p.`Date obtained` DESC LIMIT 2000"""),
+    ('disposition and price filter', 'idx_disposition_price',
+     """SELECT p.listing_id FROM properties p
+        WHERE p.Disposition IN (:disposition)
+          AND (COALESCE(p.`Rent (CZK)`,0) + COALESCE(p.`Utilities (CZK)`,0) + COALESCE(p.`Services (CZK)`,0)) <= :price_max""")
+]
+PLAN_CHECK_PARAMS = {
+    'listing_id': 1, 'date': '2026-01-01',
+    'lat_min': 50.07, 'lat_max': 50.09, 'lng_min': 14.40, 'lng_max': 14.44,
+    'disposition': '2+kk', 'price_max': 20000
+}
+
+
+def _column_definitions():
+    return ',\n'.join(f"`{name}` {definition}" for name, definition in PROPERTIES_COLUMNS)
+
+
+def _table_kind(engine):
+    inspector = inspect(engine)
+    if 'properties' in inspector.get_view_names():
+        return 'view'
+    if inspector.has_table('properties'):
+        return 'table'
+    return None
+
+
+def ensure_properties_schema(engine):
+    """
+    Creates properties with the typed schema and its indexes if it does not exist yet, otherwise adds
+    missing indexes. Untyped legacy tables get prefix key parts on their TEXT columns until migrated.
+    Nothing to do when properties is the normalized compatibility view.
+    """
+    kind = _table_kind(engine)
+    if kind == 'view':
+        return
+    if kind is None:
+        print("Creating typed 'properties' table")
+        indexes = ',\n'.join(f"INDEX {name} {columns}" for name, columns in PROPERTIES_INDEXES.items())
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE TABLE properties (\n{_column_definitions()},\n{indexes}\n);"))
+        return
+
+    inspector = inspect(engine)
+    existing = {i['name'] for i in inspector.get_indexes('properties')}
+    id_type = next(c['type'] for c in inspector.get_columns('properties') if c['name'] == 'listing_id')
+    typed = 'INT' in str(id_type).upper()
+    for name, columns in (PROPERTIES_INDEXES if typed else LEGACY_PROPERTIES_INDEXES).items():
+        if name in existing:
+            continue
+        print(f"Creating index '{name}' on properties {columns}")
+        with engine.begin() as conn:
+            conn.execute(text(f"CREATE INDEX {name} ON properties {columns}"))
+
+
+def migrate_properties_schema(engine):
+    """
+    Converts an existing to_sql-created properties table to the typed schema in a single ALTER TABLE
+    (one table rebuild): modifies every column and replaces the prefix index by the composite indexes.
+    Refuses to run if any listing_id is not numeric, as BIGINT conversion would corrupt it.
+    """
+    kind = _table_kind(engine)
+    if kind != 'table':
+        print(f"properties is {'a view' if kind else 'missing'}, nothing to migrate")
+        return
+
+    with engine.connect() as conn:
+        bad_ids = conn.execute(text("SELECT COUNT(*) FROM properties WHERE listing_id NOT REGEXP '^[0-9]+$'")).scalar()
+    if bad_ids:
+        print(f"❌ {bad_ids} rows have a non-numeric listing_id, fix them before migrating")
+        return
+
+    inspector = inspect(engine)
+    existing_columns = {c['name'] for c in inspector.get_columns('properties')}
+    existing_indexes = {i['name'] for i in inspector.get_indexes('properties')}
+
+    changes = []
+    for name, definition in PROPERTIES_COLUMNS:
+        verb = 'MODIFY COLUMN' if name in existing_columns else 'ADD COLUMN'
+        changes.append(f"{verb} `{name}` {definition}")
+    for name, columns in PROPERTIES_INDEXES.items():
+        if name in existing_indexes:
+            changes.append(f"DROP INDEX {name}")
+        changes.append(f"ADD INDEX {name} {columns}")
+
+    print("Migrating 'properties' to the typed schema (rebuilds the table)")
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE properties\n" + ',\n'.join(changes)))
+    print("Migration done")
+    check_query_plans(engine)
+
+
+def check_query_plans(engine):
+    """
+    Runs EXPLAIN on the dedup, detail, viewport and filter queries and reports the index each one uses.
+    Returns a DataFrame with one row per check; 'ok' is False when the expected index is not chosen.
+    """
+    results = []
+    with engine.connect() as conn:
+        for name, expected, query in PLAN_CHECKS:
+            plan = conn.execute(text(f"EXPLAIN {query}"), PLAN_CHECK_PARAMS).mappings().first()
+            key = plan.get('key') if plan else None
+            results.append({
+                'query': name, 'expected': expected, 'key': key,
+                'access': plan.get('type') if plan else None,
+                'rows': plan.get('rows') if plan else None,
+                'ok': key == expected
+            })
+
+    report = pd.DataFrame(results)
+    for row in report.itertuples(index=False):
+        mark = '✅' if row.ok else '⚠️'
+        print(f"{mark} {row.query}: key={row.key} (expected {row.expected}), access={row.access}, rows≈{row.rows}")
+    return report
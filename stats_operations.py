@@ -0,0 +1,236 @@
+import numpy as np
+import pandas as pd
+from sqlalchemy import text, bindparam
+from stream_operations import read_key_pages
+
+# Aggregates shared by every scope of the stats_summary table
+SUMMARY_AGGREGATES = """
+    COUNT(*),
+    COUNT(DISTINCT listing_id),
+    MIN(`Rent (CZK)`), MAX(`Rent (CZK)`), AVG(`Rent (CZK)`),
+    MIN(`Area (m2)`), MAX(`Area (m2)`), AVG(`Area (m2)`),
+    MIN(Latitude), MAX(Latitude), MIN(Longitude), MAX(Longitude),
+    AVG(Latitude), AVG(Longitude),
+    NOW()
+"""
+
+SUMMARY_COLUMNS = """
+    scope, scope_value,
+    total_records, unique_properties,
+    min_price, max_price, avg_price,
+    min_surface, max_surface, avg_surface,
+    lat_min, lat_max, lng_min, lng_max,
+    lat_center, lng_center,
+    updated_at
+"""
+
+
+def refresh_stats_summary(engine):
+    """
+    Rebuilds the 'stats_summary' table read by the web app's map header and /stats page.
+    One row with scope 'all' covers the whole table, one row per Disposition with scope 'disposition'.
+
+    Called once after each daily load. Deduplication deletes intermediate rows, so MIN/MAX/COUNT DISTINCT
+    cannot be updated from the new rows alone; the table is recomputed in two aggregate passes instead,
+    which moves the cost from every page view to once per day.
+    """
+    print("Refreshing stats summary")
+    with engine.begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS stats_summary (
+                scope VARCHAR(32) NOT NULL,
+                scope_value VARCHAR(64) NOT NULL,
+                total_records BIGINT,
+                unique_properties BIGINT,
+                min_price DOUBLE, max_price DOUBLE, avg_price DOUBLE,
+                min_surface DOUBLE, max_surface DOUBLE, avg_surface DOUBLE,
+                lat_min DOUBLE, lat_max DOUBLE, lng_min DOUBLE, lng_max DOUBLE,
+                lat_center DOUBLE, lng_center DOUBLE,
+                updated_at DATETIME NOT NULL,
+                PRIMARY KEY (scope, scope_value)
+            );
+        """))
+        conn.execute(text("DELETE FROM stats_summary;"))
+        conn.execute(text(f"""
+            INSERT INTO stats_summary ({SUMMARY_COLUMNS})
+            SELECT 'all', '', {SUMMARY_AGGREGATES}
+            FROM properties
+            WHERE Latitude IS NOT NULL AND Longitude IS NOT NULL;
+        """))
+        conn.execute(text(f"""
+            INSERT INTO stats_summary ({SUMMARY_COLUMNS})
+            SELECT 'disposition', Disposition, {SUMMARY_AGGREGATES}
+            FROM properties
+            WHERE Latitude IS NOT NULL AND Longitude IS NOT NULL
+              AND Disposition IS NOT NULL AND Disposition != ''
+            GROUP BY Disposition;
+        """))
+    print("Stats summary refreshed")
+
+
+### Rental price index ###
+# Rent per m² by grid cell, disposition and month. Each listing counts once per month it was on offer
+# (price_index_listing_months), price_index holds sums per bucket so any set of cells/dispositions
+# can be combined exactly into means and standard deviations.
+
+# Cell size of the price index grid in degrees (~5.5 km north-south, ~3.6 km east-west in Czechia)
+PRICE_INDEX_CELL_DEG = 0.05
+# Listings per page read by rebuild_price_index
+PRICE_INDEX_REBUILD_LISTINGS = 20000
+
+
+def _create_price_index_tables(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS price_index_listing_months (
+            listing_id BIGINT NOT NULL,
+            month DATE NOT NULL,
+            cell_row INT NOT NULL,
+            cell_col INT NOT NULL,
+            disposition VARCHAR(32) NOT NULL,
+            rent DOUBLE NOT NULL,
+            area DOUBLE NOT NULL,
+            PRIMARY KEY (listing_id, month),
+            INDEX idx_month (month)
+        );
+    """))
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS price_index (
+            month DATE NOT NULL,
+            cell_row INT NOT NULL,
+            cell_col INT NOT NULL,
+            disposition VARCHAR(32) NOT NULL,
+            cell_lat DOUBLE NOT NULL,
+            cell_lng DOUBLE NOT NULL,
+            listings INT NOT NULL,
+            sum_rent_m2 DOUBLE NOT NULL,
+            sum_sq_rent_m2 DOUBLE NOT NULL,
+            sum_rent DOUBLE NOT NULL,
+            sum_area DOUBLE NOT NULL,
+            PRIMARY KEY (month, cell_row, cell_col, disposition),
+            INDEX idx_disposition_month (disposition, month)
+        );
+    """))
+
+
+def price_index_rows(df):
+    """
+    Maps observation rows (properties columns plus a 'month' column) to price_index_listing_months rows.
+    Rows without coordinates, rent or a positive area are dropped.
+    """
+    df = df.dropna(subset=['Latitude', 'Longitude', 'Rent (CZK)', 'Area (m2)'])
+    df = df[df['Area (m2)'] > 0]
+    return pd.DataFrame({
+        'listing_id': pd.to_numeric(df['listing_id']).astype('int64'),
+        'month': df['month'],
+        'cell_row': np.floor(df['Latitude'] / PRICE_INDEX_CELL_DEG).astype(int),
+        'cell_col': np.floor(df['Longitude'] / PRICE_INDEX_CELL_DEG).astype(int),
+        'disposition': df['Disposition'].fillna(''),
+        'rent': df['Rent (CZK)'].astype(float),
+        'area': df['Area (m2)'].astype(float)
+    })
+
+
+def _aggregate_price_index(conn, months=None):
+    """Recomputes price_index buckets from price_index_listing_months, for the given months or for all"""
+    month_filter = "WHERE month IN :months" if months is not None else ""
+    delete = text(f"DELETE FROM price_index {month_filter}")
+    insert = text(f"""
+        INSERT INTO price_index (
+            month, cell_row, cell_col, disposition, cell_lat, cell_lng,
+            listings, sum_rent_m2, sum_sq_rent_m2, sum_rent, sum_area
+        )
+        SELECT
+            month, cell_row, cell_col, disposition,
+            (cell_row + 0.5) * {PRICE_INDEX_CELL_DEG}, (cell_col + 0.5) * {PRICE_INDEX_CELL_DEG},
+            COUNT(*), SUM(rent / area), SUM(POW(rent / area, 2)), SUM(rent), SUM(area)
+        FROM price_index_listing_months
+        {month_filter}
+        GROUP BY month, cell_row, cell_col, disposition
+    """)
+    params = {}
+    if months is not None:
+        delete = delete.bindparams(bindparam('months', expanding=True))
+        insert = insert.bindparams(bindparam('months', expanding=True))
+        params['months'] = list(months)
+    conn.execute(delete, params)
+    conn.execute(insert, params)
+
+
+def update_price_index(engine, df_today):
+    """
+    Incremental daily update: upserts today's listings into their month and recomputes only
+    the buckets of the months present in df_today.
+    """
+    df = df_today.assign(month=pd.to_datetime(df_today['Date obtained']).dt.to_period('M').dt.start_time.dt.date)
+    rows = price_index_rows(df)
+    if rows.empty:
+        print("No rows for the price index")
+        return
+
+    with engine.begin() as conn:
+        _create_price_index_tables(conn)
+    rows.to_sql("price_index_staging", engine, if_exists="replace", index=False)
+
+    with engine.begin() as conn:
+        conn.execute(text("""
+            INSERT INTO price_index_listing_months (listing_id, month, cell_row, cell_col, disposition, rent, area)
+            SELECT listing_id, month, cell_row, cell_col, disposition, rent, area
+            FROM price_index_staging
+            ON DUPLICATE KEY UPDATE
+                cell_row = VALUES(cell_row), cell_col = VALUES(cell_col),
+                disposition = VALUES(disposition), rent = VALUES(rent), area = VALUES(area);
+        """))
+        _aggregate_price_index(conn, months=sorted(rows['month'].unique()))
+    print(f"Price index updated with {len(rows)} listings")
+
+
+def _listing_month_rows(df):
+    """
+    price_index_listing_months rows of complete listing histories. Deduplication keeps only rows where data
+    changed (plus the latest), so every row is taken to hold from its date until the listing's next row and
+    is expanded over all months in that range.
+    """
+    df = df.assign(**{'Date obtained': pd.to_datetime(df['Date obtained'])})
+    df = df.sort_values(['listing_id', 'Date obtained'], kind='stable')
+
+    # Month numbers (year * 12 + month) covered by each row: up to the month before the next row starts
+    month_start = (df['Date obtained'].dt.year * 12 + df['Date obtained'].dt.month - 1).to_numpy()
+    next_date = df.groupby('listing_id')['Date obtained'].shift(-1)
+    valid_until = (next_date - pd.Timedelta(days=1)).fillna(df['Date obtained'])
+    month_end = (valid_until.dt.year * 12 + valid_until.dt.month - 1).to_numpy()
+    month_end = np.maximum(month_end, month_start)
+
+    repeats = month_end - month_start + 1
+    expanded = df.iloc[np.repeat(np.arange(len(df)), repeats)].copy()
+    offsets = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+    month_number = np.repeat(month_start, repeats) + offsets
+    months = pd.to_datetime({'year': month_number // 12, 'month': month_number % 12 + 1, 'day': 1})
+    expanded['month'] = months.dt.date.to_numpy()
+
+    # The latest row within a month represents the listing for that month
+    expanded = expanded.drop_duplicates(['listing_id', 'month'], keep='last')
+    return price_index_rows(expanded)
+
+
+def rebuild_price_index(engine):
+    """
+    Builds the price index from the full properties history (initial load or after a parser change).
+    properties is read in pages of PRICE_INDEX_REBUILD_LISTINGS whole listings (read_key_pages), each page is
+    expanded and written before the next one is read, so memory is bounded by the page, not the table.
+    """
+    with engine.begin() as conn:
+        _create_price_index_tables(conn)
+        conn.execute(text("DELETE FROM price_index_listing_months"))
+
+    columns = "listing_id, `Date obtained`, Latitude, Longitude, Disposition, `Rent (CZK)`, `Area (m2)`"
+    n_rows = n_months = 0
+    for df in read_key_pages(engine, columns, "properties", "listing_id",
+                             keys_per_page=PRICE_INDEX_REBUILD_LISTINGS, order_by="`Date obtained`"):
+        rows = _listing_month_rows(df)
+        rows.to_sql("price_index_listing_months", engine, if_exists="append", index=False, chunksize=10000)
+        n_rows += len(df)
+        n_months += len(rows)
+
+    with engine.begin() as conn:
+        _aggregate_price_index(conn)
+    print(f"Price index rebuilt from {n_rows} rows into {n_months} listing-months")
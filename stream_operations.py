@@ -0,0 +1,75 @@
+import pandas as pd
+from sqlalchemy import text
+
+### Streaming reads ###
+# pd.read_sql(..., chunksize=n) alone still lets pymysql's default cursor pull the whole result into client memory
+# before the first chunk is returned. With stream_results the connection uses an unbuffered server-side cursor
+# (SSCursor), so only one chunk of rows is held at a time. The connection is busy until the result is fully read
+# or the generator is closed: other statements have to run on a different connection.
+
+READ_CHUNK_SIZE = 10000
+
+
+def read_sql_chunks(engine, query, params=None, chunksize=READ_CHUNK_SIZE):
+    """Yields the result of query as DataFrames of at most chunksize rows, streamed from the server"""
+    if isinstance(query, str):
+        query = text(query)
+    with engine.connect() as conn:
+        conn = conn.execution_options(stream_results=True, max_row_buffer=chunksize)
+        for chunk in pd.read_sql(query, conn, params=params, chunksize=chunksize):
+            yield chunk
+
+
+def read_keyset_pages(engine, columns, table, keys, page_size=READ_CHUNK_SIZE):
+    """
+    Yields the rows of table as DataFrames of at most page_size rows, ordered by the two key columns
+    (an index prefix), each page read by its own short query after the last key of the previous one.
+    Nothing stays open between pages, so the caller can write to the database while it processes a page.
+    Rows sharing both keys with the last row of a page are skipped: use keys that are unique, or where
+    such duplicates collapse anyway (e.g. a primary key on the same columns downstream).
+    """
+    first, second = keys
+    select = f"SELECT {columns} FROM {table}"
+    order = f"ORDER BY `{first}`, `{second}` LIMIT :page_size"
+    after = None
+    while True:
+        with engine.connect() as conn:
+            if after is None:
+                page = pd.read_sql(text(f"{select} {order}"), conn, params={'page_size': page_size})
+            else:
+                page = pd.read_sql(text(f"""
+                    {select}
+                    WHERE `{first}` > :first OR (`{first}` = :first AND `{second}` > :second)
+                    {order}
+                """), conn, params={'first': after[0], 'second': after[1], 'page_size': page_size})
+        if page.empty:
+            return
+        yield page
+        last = page.iloc[-1]
+        # Plain Python values for the driver
+        after = tuple(v.item() if hasattr(v, 'item') else v for v in (last[first], last[second]))
+
+
+def read_key_pages(engine, columns, table, key, keys_per_page=READ_CHUNK_SIZE, order_by=None):
+    """
+    Yields all rows of the next keys_per_page distinct key values at a time (key ascending), one DataFrame
+    per page: the page's last key is looked up first, then its rows are read by a key range. Every value
+    of key ends up in a single page and nothing stays open between pages, so the caller can process
+    complete groups (e.g. a listing's whole history) and write to the database in between.
+    """
+    order = f"ORDER BY `{key}`" + (f", {order_by}" if order_by else "")
+    after = None
+    while True:
+        bound = f"`{key}` > :after" if after is not None else f"`{key}` IS NOT NULL"
+        params = {'after': after} if after is not None else {}
+        with engine.connect() as conn:
+            keys = conn.execute(text(f"""
+                SELECT DISTINCT `{key}` FROM {table} WHERE {bound} ORDER BY `{key}` LIMIT :keys_per_page
+            """), {**params, 'keys_per_page': keys_per_page}).scalars().all()
+            if not keys:
+                return
+            page = pd.read_sql(text(f"""
+                SELECT {columns} FROM {table} WHERE {bound} AND `{key}` <= :last {order}
+            """), conn, params={**params, 'last': keys[-1]})
+        yield page
+        after = keys[-1]
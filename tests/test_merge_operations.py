@@ -0,0 +1,82 @@
+import pandas as pd
+
+from merge_operations import image_keys, match_batch, prepare_listings
+
+DESCRIPTION = "Bright two room flat with a balcony facing the park, renovated kitchen and a cellar, close to the tram stop"
+OTHER_DESCRIPTION = "Spacious family apartment on the top floor with a terrace, two bathrooms and a garage in the courtyard"
+
+
+def listings(*rows):
+    """Daily frame rows (listing_id, latitude, longitude, area, disposition, description)"""
+    return pd.DataFrame(rows, columns=['listing_id', 'Latitude', 'Longitude', 'Area (m2)', 'Disposition', 'Description'])
+
+
+def stored(prepared, flat_ids):
+    """Prepared rows as they are read back from listing_flats"""
+    return prepared.assign(flat_id=flat_ids)
+
+
+def test_image_keys_and_prepared_ids_stay_numeric():
+    df_images = pd.DataFrame({'listing_id': ['7', '7', '8'], 'filename': ['b.webp', 'a.jpg', 'c.webp']})
+    keys = image_keys(df_images)
+    assert keys.to_dict() == {7: 'a b', 8: 'c'}
+
+    prepared = prepare_listings(listings(('7', 50.08, 14.42, 54, '2+kk', DESCRIPTION)), df_images)
+    assert prepared['listing_id'].dtype == 'int64'
+    assert prepared['image_keys'].to_list() == ['a b']
+
+
+def test_relisting_gets_its_earlier_flat_id():
+    earlier = stored(prepare_listings(listings((1, 50.0800, 14.4200, 54, '2+kk', DESCRIPTION))), [5])
+    new = prepare_listings(listings((2, 50.0801, 14.4201, 55, '2+kk', DESCRIPTION + ", available now")))
+
+    merged, next_flat_id = match_batch(new, earlier, 6)
+
+    assert merged['flat_id'].to_list() == [5]
+    assert merged['matched_listing_id'].to_list() == [1]
+    assert next_flat_id == 6
+
+
+def test_unrelated_listings_in_the_same_block_stay_apart():
+    earlier = stored(prepare_listings(listings((1, 50.0800, 14.4200, 54, '2+kk', DESCRIPTION))), [5])
+    new = prepare_listings(listings((2, 50.0801, 14.4201, 55, '2+kk', OTHER_DESCRIPTION)))
+
+    merged, next_flat_id = match_batch(new, earlier, 6)
+
+    assert merged['flat_id'].to_list() == [6]
+    assert merged['matched_listing_id'].isna().all()
+    assert next_flat_id == 7
+
+
+def test_matches_within_one_batch_share_one_id():
+    new = prepare_listings(listings(
+        (1, 50.0800, 14.4200, 54, '2+kk', DESCRIPTION),
+        (2, 50.0801, 14.4201, 54, '2+kk', DESCRIPTION),
+        (3, 50.1500, 14.5000, 80, '3+1', OTHER_DESCRIPTION)
+    ))
+
+    merged, next_flat_id = match_batch(new, stored(new.iloc[:0], []), 1)
+
+    flat_ids = merged.set_index('listing_id')['flat_id']
+    assert flat_ids[1] == flat_ids[2]
+    assert flat_ids[3] != flat_ids[1]
+    assert next_flat_id == 3
+
+
+def test_existing_flat_ids_are_never_merged():
+    # Each new listing matches a different stored flat, and the two new listings share their photos
+    earlier = stored(prepare_listings(listings(
+        (1, 50.0800, 14.4200, 54, '2+kk', DESCRIPTION),
+        (2, 50.0801, 14.4201, 54, '2+kk', OTHER_DESCRIPTION)
+    )), [5, 6])
+    df_images = pd.DataFrame({'listing_id': [3, 3, 4, 4], 'filename': ['a.webp', 'b.webp', 'a.webp', 'b.webp']})
+    new = prepare_listings(listings(
+        (3, 50.0800, 14.4201, 54, '2+kk', DESCRIPTION),
+        (4, 50.0801, 14.4200, 54, '2+kk', OTHER_DESCRIPTION)
+    ), df_images)
+
+    merged, next_flat_id = match_batch(new, earlier, 7)
+
+    assert merged['flat_id'].to_list() == [5, 6]
+    assert merged['matched_listing_id'].to_list() == [1, 2]
+    assert next_flat_id == 7
@@ -0,0 +1,76 @@
+import os
+from datetime import date
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, event, inspect
+
+from schema_operations import ensure_properties_schema, PROPERTIES_INDEXES
+
+
+def legacy_frame():
+    """A daily frame as the baseline pipeline appended it with to_sql (ids and dispositions as text)"""
+    return pd.DataFrame({
+        'listing_id': ['101', '102'],
+        'Disposition': ['2+kk', '3+1'],
+        'Rent (CZK)': [20000.0, 25000.0],
+        'Utilities (CZK)': [3000.0, None],
+        'Services (CZK)': [None, 1500.0],
+        'Latitude': [50.08, 50.09],
+        'Longitude': [14.42, 14.43],
+        'Date obtained': [date(2026, 1, 1), date(2026, 1, 2)]
+    })
+
+
+def recorded_ddl(engine):
+    """Collects CREATE INDEX statements and runs a no-op instead (SQLite has no prefix key parts)"""
+    statements = []
+
+    @event.listens_for(engine, "before_cursor_execute", retval=True)
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("CREATE INDEX"):
+            statements.append(statement)
+            return "SELECT 1", ()
+        return statement, parameters
+
+    return statements
+
+
+def test_legacy_table_gets_prefix_key_parts_on_text_columns(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.sqlite'}")
+    legacy_frame().to_sql("properties", engine, index=False)
+    statements = recorded_ddl(engine)
+
+    ensure_properties_schema(engine)
+
+    by_name = {s.split()[2]: s for s in statements}
+    assert set(by_name) == set(PROPERTIES_INDEXES)
+    assert "`listing_id`(255)" in by_name['idx_id_date']
+    assert "`Disposition`(32)" in by_name['idx_disposition_price']
+
+
+def test_existing_indexes_are_left_alone(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.sqlite'}")
+    legacy_frame().to_sql("properties", engine, index=False)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE INDEX idx_coords_date ON properties (Latitude, Longitude, `Date obtained`)")
+    statements = recorded_ddl(engine)
+
+    ensure_properties_schema(engine)
+
+    assert not any('idx_coords_date' in s for s in statements)
+    assert len(statements) == len(PROPERTIES_INDEXES) - 1
+
+
+@pytest.mark.skipif(not os.getenv("TEST_MYSQL_URL"), reason="needs a scratch MySQL 8 database in TEST_MYSQL_URL")
+def test_legacy_table_on_mysql():
+    engine = create_engine(os.environ["TEST_MYSQL_URL"])
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP TABLE IF EXISTS properties")
+    legacy_frame().to_sql("properties", engine, index=False)
+
+    ensure_properties_schema(engine)
+    ensure_properties_schema(engine)
+
+    indexes = {i['name'] for i in inspect(engine).get_indexes('properties')}
+    assert set(PROPERTIES_INDEXES) <= indexes
@@ -1,16 +1,21 @@
 # Optimized Housing Map V2
-from bottle import route, run, default_app, request, response, static_file
+from bottle import route, run, default_app, request, response, static_file, install
 import pandas as pd
+import numpy as np
 import json
 import os
 import sshtunnel
-from sqlalchemy import create_engine, text
-from sqlalchemy.pool import QueuePool
+from sqlalchemy import create_engine, text, inspect
 from datetime import datetime, date
 import time
 import threading
 import atexit
 from dotenv import load_dotenv
+from response_cache import ResponseCache, snap_to_tiles
+from listing_index import ListingIndex, aggregate_grid, description_sql
+from wire_format import FORMATS, encode_payload, negotiate_encoding, compress
+from fair_price import FairPriceEstimator, DEFAULT_K
+from request_metrics import request_metrics, TimedQueuePool
 
 # Import DB config from local module
 try:
@@ -33,6 +38,36 @@ load_dotenv()
 _engine = None
 _ssh_tunnel = None
 _db_config = DBconfig()
+_engine_lock = threading.Lock()
+
+# Per-route latency, phase timings (sql, pandas, encode, html, ...) and pool wait, served at /metrics
+install(request_metrics)
+
+# Cache for the map APIs (encoded cluster responses, per-tile listing query results),
+# dropped whenever the daily load bumps data_version
+_properties_cache = ResponseCache(
+    max_entries=int(os.getenv("API_CACHE_MAX_ENTRIES", 512)),
+    ttl_seconds=int(os.getenv("API_CACHE_TTL", 900))
+)
+DATA_VERSION_CHECK_SECONDS = 60
+# Rendered sidebars for /api/property/<id>, invalidated together with _properties_cache
+_detail_cache = ResponseCache(
+    max_entries=int(os.getenv("DETAIL_CACHE_MAX_ENTRIES", 4096)),
+    ttl_seconds=int(os.getenv("API_CACHE_TTL", 900))
+)
+# Summary statistics for the map header and /stats, read from stats_summary once per data version
+_summary_cache = ResponseCache(max_entries=1, ttl_seconds=24 * 3600)
+_data_version = None
+_data_version_checked_at = 0.0
+_data_version_lock = threading.Lock()
+# Tables present in the database, listed when the engine is created and again whenever data_version changes
+# (tables of optional migrations and rebuilds, e.g. listing_presence, may appear while the app runs)
+_tables = frozenset()
+
+# Zoom level from which /api/clusters returns individual listings instead of grid clusters
+CLUSTER_MAX_ZOOM = 15
+# Approximate on-screen size of one cluster cell in pixels
+CLUSTER_CELL_PX = 60
 
 def get_db_engine():
     """Get or create the SQLAlchemy engine with persistent SSH tunnel if needed"""
@@ -41,6 +76,15 @@ def get_db_engine():
     if _engine:
         return _engine
 
+    with _engine_lock:
+        if _engine:
+            return _engine
+        return _create_db_engine()
+
+def _create_db_engine():
+    """Create the engine, called with _engine_lock held"""
+    global _engine, _ssh_tunnel, _db_config
+
     print("Initializing database connection...")
 
     try:
@@ -65,13 +109,14 @@ def get_db_engine():
         # Create engine with connection pooling
         _engine = create_engine(
             db_url,
-            poolclass=QueuePool,
+            poolclass=TimedQueuePool,
             pool_size=5,
             max_overflow=10,
             pool_recycle=3600,
             pool_pre_ping=True
         )
         print("✅ Database engine created")
+        refresh_table_names(_engine)
         return _engine
 
     except Exception as e:
@@ -81,6 +126,24 @@ def get_db_engine():
             _ssh_tunnel = None
         return None
 
+def refresh_table_names(engine):
+    """Re-lists the tables of the database, keeps the previous list if that fails"""
+    global _tables
+    try:
+        _tables = frozenset(inspect(engine).get_table_names())
+    except Exception as e:
+        print(f"Could not list tables: {e}")
+
+def available_sql():
+    """
+    SQL condition for 'on offer today' of the properties row p (binds :today): last_seen of the listing's
+    presence interval once listing_presence exists, so it holds per listing whatever rows the filters match;
+    otherwise the row's own date, which the callers evaluate on the latest row of each listing.
+    """
+    if 'listing_presence' in _tables:
+        return "p.listing_id IN (SELECT listing_id FROM listing_presence WHERE last_seen = :today)"
+    return "p.`Date obtained` = :today"
+
 def cleanup():
     """Cleanup resources on shutdown"""
     global _engine, _ssh_tunnel
@@ -92,6 +155,64 @@ def cleanup():
 
 atexit.register(cleanup)
 
+def clear_response_caches():
+    """Drop all cached API responses"""
+    _properties_cache.clear()
+    _detail_cache.clear()
+    _summary_cache.clear()
+
+def check_data_version(engine):
+    """
+    Clears cached API responses if the pipeline has loaded new data since the last check.
+    The data_version table is polled at most once every DATA_VERSION_CHECK_SECONDS.
+    """
+    global _data_version, _data_version_checked_at
+
+    now = time.monotonic()
+    if now - _data_version_checked_at < DATA_VERSION_CHECK_SECONDS:
+        return
+    with _data_version_lock:
+        if now - _data_version_checked_at < DATA_VERSION_CHECK_SECONDS:
+            return
+        _data_version_checked_at = now
+        try:
+            with request_metrics.phase('version_check'), engine.connect() as conn:
+                version = conn.execute(text("SELECT updated_at FROM data_version WHERE id = 1")).scalar()
+        except Exception as e:
+            # Table is created by the first pipeline run after this feature, until then rely on TTL
+            print(f"Could not read data_version: {e}")
+            return
+        if version != _data_version:
+            if _data_version is not None:
+                print(f"New data loaded at {version}, clearing response caches")
+                if _listing_index:
+                    _listing_index.refresh()
+            refresh_table_names(engine)
+            clear_response_caches()
+            _data_version = version
+
+# Comparable-price estimator over the current listing snapshot, rebuilt with every snapshot
+_fair_price = None
+
+def on_listing_index_refresh():
+    """Runs in the listing index thread after a new snapshot is loaded"""
+    global _fair_price
+    clear_response_caches()
+    try:
+        _fair_price = FairPriceEstimator(_listing_index.snapshot)
+    except Exception as e:
+        print(f"❌ Fair-price estimator build failed: {e}")
+
+# In-memory listing index, loaded in the background at startup. Until it is ready the API queries MySQL.
+_listing_index = None
+if os.getenv("LISTING_INDEX", "true") == "true":
+    _listing_index = ListingIndex(
+        get_db_engine,
+        refresh_seconds=int(os.getenv("LISTING_INDEX_REFRESH", 3600)),
+        on_refresh=on_listing_index_refresh
+    )
+    _listing_index.start()
+
 def format_date(date_obj):
     """Format date object or string to readable format"""
     if not date_obj:
@@ -110,25 +231,15 @@ def format_date(date_obj):
     except:
         return str(date_obj)
 
-def create_efficient_popup(group_data, images_list, is_available):
-    """Create content for the property sidebar"""
-    # group_data is a DataFrame containing all history for a specific location (lat/lng)
-
-    # Sort by date descending (newest first)
-    group_data = group_data.sort_values('Date obtained', ascending=False)
-
-    # Latest entry
-    latest = group_data.iloc[0]
+@request_metrics.timed('html')
+def render_sidebar(latest, first_seen, last_seen, history_len, images_list, is_available):
+    """Create content for the property sidebar from the latest observation of a listing (Series or dict with properties columns)"""
     listing_id = latest['listing_id']
 
-    # Calculate dates
-    first_seen = group_data['Date obtained'].min()
-    last_seen = group_data['Date obtained'].max()
-
     # Calculate total price
-    rent = latest['Rent (CZK)'] or 0
-    utilities = latest['Utilities (CZK)'] or 0
-    services = latest['Services (CZK)'] or 0
+    rent = latest['Rent (CZK)'] if pd.notna(latest['Rent (CZK)']) else 0
+    utilities = latest['Utilities (CZK)'] if pd.notna(latest['Utilities (CZK)']) else 0
+    services = latest['Services (CZK)'] if pd.notna(latest['Services (CZK)']) else 0
     total_price = rent + utilities + services
     fee = latest['Fee'] if pd.notna(latest['Fee']) else 0
 
@@ -190,7 +301,7 @@ def create_efficient_popup(group_data, images_list, is_available):
     """
 
     # History section - Chart placeholder
-    if len(group_data) > 1:
+    if history_len > 1:
         popup_content += f"""
         <div style='margin-top:20px; padding-top:15px; border-top:1px solid #eee;'>
             <h4 style='margin:0 0 10px 0'>Price History</h4>
@@ -209,178 +320,761 @@ def create_efficient_popup(group_data, images_list, is_available):
     """
     return popup_content
 
+def build_where_clause(bounds, filters):
+    """Build the WHERE clause and its parameters for a viewport with filters"""
+    lat_min, lat_max, lng_min, lng_max = bounds
+
+    where_clauses = [
+        "p.Latitude BETWEEN :lat_min AND :lat_max",
+        "p.Longitude BETWEEN :lng_min AND :lng_max",
+        "p.Latitude IS NOT NULL",
+        "p.Longitude IS NOT NULL"
+    ]
+
+    params = {
+        "lat_min": lat_min, "lat_max": lat_max,
+        "lng_min": lng_min, "lng_max": lng_max
+    }
+
+    # Apply Filters
+    if filters['price_min'] is not None:
+        where_clauses.append("(COALESCE(p.`Rent (CZK)`,0) + COALESCE(p.`Utilities (CZK)`,0) + COALESCE(p.`Services (CZK)`,0)) >= :price_min")
+        params['price_min'] = filters['price_min']
+    if filters['price_max'] is not None:
+        where_clauses.append("(COALESCE(p.`Rent (CZK)`,0) + COALESCE(p.`Utilities (CZK)`,0) + COALESCE(p.`Services (CZK)`,0)) <= :price_max")
+        params['price_max'] = filters['price_max']
+
+    if filters['area_min'] is not None:
+        where_clauses.append("p.`Area (m2)` >= :area_min")
+        params['area_min'] = filters['area_min']
+    if filters['area_max'] is not None:
+        where_clauses.append("p.`Area (m2)` <= :area_max")
+        params['area_max'] = filters['area_max']
+
+    if filters['fee_max'] is not None:
+        where_clauses.append("p.Fee <= :fee_max")
+        params['fee_max'] = filters['fee_max']
+
+    if filters['dispositions']:
+        dispo_list = filters['dispositions']
+        dispo_keys = [f"d{i}" for i in range(len(dispo_list))]
+        for k, v in zip(dispo_keys, dispo_list):
+            params[k] = v
+
+        in_clause = ", ".join([f":{k}" for k in dispo_keys])
+        where_clauses.append(f"p.Disposition IN ({in_clause})")
+
+    return " AND ".join(where_clauses), params
+
+def query_properties_sql(engine, bounds, filters, limit, show_available, show_unavailable):
+    """Viewport query against MySQL, used until the in-memory listing index is loaded"""
+    where_sql, params = build_where_clause(bounds, filters)
+    params.update(limit=limit, today=datetime.now().date())
+
+    query = text(f"""
+    SELECT
+        p.listing_id, p.Latitude, p.Longitude, p.`Date obtained`,
+        p.`Rent (CZK)`, p.`Utilities (CZK)`, p.`Services (CZK)`,
+        {available_sql()} AS is_available
+    FROM properties p
+    WHERE {where_sql}
+    ORDER BY p.`Date obtained` DESC
+    LIMIT :limit
+    """)
+
+    with request_metrics.phase('sql'), engine.connect() as conn:
+        df = pd.read_sql(query, conn, params=params)
+
+    with request_metrics.phase('pandas'):
+        properties = summarize_listings(df, datetime.now().date(), show_available, show_unavailable)
+        entries = pd.to_numeric(df['listing_id']).value_counts().reindex(properties['id']).to_numpy(np.int64)
+
+    return {
+        "properties": properties,
+        "count": len(properties['id']),
+        "total_entries": len(df),
+        # For clip_properties: observation rows per listing, and whether LIMIT cut the result
+        "entries": entries,
+        "truncated": len(df) >= limit
+    }
+
+def total_price(df):
+    """Rent + utilities + services per row, missing components count as 0"""
+    return (df['Rent (CZK)'].fillna(0) + df['Utilities (CZK)'].fillna(0) + df['Services (CZK)'].fillna(0)).to_numpy(np.int64)
+
+def summarize_listings(df, today, show_available=True, show_unavailable=True):
+    """
+    Collapse observation rows into one compact marker per listing (its latest observation),
+    returned as a dict of NumPy columns (id, lat, lng, price, is_available).
+    Availability comes from an is_available column when the query selected one (available_sql),
+    otherwise from the latest observation's date.
+    One sort and a groupby tail replace the per-listing loop, dates are parsed once for the whole frame.
+    """
+    df = df.assign(**{'Date obtained': pd.to_datetime(df['Date obtained'])})
+    df = df.sort_values(['listing_id', 'Date obtained'], kind='stable')
+    latest = df.groupby('listing_id', sort=False).tail(1)
+
+    if 'is_available' in latest.columns:
+        is_available = latest['is_available'].to_numpy(bool)
+    else:
+        is_available = (latest['Date obtained'] == pd.Timestamp(today)).to_numpy()
+    keep = (is_available & show_available) | (~is_available & show_unavailable)
+    latest = latest[keep]
+
+    return {
+        'id': pd.to_numeric(latest['listing_id']).to_numpy(np.int64),
+        'lat': latest['Latitude'].to_numpy(np.float64),
+        'lng': latest['Longitude'].to_numpy(np.float64),
+        'price': total_price(latest),
+        'is_available': is_available[keep]
+    }
+
+def build_history(dates, prices):
+    """Price history points for the chart in ascending date order, empty for a single observation"""
+    if len(dates) <= 1:
+        return []
+    labels = pd.DatetimeIndex(dates).strftime('%d.%m.%Y').tolist()
+    return [{'date': d, 'price': p} for d, p in zip(labels, np.asarray(prices, dtype=np.int64).tolist())]
+
+def query_properties_index(snapshot, bounds, filters, limit, show_available, show_unavailable):
+    """Viewport query against the in-memory listing snapshot, no database round-trip"""
+    today = datetime.now().date()
+    matches = snapshot.query(*bounds, **filters, show_available=show_available,
+                             show_unavailable=show_unavailable, today=today)
+    positions = matches[:limit]
+    is_available = snapshot.last_seen[positions] == np.datetime64(today, 'D')
+    entries = (snapshot.hist_offsets[positions + 1] - snapshot.hist_offsets[positions]).astype(np.int64)
+
+    properties = {
+        'id': snapshot.listing_id[positions],
+        'lat': snapshot.lat[positions],
+        'lng': snapshot.lng[positions],
+        'price': snapshot.total_price[positions].astype(np.int64),
+        'is_available': is_available
+    }
+
+    return {
+        "properties": properties,
+        "count": len(positions),
+        "total_entries": int(entries.sum()),
+        "entries": entries,
+        "truncated": len(matches) > limit
+    }
+
+def property_detail_sql(engine, listing_id):
+    """Sidebar HTML and price history of one listing from MySQL"""
+    description_select, description_join = description_sql('descriptions' in _tables)
+    query = text(f"""
+    SELECT
+        p.listing_id, p.Latitude, p.Longitude,
+        p.`Rent (CZK)`, p.`Area (m2)`, p.`Date obtained`,
+        p.URL, p.Disposition, p.`Utilities (CZK)`, p.`Services (CZK)`,
+        {description_select}, p.Fee, p.Address
+    FROM properties p
+    {description_join}
+    WHERE p.listing_id = :listing_id
+    """)
+    img_query = text("SELECT object_name FROM images WHERE listing_id = :listing_id")
+
+    # properties.listing_id is BIGINT while images.listing_id is a text column:
+    # each query binds the column's own type so both indexes can be used
+    with request_metrics.phase('sql'), engine.connect() as conn:
+        group = pd.read_sql(query, conn, params={'listing_id': int(listing_id)})
+        imgs = pd.read_sql(img_query, conn, params={'listing_id': str(listing_id)})['object_name'].tolist()
+
+    if group.empty:
+        return None
+
+    group = group.assign(**{'Date obtained': pd.to_datetime(group['Date obtained'])})
+    group = group.sort_values('Date obtained', ascending=True, kind='stable')
+    is_available = (group['Date obtained'].iloc[-1].date() == datetime.now().date())
+
+    # History for the chart in ascending order
+    history = build_history(group['Date obtained'].to_numpy(), total_price(group))
+
+    return {
+        'id': listing_id,
+        'is_available': is_available,
+        'sidebar_html': render_sidebar(group.iloc[-1], group['Date obtained'].iloc[0], group['Date obtained'].iloc[-1],
+                                       len(group), imgs, is_available),
+        'history': history
+    }
+
+def property_detail_index(snapshot, pos):
+    """Sidebar HTML and price history of one listing from the in-memory snapshot"""
+    is_available = bool(snapshot.last_seen[pos] == np.datetime64(datetime.now().date(), 'D'))
+    hist_dates, hist_prices = snapshot.history(pos)
+    history = build_history(hist_dates, hist_prices)
+
+    latest = {
+        'listing_id': int(snapshot.listing_id[pos]),
+        'Rent (CZK)': snapshot.rent[pos],
+        'Utilities (CZK)': snapshot.utilities[pos],
+        'Services (CZK)': snapshot.services[pos],
+        'Fee': snapshot.fee[pos],
+        'Area (m2)': snapshot.area[pos],
+        'Disposition': snapshot.dispositions[snapshot.disposition_code[pos]] if snapshot.disposition_code[pos] >= 0 else None,
+        'URL': snapshot.url[pos],
+        'Description': snapshot.description[pos],
+        'Address': snapshot.address[pos]
+    }
+    imgs = snapshot.images.get(latest['listing_id'], [])
+
+    return {
+        'id': latest['listing_id'],
+        'is_available': is_available,
+        'sidebar_html': render_sidebar(latest, snapshot.first_seen[pos].item(), snapshot.last_seen[pos].item(),
+                                       len(hist_dates), imgs, is_available),
+        'history': history
+    }
+
+SUMMARY_COLUMNS = [
+    'total_records', 'unique_properties',
+    'min_price', 'max_price', 'avg_price',
+    'min_surface', 'max_surface', 'avg_surface',
+    'lat_min', 'lat_max', 'lng_min', 'lng_max',
+    'lat_center', 'lng_center', 'updated_at'
+]
+
+def get_summary_stats(engine):
+    """
+    Summary statistics as {'all': {...}, 'dispositions': {name: {...}}}.
+    Read from the stats_summary table the pipeline refreshes after each load; if that table
+    does not exist yet, computed from properties directly.
+    """
+    check_data_version(engine)
+    cached = _summary_cache.get('summary')
+    if cached is not None:
+        return cached
+
+    try:
+        with engine.connect() as conn:
+            df = pd.read_sql(text(f"SELECT scope, scope_value, {', '.join(SUMMARY_COLUMNS)} FROM stats_summary"), conn)
+    except Exception as e:
+        print(f"stats_summary not available ({e}), computing statistics from properties")
+        df = pd.DataFrame()
+
+    if df.empty or not (df['scope'] == 'all').any():
+        aggregates = """
+            COUNT(*) as total_records,
+            COUNT(DISTINCT listing_id) as unique_properties,
+            MIN(`Rent (CZK)`) as min_price, MAX(`Rent (CZK)`) as max_price, AVG(`Rent (CZK)`) as avg_price,
+            MIN(`Area (m2)`) as min_surface, MAX(`Area (m2)`) as max_surface, AVG(`Area (m2)`) as avg_surface,
+            MIN(Latitude) as lat_min, MAX(Latitude) as lat_max,
+            MIN(Longitude) as lng_min, MAX(Longitude) as lng_max,
+            AVG(Latitude) as lat_center, AVG(Longitude) as lng_center,
+            NULL as updated_at
+        """
+        with engine.connect() as conn:
+            df_all = pd.read_sql(text(f"""
+            SELECT 'all' as scope, '' as scope_value, {aggregates}
+            FROM properties
+            WHERE Latitude IS NOT NULL AND Longitude IS NOT NULL
+            """), conn)
+            df_dispo = pd.read_sql(text(f"""
+            SELECT 'disposition' as scope, Disposition as scope_value, {aggregates}
+            FROM properties
+            WHERE Latitude IS NOT NULL AND Longitude IS NOT NULL AND Disposition IS NOT NULL AND Disposition != ''
+            GROUP BY Disposition
+            """), conn)
+        df = pd.concat([df_all, df_dispo], ignore_index=True)
+
+    for col in ('total_records', 'unique_properties'):
+        df[col] = df[col].fillna(0).astype(int)
+    rows = df.set_index(['scope', 'scope_value'])[SUMMARY_COLUMNS].to_dict('index')
+
+    summary = {
+        'all': rows[('all', '')],
+        'dispositions': {value: row for (scope, value), row in rows.items() if scope == 'disposition'}
+    }
+    _summary_cache.set('summary', summary)
+    return summary
+
+def parse_viewport_request():
+    """Read viewport bounds, filters and status selection from the query string"""
+    # Viewport params
+    lat_min = float(request.query.get('lat_min', 0))
+    lat_max = float(request.query.get('lat_max', 0))
+    lng_min = float(request.query.get('lng_min', 0))
+    lng_max = float(request.query.get('lng_max', 0))
+
+    # Filter params
+    price_min = request.query.get('price_min')
+    price_max = request.query.get('price_max')
+    area_min = request.query.get('area_min')
+    area_max = request.query.get('area_max')
+    fee_max = request.query.get('fee_max')
+    dispositions = request.query.get('dispositions') # Comma separated
+    status_filter = request.query.get('status') # 'available', 'unavailable', or both/none
+
+    filters = {
+        'price_min': int(price_min) if price_min else None,
+        'price_max': int(price_max) if price_max else None,
+        'area_min': int(area_min) if area_min else None,
+        'area_max': int(area_max) if area_max else None,
+        'fee_max': int(fee_max) if fee_max else None,
+        'dispositions': dispositions.split(',') if dispositions else None
+    }
+
+    # Status filters
+    show_available = True
+    show_unavailable = True
+    if status_filter:
+        statuses = status_filter.split(',')
+        show_available = 'available' in statuses
+        show_unavailable = 'unavailable' in statuses
+
+    # Raw filter values identify the request in the response cache
+    filter_key = (price_min, price_max, area_min, area_max, fee_max, dispositions, status_filter)
+
+    return (lat_min, lat_max, lng_min, lng_max), filters, show_available, show_unavailable, filter_key
+
+def parse_wire_options():
+    """Response format from the query string and the content encoding negotiated from Accept-Encoding"""
+    fmt = request.query.get('format', 'json')
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown format '{fmt}', expected one of: {', '.join(FORMATS)}")
+    return fmt, negotiate_encoding(request.headers.get('Accept-Encoding'))
+
+def encode_response(result, key, fmt, encoding):
+    """Serialize and compress an API result into a cacheable (body, content type, content encoding) entry"""
+    with request_metrics.phase('encode'):
+        body, content_type = encode_payload(result, key, fmt)
+        body, applied_encoding = compress(body, encoding)
+    return body, content_type, applied_encoding
+
+def send_encoded(entry):
+    """Set the response headers for an encoded entry and return its body"""
+    body, content_type, encoding = entry
+    response.content_type = content_type
+    response.set_header('Vary', 'Accept-Encoding')
+    if encoding:
+        response.set_header('Content-Encoding', encoding)
+    return body
+
+def query_properties(engine, bounds, filters, limit, show_available, show_unavailable):
+    """Individual listings for a viewport, from the listing index when loaded, otherwise from MySQL"""
+    snapshot = _listing_index.snapshot if _listing_index else None
+    if snapshot is not None:
+        with request_metrics.phase('index'):
+            return query_properties_index(snapshot, bounds, filters, limit, show_available, show_unavailable)
+    return query_properties_sql(engine, bounds, filters, limit, show_available, show_unavailable)
+
+def clip_properties(result, bounds, limit):
+    """API result for a viewport from a query result over a larger area: listings outside bounds are dropped before the limit"""
+    lat_min, lat_max, lng_min, lng_max = bounds
+    properties = result['properties']
+    inside = np.flatnonzero((properties['lat'] >= lat_min) & (properties['lat'] <= lat_max) &
+                            (properties['lng'] >= lng_min) & (properties['lng'] <= lng_max))[:limit]
+    return {
+        "properties": {name: np.asarray(values)[inside] for name, values in properties.items()},
+        "count": len(inside),
+        "total_entries": int(result['entries'][inside].sum())
+    }
+
+def viewport_properties(engine, bounds, filters, limit, show_available, show_unavailable, filter_key):
+    """
+    Listings of a viewport, at most limit. The query runs over the enclosing tile range (snap_to_tiles) and its
+    result is cached per tile, so nearby viewports share it; it is clipped to the viewport before the limit applies.
+    If the limit already cut the tile result, listings of the viewport may be missing from it and the viewport
+    itself is queried (and cached under its exact bounds).
+    """
+    today = datetime.now().date()
+    tile_key, tile_bounds = snap_to_tiles(*bounds)
+    tile_cache_key = ('properties_tile', tile_key, limit, filter_key, today)
+    result = _properties_cache.get(tile_cache_key)
+    if result is None:
+        result = query_properties(engine, tile_bounds, filters, limit, show_available, show_unavailable)
+        _properties_cache.set(tile_cache_key, result)
+    if not result['truncated']:
+        return clip_properties(result, bounds, limit)
+
+    exact_cache_key = ('properties_exact', bounds, limit, filter_key, today)
+    result = _properties_cache.get(exact_cache_key)
+    if result is None:
+        result = query_properties(engine, bounds, filters, limit, show_available, show_unavailable)
+        _properties_cache.set(exact_cache_key, result)
+    return clip_properties(result, bounds, limit)
+
+def cluster_cell_deg(zoom):
+    """Grid cell size in degrees covering about CLUSTER_CELL_PX pixels at a Leaflet zoom level"""
+    return CLUSTER_CELL_PX * 360.0 / (256 * 2 ** zoom)
+
+def query_clusters_sql(engine, bounds, filters, cell_deg, show_available, show_unavailable):
+    """
+    Cluster aggregation in MySQL, used until the in-memory listing index is loaded.
+    Same result as aggregate_grid over the latest matching observation per listing, but grouped by grid cell
+    in the database, so only one row per cell is transferred however large the viewport is.
+    """
+    if not (show_available or show_unavailable):
+        return aggregate_grid(np.empty(0), np.empty(0), np.empty(0), np.empty(0, bool), cell_deg)
+
+    where_sql, params = build_where_clause(bounds, filters)
+    params.update(cell_deg=cell_deg, today=datetime.now().date())
+    status_sql = "" if show_available and show_unavailable else f"AND is_available = {1 if show_available else 0}"
+
+    # The median sits at ranks (n+1)/2 and n/2+1 (the same rank for odd n), as in aggregate_grid
+    query = text(f"""
+    WITH latest AS (
+        SELECT
+            p.Latitude, p.Longitude,
+            COALESCE(p.`Rent (CZK)`,0) + COALESCE(p.`Utilities (CZK)`,0) + COALESCE(p.`Services (CZK)`,0) AS price,
+            {available_sql()} AS is_available,
+            ROW_NUMBER() OVER (PARTITION BY p.listing_id ORDER BY p.`Date obtained` DESC) AS rn
+        FROM properties p
+        WHERE {where_sql}
+    ),
+    ranked AS (
+        SELECT
+            Latitude, Longitude, price, is_available,
+            FLOOR(Latitude / :cell_deg) AS cell_row,
+            FLOOR(Longitude / :cell_deg) AS cell_col,
+            ROW_NUMBER() OVER (PARTITION BY FLOOR(Latitude / :cell_deg), FLOOR(Longitude / :cell_deg) ORDER BY price) AS price_rank,
+            COUNT(*) OVER (PARTITION BY FLOOR(Latitude / :cell_deg), FLOOR(Longitude / :cell_deg)) AS n
+        FROM latest
+        WHERE rn = 1 {status_sql}
+    )
+    SELECT
+        AVG(Latitude) AS lat, AVG(Longitude) AS lng, COUNT(*) AS count, SUM(is_available) AS available,
+        AVG(CASE WHEN price_rank IN (FLOOR((n + 1) / 2), FLOOR(n / 2) + 1) THEN price END) AS median_price
+    FROM ranked
+    GROUP BY cell_row, cell_col
+    ORDER BY cell_row, cell_col
+    """)
+
+    with request_metrics.phase('sql'), engine.connect() as conn:
+        df = pd.read_sql(query, conn, params=params)
+
+    return {
+        'lat': df['lat'].to_numpy(np.float64).round(5),
+        'lng': df['lng'].to_numpy(np.float64).round(5),
+        'count': df['count'].to_numpy(np.int64),
+        'available': df['available'].to_numpy(np.float64).astype(np.int64),
+        'median_price': df['median_price'].to_numpy(np.float64).astype(np.int64)
+    }
+
+def query_clusters(engine, bounds, filters, cell_deg, show_available, show_unavailable):
+    """Grid clusters for a viewport, from the listing index when loaded, otherwise from MySQL"""
+    snapshot = _listing_index.snapshot if _listing_index else None
+    if snapshot is None:
+        return query_clusters_sql(engine, bounds, filters, cell_deg, show_available, show_unavailable)
+
+    today = datetime.now().date()
+    with request_metrics.phase('index'):
+        positions = snapshot.query(*bounds, **filters, show_available=show_available,
+                                   show_unavailable=show_unavailable, today=today)
+    is_available = snapshot.last_seen[positions] == np.datetime64(today, 'D')
+    return aggregate_grid(snapshot.lat[positions], snapshot.lng[positions],
+                          snapshot.total_price[positions], is_available, cell_deg)
+
+def query_price_index(engine, dispositions, bounds, month_from, month_to, by_disposition):
+    """
+    Rent per m² time series from the price_index table the pipeline maintains.
+    Buckets hold sums, so any combination of cells and dispositions yields exact means and standard deviations.
+    """
+    conditions = ["1=1"]
+    params = {}
+    if dispositions:
+        placeholders = ', '.join(f':disp_{i}' for i in range(len(dispositions)))
+        conditions.append(f"disposition IN ({placeholders})")
+        params.update({f'disp_{i}': d for i, d in enumerate(dispositions)})
+    if bounds:
+        conditions.append("cell_lat BETWEEN :lat_min AND :lat_max AND cell_lng BETWEEN :lng_min AND :lng_max")
+        params.update(dict(zip(('lat_min', 'lat_max', 'lng_min', 'lng_max'), bounds)))
+    if month_from:
+        conditions.append("month >= :month_from")
+        params['month_from'] = month_from
+    if month_to:
+        conditions.append("month <= :month_to")
+        params['month_to'] = month_to
+
+    group_columns = "month, disposition" if by_disposition else "month"
+    query = text(f"""
+    SELECT
+        {group_columns},
+        SUM(listings) as listings,
+        SUM(sum_rent_m2) as sum_rent_m2,
+        SUM(sum_sq_rent_m2) as sum_sq_rent_m2,
+        SUM(sum_rent) as sum_rent,
+        SUM(sum_area) as sum_area
+    FROM price_index
+    WHERE {' AND '.join(conditions)}
+    GROUP BY {group_columns}
+    ORDER BY {group_columns}
+    """)
+
+    with engine.connect() as conn:
+        df = pd.read_sql(query, conn, params=params)
+
+    n = df['listings'].astype(float)
+    mean = df['sum_rent_m2'] / n
+    variance = (df['sum_sq_rent_m2'] / n - mean ** 2).clip(lower=0)
+
+    series = pd.DataFrame({
+        'month': pd.to_datetime(df['month']).dt.strftime('%Y-%m'),
+        'listings': df['listings'].astype(int),
+        'rent_m2': mean.round(1),
+        'rent_m2_std': np.sqrt(variance).round(1),
+        'avg_rent': (df['sum_rent'] / n).round(0),
+        'avg_area': (df['sum_area'] / n).round(1)
+    })
+    if by_disposition:
+        series.insert(1, 'disposition', df['disposition'])
+    return series.to_dict('records')
+
 @route('/api/properties')
 def get_properties_api():
     """API endpoint to get properties within viewport bounds with filters"""
     response.content_type = 'application/json'
 
     try:
-        # Viewport params
-        lat_min = float(request.query.get('lat_min', 0))
-        lat_max = float(request.query.get('lat_max', 0))
-        lng_min = float(request.query.get('lng_min', 0))
-        lng_max = float(request.query.get('lng_max', 0))
+        bounds, filters, show_available, show_unavailable, filter_key = parse_viewport_request()
         limit = int(request.query.get('limit', 2000))
+        fmt, encoding = parse_wire_options()
+
+        engine = get_db_engine()
+        if not engine:
+            return json.dumps({"error": "Database connection failed"})
+
+        check_data_version(engine)
+        result = viewport_properties(engine, bounds, filters, limit, show_available, show_unavailable, filter_key)
+        return send_encoded(encode_response(result, 'properties', fmt, encoding))
 
-        # Filter params
-        price_min = request.query.get('price_min')
-        price_max = request.query.get('price_max')
-        area_min = request.query.get('area_min')
-        area_max = request.query.get('area_max')
-        fee_max = request.query.get('fee_max')
-        dispositions = request.query.get('dispositions') # Comma separated
-        status_filter = request.query.get('status') # 'available', 'unavailable', or both/none
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        request_metrics.mark_error()
+        return json.dumps({"error": str(e)})
+
+@route('/api/property/<listing_id:int>')
+def get_property_detail_api(listing_id):
+    """API endpoint with the sidebar HTML and price history of one listing, requested when a marker is clicked"""
+    response.content_type = 'application/json'
 
+    try:
         engine = get_db_engine()
         if not engine:
             return json.dumps({"error": "Database connection failed"})
 
-        # Build Query
-        where_clauses = [
-            "p.Latitude BETWEEN :lat_min AND :lat_max",
-            "p.Longitude BETWEEN :lng_min AND :lng_max",
-            "p.Latitude IS NOT NULL",
-            "p.Longitude IS NOT NULL"
-        ]
-
-        params = {
-            "lat_min": lat_min, "lat_max": lat_max,
-            "lng_min": lng_min, "lng_max": lng_max,
-            "limit": limit
-        }
+        cache_key = (listing_id, datetime.now().date())
+        check_data_version(engine)
+        cached = _detail_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
-        # Apply Filters
-        if price_min:
-            where_clauses.append("(COALESCE(p.`Rent (CZK)`,0) + COALESCE(p.`Utilities (CZK)`,0) + COALESCE(p.`Services (CZK)`,0)) >= :price_min")
-            params['price_min'] = int(price_min)
-        if price_max:
-            where_clauses.append("(COALESCE(p.`Rent (CZK)`,0) + COALESCE(p.`Utilities (CZK)`,0) + COALESCE(p.`Services (CZK)`,0)) <= :price_max")
-            params['price_max'] = int(price_max)
-
-        if area_min:
-            where_clauses.append("p.`Area (m2)` >= :area_min")
-            params['area_min'] = int(area_min)
-        if area_max:
-            where_clauses.append("p.`Area (m2)` <= :area_max")
-            params['area_max'] = int(area_max)
-
-        if fee_max:
-            where_clauses.append("p.Fee <= :fee_max")
-            params['fee_max'] = int(fee_max)
-
-        if dispositions:
-            dispo_list = dispositions.split(',')
-            dispo_keys = [f"d{i}" for i in range(len(dispo_list))]
-            for k, v in zip(dispo_keys, dispo_list):
-                params[k] = v
-
-            in_clause = ", ".join([f":{k}" for k in dispo_keys])
-            where_clauses.append(f"p.Disposition IN ({in_clause})")
-
-        where_sql = " AND ".join(where_clauses)
-
-        query = text(f"""
-        SELECT
-            p.listing_id, p.Latitude, p.Longitude,
-            p.`Rent (CZK)`, p.`Area (m2)`, p.`Date obtained`,
-            p.URL, p.Disposition, p.`Utilities (CZK)`, p.`Services (CZK)`,
-            p.Description, p.Fee, p.Address
-        FROM properties p
-        WHERE {where_sql}
-        ORDER BY p.`Date obtained` DESC
-        LIMIT :limit
-        """)
+        snapshot = _listing_index.snapshot if _listing_index else None
+        pos = snapshot.position(listing_id) if snapshot is not None else None
+        if pos is not None:
+            result = property_detail_index(snapshot, pos)
+        else:
+            # Not in the index yet (or index not loaded), the listing may still exist in MySQL
+            result = property_detail_sql(engine, listing_id)
 
-        with engine.connect() as conn:
-            df = pd.read_sql(query, conn, params=params)
+        if result is None:
+            response.status = 404
+            return json.dumps({"error": f"Listing {listing_id} not found"})
 
-        if df.empty:
-            return json.dumps({"properties": [], "count": 0})
+        payload = json.dumps(result)
+        _detail_cache.set(cache_key, payload)
+        return payload
 
-        # Fetch images for these properties
-        listing_ids = df['listing_id'].unique().tolist()
-        images_map = {}
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        request_metrics.mark_error()
+        return json.dumps({"error": str(e)})
 
-        if listing_ids:
-            listing_ids = [int(x) for x in listing_ids]
-            ids_str = ','.join(map(str, listing_ids))
-            img_query = text(f"SELECT listing_id, object_name FROM images WHERE listing_id IN ({ids_str})")
+@route('/api/property/<listing_id:int>/timeline')
+def get_property_timeline_api(listing_id):
+    """Presence intervals of one listing (when it was on offer and at which price), oldest first"""
+    response.content_type = 'application/json'
+
+    try:
+        engine = get_db_engine()
+        if not engine:
+            return json.dumps({"error": "Database connection failed"})
 
-            with engine.connect() as conn:
-                img_df = pd.read_sql(img_query, conn)
+        query = text("""
+        SELECT version, first_seen, last_seen, `Rent (CZK)`, `Utilities (CZK)`, `Services (CZK)`
+        FROM listing_presence
+        WHERE listing_id = :listing_id
+        ORDER BY version
+        """)
+        with engine.connect() as conn:
+            df = pd.read_sql(query, conn, params={'listing_id': int(listing_id)})
 
-            for lid, group in img_df.groupby('listing_id'):
-                images_map[lid] = group['object_name'].tolist()
+        if df.empty:
+            response.status = 404
+            return json.dumps({"error": f"Listing {listing_id} not found"})
 
-        # Group by listing_id
-        grouped = df.groupby('listing_id')
-        properties = []
         today = datetime.now().date()
-
-        # Status filters
-        show_available = True
-        show_unavailable = True
-        if status_filter:
-            statuses = status_filter.split(',')
-            show_available = 'available' in statuses
-            show_unavailable = 'unavailable' in statuses
-
-        for listing_id, group in grouped:
-            group = group.sort_values('Date obtained', ascending=False)
-            latest = group.iloc[0]
-
-            # Convert pandas timestamp to date
-            latest_date = latest['Date obtained']
-            if isinstance(latest_date, pd.Timestamp):
-                latest_date = latest_date.date()
-            elif isinstance(latest_date, str):
-                 try:
-                     latest_date = datetime.strptime(latest_date, '%Y-%m-%d').date()
-                 except:
-                     pass
-
-            is_available = (latest_date == today)
-
-            # Filter by status
-            if is_available and not show_available:
-                continue
-            if not is_available and not show_unavailable:
-                continue
-
-            marker_type = 'single'
-            imgs = images_map.get(listing_id, [])
-
-            # Prepare history data for chart
-            history = []
-            if len(group) > 1:
-                # We need ascending order for the chart
-                chart_group = group.sort_values('Date obtained', ascending=True)
-                for _, row in chart_group.iterrows():
-                    d = row['Date obtained']
-                    d_str = format_date(d)
-                    price = (row['Rent (CZK)'] or 0) + (row['Utilities (CZK)'] or 0) + (row['Services (CZK)'] or 0)
-                    history.append({'date': d_str, 'price': int(price)})
-
-            properties.append({
-                'lat': float(latest['Latitude']),
-                'lng': float(latest['Longitude']),
-                'type': marker_type,
-                'is_available': is_available,
-                'sidebar_html': create_efficient_popup(group, imgs, is_available),
-                'history': history
-            })
+        last_seen = pd.to_datetime(df['last_seen']).dt.date
+        intervals = [{
+            'version': int(row.version),
+            'from': pd.Timestamp(row.first_seen).strftime('%Y-%m-%d'),
+            'to': seen.strftime('%Y-%m-%d'),
+            'days': (seen - pd.Timestamp(row.first_seen).date()).days + 1,
+            'price': int(total)
+        } for row, seen, total in zip(df.itertuples(index=False), last_seen, total_price(df))]
 
         return json.dumps({
-            "properties": properties,
-            "count": len(properties),
-            "total_entries": len(df)
+            'id': listing_id,
+            'is_available': bool(last_seen.iloc[-1] == today),
+            'intervals': intervals
         })
 
     except Exception as e:
         import traceback
         traceback.print_exc()
+        request_metrics.mark_error()
         return json.dumps({"error": str(e)})
 
+@route('/api/clusters')
+def get_clusters_api():
+    """
+    Zoom-aware map API: grid clusters (centroid, count, median price) below CLUSTER_MAX_ZOOM,
+    individual properties from that zoom on. Clusters cover every matching listing, no limit applies.
+    """
+    response.content_type = 'application/json'
+
+    try:
+        bounds, filters, show_available, show_unavailable, filter_key = parse_viewport_request()
+        zoom = int(request.query.get('zoom', CLUSTER_MAX_ZOOM))
+        limit = int(request.query.get('limit', 2000))
+        fmt, encoding = parse_wire_options()
+
+        engine = get_db_engine()
+        if not engine:
+            return json.dumps({"error": "Database connection failed"})
+
+        check_data_version(engine)
+        if zoom >= CLUSTER_MAX_ZOOM:
+            result = viewport_properties(engine, bounds, filters, limit, show_available, show_unavailable, filter_key)
+            result["mode"] = "properties"
+            return send_encoded(encode_response(result, 'properties', fmt, encoding))
+
+        # Clusters have no limit and globally aligned cells: the clusters of the whole tile range are cached and
+        # served as they are (cells just outside the viewport are harmless)
+        tile_key, bounds = snap_to_tiles(*bounds)
+        cache_key = ('clusters', zoom, tile_key, filter_key, fmt, encoding, datetime.now().date())
+        cached = _properties_cache.get(cache_key)
+        if cached is not None:
+            return send_encoded(cached)
+
+        clusters = query_clusters(engine, bounds, filters, cluster_cell_deg(zoom), show_available, show_unavailable)
+        result = {
+            "mode": "clusters",
+            "clusters": clusters,
+            "count": len(clusters['count']),
+            "total_properties": int(clusters['count'].sum())
+        }
+        entry = encode_response(result, 'clusters', fmt, encoding)
+        _properties_cache.set(cache_key, entry)
+        return send_encoded(entry)
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        request_metrics.mark_error()
+        return json.dumps({"error": str(e)})
+
+@route('/api/stats/timeseries')
+def get_timeseries_api():
+    """
+    Monthly rent per m² index. Optional filters: dispositions (comma separated), viewport bounds
+    (lat_min, lat_max, lng_min, lng_max), from/to (YYYY-MM); group_by=disposition splits the series.
+    """
+    response.content_type = 'application/json'
+
+    try:
+        dispositions = request.query.get('dispositions')
+        dispositions = dispositions.split(',') if dispositions else None
+        bounds = None
+        if all(request.query.get(k) for k in ('lat_min', 'lat_max', 'lng_min', 'lng_max')):
+            bounds = tuple(float(request.query.get(k)) for k in ('lat_min', 'lat_max', 'lng_min', 'lng_max'))
+        month_from = request.query.get('from')
+        month_to = request.query.get('to')
+        month_from = datetime.strptime(month_from, '%Y-%m').date() if month_from else None
+        month_to = datetime.strptime(month_to, '%Y-%m').date() if month_to else None
+        by_disposition = request.query.get('group_by') == 'disposition'
+
+        engine = get_db_engine()
+        if not engine:
+            return json.dumps({"error": "Database connection failed"})
+
+        cache_key = ('timeseries', tuple(dispositions or ()), bounds, month_from, month_to, by_disposition)
+        check_data_version(engine)
+        cached = _properties_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+        series = query_price_index(engine, dispositions, bounds, month_from, month_to, by_disposition)
+        payload = json.dumps({"series": series, "count": len(series)})
+        _properties_cache.set(cache_key, payload)
+        return payload
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        request_metrics.mark_error()
+        return json.dumps({"error": str(e)})
+
+@route('/api/estimate')
+def get_estimate_api():
+    """
+    Fair-price estimate for a flat from the k nearest comparable listings (same disposition, similar area).
+    Params: lat, lng, area (m²), optional disposition and k.
+    """
+    response.content_type = 'application/json'
+
+    try:
+        lat = float(request.query.get('lat'))
+        lng = float(request.query.get('lng'))
+        area = float(request.query.get('area'))
+        disposition = request.query.get('disposition') or None
+        k = int(request.query.get('k', DEFAULT_K))
+        # float() accepts 'nan' and 'inf', which the neighbour search cannot place
+        if not np.isfinite([lat, lng, area]).all():
+            raise ValueError("lat, lng and area must be finite numbers")
+        if area <= 0:
+            raise ValueError("area must be positive")
+    except (TypeError, ValueError) as e:
+        response.status = 400
+        return json.dumps({"error": f"Invalid parameters: {e}"})
+
+    try:
+        engine = get_db_engine()
+        if engine:
+            # New data triggers a listing index refresh, which rebuilds the estimator
+            check_data_version(engine)
+
+        estimator = _fair_price
+        if estimator is None:
+            response.status = 503
+            return json.dumps({"error": "Estimator is not loaded yet"})
+
+        result = estimator.estimate(lat, lng, area, disposition, k)
+        if result is None:
+            response.status = 404
+            return json.dumps({"error": "No comparable listings found"})
+        return json.dumps(result)
+
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        request_metrics.mark_error()
+        return json.dumps({"error": str(e)})
+
+@route('/metrics')
+def get_metrics():
+    """Request latency percentiles per route and phase, DB pool checkout wait; Prometheus text or ?format=json"""
+    pool = _engine.pool if _engine else None
+    if request.query.get('format') == 'json':
+        response.content_type = 'application/json'
+        return json.dumps(request_metrics.snapshot(pool))
+    response.content_type = 'text/plain; version=0.0.4'
+    return request_metrics.prometheus_text(pool)
+
 @route('/')
 def show_map():
     """Main map page"""
@@ -389,29 +1083,14 @@ def show_map():
         return "<h1>Error: Could not connect to database</h1>"
 
     try:
-        # Get bounds and filters data
-        with engine.connect() as conn:
-            # Bounds and counts
-            bounds_query = text("""
-            SELECT
-                MIN(Latitude) as lat_min, MAX(Latitude) as lat_max,
-                MIN(Longitude) as lng_min, MAX(Longitude) as lng_max,
-                AVG(Latitude) as lat_center, AVG(Longitude) as lng_center,
-                COUNT(*) as total_data_points,
-                COUNT(DISTINCT listing_id) as total_unique_properties
-            FROM properties
-            WHERE Latitude IS NOT NULL AND Longitude IS NOT NULL
-            """)
-            bounds_result = pd.read_sql(bounds_query, conn).iloc[0].to_dict()
-
-            # Ensure counts are integers
-            bounds = bounds_result
-            bounds['total_data_points'] = int(bounds['total_data_points'])
-            bounds['total_unique_properties'] = int(bounds['total_unique_properties'])
+        # Get bounds and filters data from the precomputed summary
+        summary = get_summary_stats(engine)
+        bounds = dict(summary['all'])
+        bounds['total_data_points'] = bounds['total_records']
+        bounds['total_unique_properties'] = bounds['unique_properties']
 
-            # Dispositions for filter
-            dispo_query = text("SELECT DISTINCT Disposition FROM properties WHERE Disposition IS NOT NULL AND Disposition != '' ORDER BY Disposition LIMIT 100")
-            dispositions = pd.read_sql(dispo_query, conn)['Disposition'].tolist()
+        # Dispositions for filter
+        dispositions = sorted(summary['dispositions'])[:100]
 
         # Build HTML
         dispo_options = "".join([f'<label><input type="checkbox" value="{d}"> {d}</label>' for d in dispositions])
@@ -566,6 +1245,12 @@ def show_map():
                     text-align: center; color: white; font-weight: bold;
                     border: 2px solid rgba(220, 53, 69, 1); line-height: 30px;
                 }}
+
+                .server-cluster {{
+                    display: flex; flex-direction: column; justify-content: center;
+                    line-height: 12px; font-size: 12px;
+                }}
+                .server-cluster small {{ font-weight: normal; font-size: 10px; }}
             </style>
         </head>
         <body>
@@ -678,6 +1363,9 @@ def show_map():
             }});
             map.addLayer(markers);
 
+            // Server-side clusters shown at low zoom instead of individual markers
+            const clusterLayer = L.layerGroup().addTo(map);
+
             let loading = false;
             let selectedMarker = null;
             let priceChart = null;
@@ -749,6 +1437,50 @@ def show_map():
                 }});
             }}
 
+            function createClusterIcon(cluster) {{
+                const size = Math.round(30 + 8 * Math.log10(cluster.count));
+                const price = (cluster.median_price / 1000).toFixed(0) + 'k';
+                return L.divIcon({{
+                    html: `<span>${{cluster.count}}</span><small>${{price}}</small>`,
+                    className: 'custom-cluster server-cluster',
+                    iconSize: L.point(size, size)
+                }});
+            }}
+
+            // --- BINARY API FORMAT (see wire_format.pack_columns) ---
+            const TYPED_ARRAYS = {{ float64: Float64Array, int32: Int32Array, uint8: Uint8Array }};
+
+            function decodeBinary(buffer) {{
+                const headerLength = new DataView(buffer).getUint32(0, true);
+                const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength)));
+                const base = Math.ceil((4 + headerLength) / 8) * 8;
+                const columns = {{}};
+                header.columns.forEach(c => {{
+                    columns[c.name] = new TYPED_ARRAYS[c.dtype](buffer, base + c.offset, header.count);
+                }});
+                return {{ ...header.meta, [header.key]: columns, length: header.count }};
+            }}
+
+            function readResponse(r) {{
+                if ((r.headers.get('Content-Type') || '').startsWith('application/octet-stream')) {{
+                    return r.arrayBuffer().then(decodeBinary);
+                }}
+                return r.json();
+            }}
+
+            function renderClusters(columns, n) {{
+                for (let i = 0; i < n; i++) {{
+                    const c = {{
+                        lat: columns.lat[i], lng: columns.lng[i], count: columns.count[i],
+                        available: columns.available[i], median_price: columns.median_price[i]
+                    }};
+                    const marker = L.marker([c.lat, c.lng], {{icon: createClusterIcon(c)}});
+                    marker.bindTooltip(`${{c.count}} listings (${{c.available}} available)<br>Median ${{c.median_price.toLocaleString()}} CZK`);
+                    marker.on('click', () => map.setView([c.lat, c.lng], Math.min(map.getZoom() + 2, 19)));
+                    clusterLayer.addLayer(marker);
+                }}
+            }}
+
             function renderChart(history) {{
                 const ctx = document.getElementById('priceChart');
                 if (!ctx) return;
@@ -813,6 +1545,22 @@ def show_map():
                 }}
             }}
 
+            function loadDetail(listingId) {{
+                document.getElementById('sidebar-content').innerHTML = '<div style="color:#888;padding:20px;">Loading...</div>';
+                fetch(`/api/property/${{listingId}}`)
+                    .then(r => r.json())
+                    .then(data => {{
+                        // Ignore responses for a marker that is no longer selected
+                        if (!selectedMarker || selectedMarker.options.listingId !== listingId) return;
+                        if (data.error) {{
+                            updateSidebar(`<div style="color:#dc3545;">${{data.error}}</div>`, null);
+                            return;
+                        }}
+                        updateSidebar(data.sidebar_html, data.history);
+                    }})
+                    .catch(e => console.error(e));
+            }}
+
             function loadProperties() {{
                 if (loading) return;
                 loading = true;
@@ -820,7 +1568,7 @@ def show_map():
                 const bounds = map.getBounds();
                 const filters = getFilters();
 
-                let url = `/api/properties?lat_min=${{bounds.getSouth()}}&lat_max=${{bounds.getNorth()}}&lng_min=${{bounds.getWest()}}&lng_max=${{bounds.getEast()}}`;
+                let url = `/api/clusters?format=binary&zoom=${{map.getZoom()}}&lat_min=${{bounds.getSouth()}}&lat_max=${{bounds.getNorth()}}&lng_min=${{bounds.getWest()}}&lng_max=${{bounds.getEast()}}`;
 
                 if(filters.price_min) url += `&price_min=${{filters.price_min}}`;
                 if(filters.price_max) url += `&price_max=${{filters.price_max}}`;
@@ -831,15 +1579,20 @@ def show_map():
                 if(filters.status) url += `&status=${{filters.status}}`;
 
                 fetch(url)
-                    .then(r => r.json())
+                    .then(readResponse)
                     .then(data => {{
                         markers.clearLayers();
-                        if (data.properties) {{
-                            const newLayers = data.properties.map(p => {{
-                                const marker = L.marker([p.lat, p.lng], {{icon: createIcon(p.is_available, false)}});
-                                marker.options.sidebarHtml = p.sidebar_html;
-                                marker.options.isAvailable = p.is_available;
-                                marker.options.history = p.history;
+                        clusterLayer.clearLayers();
+                        if (data.clusters) {{
+                            renderClusters(data.clusters, data.length);
+                        }} else if (data.properties) {{
+                            const p = data.properties;
+                            const newLayers = [];
+                            for (let i = 0; i < data.length; i++) {{
+                                const isAvailable = p.is_available[i] === 1;
+                                const marker = L.marker([p.lat[i], p.lng[i]], {{icon: createIcon(isAvailable, false)}});
+                                marker.options.listingId = p.id[i];
+                                marker.options.isAvailable = isAvailable;
 
                                 marker.on('click', function(e) {{
                                     if (selectedMarker) {{
@@ -849,10 +1602,10 @@ def show_map():
                                     this.setIcon(createIcon(this.options.isAvailable, true));
                                     selectedMarker = this;
 
-                                    updateSidebar(this.options.sidebarHtml, this.options.history);
+                                    loadDetail(this.options.listingId);
                                 }});
-                                return marker;
-                            }});
+                                newLayers.push(marker);
+                            }}
                             markers.addLayers(newLayers);
                         }}
                     }})
@@ -932,6 +1685,7 @@ def show_map():
     except Exception as e:
         import traceback
         traceback.print_exc()
+        request_metrics.mark_error()
         return f"<h1>Error loading map: {e}</h1>"
 
 @route('/stats')
@@ -943,27 +1697,15 @@ def show_stats():
 
     try:
         # Get comprehensive statistics
-        stats_query = text("""
-        SELECT
-            COUNT(*) as total_records,
-            COUNT(DISTINCT listing_id) as unique_properties,
-            MIN(`Rent (CZK)`) as min_price,
-            MAX(`Rent (CZK)`) as max_price,
-            AVG(`Rent (CZK)`) as avg_price,
-            MIN(`Area (m2)`) as min_surface,
-            MAX(`Area (m2)`) as max_surface,
-            AVG(`Area (m2)`) as avg_surface,
-            MIN(Latitude) as lat_min,
-            MAX(Latitude) as lat_max,
-            MIN(Longitude) as lng_min,
-            MAX(Longitude) as lng_max
-        FROM properties
-        WHERE Latitude IS NOT NULL AND Longitude IS NOT NULL
-        """)
-
-        with engine.connect() as conn:
-            result = pd.read_sql(stats_query, conn).iloc[0].to_dict()
-            stats = result
+        summary = get_summary_stats(engine)
+        stats = summary['all']
+
+        # Breakdown by disposition
+        dispo_rows = "".join(
+            f"<tr><td>{name}</td><td>{row['unique_properties']:,}</td><td>{row['avg_price']:,.0f}</td>"
+            f"<td>{row['min_price']:,.0f} - {row['max_price']:,.0f}</td><td>{row['avg_surface']:,.0f} m²</td></tr>"
+            for name, row in sorted(summary['dispositions'].items(), key=lambda item: -item[1]['unique_properties'])
+        )
 
         return f"""
         <html>
@@ -1007,6 +1749,17 @@ def show_stats():
                 </div>
             </div>
 
+            <div style='background: #f8f9fa; padding: 15px; border-radius: 8px;'>
+                <h2>🏠 By Disposition</h2>
+                <table style='border-collapse: collapse; width: 100%;' cellpadding='6'>
+                    <tr style='text-align: left; border-bottom: 1px solid #ddd;'>
+                        <th>Disposition</th><th>Properties</th><th>Average Rent</th><th>Rent Range</th><th>Average Area</th>
+                    </tr>
+                    {dispo_rows}
+                </table>
+                <p style='color: #888; font-size: 12px;'>Updated {stats['updated_at']}</p>
+            </div>
+
             <div style='text-align: center; margin: 30px 0;'>
                 <a href='/' style='background: #007bff; color: white; padding: 12px 24px; text-decoration: none; border-radius: 5px; font-size: 16px;'>
                     🗺️ Back to Map
@@ -1019,6 +1772,7 @@ def show_stats():
     except Exception as e:
         import traceback
         traceback.print_exc()
+        request_metrics.mark_error()
         return f"<h1>Error: {str(e)}</h1>"
 
 # Initialize Bottle app for WSGI                                                                                                                                                      │
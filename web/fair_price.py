@@ -0,0 +1,163 @@
+# Fair-price estimates from comparable nearby listings
+import time
+from datetime import datetime
+import numpy as np
+from listing_index import GridIndex
+
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    # Optional, a grid search over the same points is used when scipy is not installed
+    cKDTree = None
+
+KM_PER_DEG_LAT = 110.57
+KM_PER_DEG_LNG_EQUATOR = 111.32
+# Only listings seen within this many days count as comparables
+COMPARABLE_MAX_AGE_DAYS = 365
+# Comparables must have an area within this fraction of the requested area
+AREA_TOLERANCE = 0.25
+DEFAULT_K = 20
+MAX_K = 200
+PERCENTILES = (10, 25, 50, 75, 90)
+# Cell size of the fallback grid search in km
+SEARCH_CELL_KM = 0.5
+# Upper bound on the box doublings of the grid search (0.5 km * 2**40 is far beyond any real extent)
+MAX_SEARCH_DOUBLINGS = 40
+
+
+class NeighbourSearch:
+    """
+    k-nearest-neighbour search over points on a plane (km).
+    Uses a scipy KD-tree when available, otherwise an expanding box search over a GridIndex:
+    the k-th nearest point is final once its distance is within the half-width of the searched box.
+    """
+
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+        if cKDTree is not None:
+            self.tree = cKDTree(np.column_stack([x, y]))
+            self.grid = None
+        else:
+            self.tree = None
+            self.grid = GridIndex(y, x, cell_deg=SEARCH_CELL_KM)
+            self.bounds = (x.min(), x.max(), y.min(), y.max()) if len(x) else (0.0, 0.0, 0.0, 0.0)
+
+    def __len__(self):
+        return len(self.x)
+
+    def nearest(self, x0, y0, k):
+        """Returns (distances, positions) of the k nearest points, closest first"""
+        k = min(k, len(self.x))
+        if k == 0:
+            return np.empty(0, np.float64), np.empty(0, np.int64)
+        if self.tree is not None:
+            distances, positions = self.tree.query([x0, y0], k=k)
+            return np.atleast_1d(distances), np.atleast_1d(positions)
+
+        if not (np.isfinite(x0) and np.isfinite(y0)):
+            return np.empty(0, np.float64), np.empty(0, np.int64)
+
+        # A box of this half-width around the point covers every point, so the search ends there at the latest
+        x_min, x_max, y_min, y_max = self.bounds
+        max_radius = max(abs(x0 - x_min), abs(x0 - x_max), abs(y0 - y_min), abs(y0 - y_max))
+        radius = SEARCH_CELL_KM
+        for _ in range(MAX_SEARCH_DOUBLINGS):
+            candidates = self.grid.lookup(y0 - radius, y0 + radius, x0 - radius, x0 + radius)
+            distances = np.hypot(self.x[candidates] - x0, self.y[candidates] - y0)
+            if len(candidates) >= k:
+                nearest = np.argpartition(distances, k - 1)[:k]
+                nearest = nearest[np.argsort(distances[nearest], kind='stable')]
+                if distances[nearest[-1]] <= radius:
+                    return distances[nearest], candidates[nearest]
+            if radius >= max_radius:
+                # Fewer than k points exist
+                break
+            radius *= 2
+        order = np.argsort(distances, kind='stable')[:k]
+        return distances[order], candidates[order]
+
+
+class FairPriceEstimator:
+    """
+    Comparable-price estimates for a flat given its location, area and disposition.
+    Built from a ListingSnapshot: one NeighbourSearch per disposition over listings seen in the last
+    COMPARABLE_MAX_AGE_DAYS, plus one over all of them for requests without a (known) disposition.
+    Prices are total monthly prices (rent + utilities + services), scaled to the requested area by price per m².
+    """
+
+    def __init__(self, snapshot, today=None):
+        started = time.perf_counter()
+        self.snapshot = snapshot
+        today = np.datetime64(today or datetime.now().date(), 'D')
+
+        eligible = ((snapshot.last_seen >= today - COMPARABLE_MAX_AGE_DAYS)
+                    & (snapshot.area > 0) & (snapshot.total_price > 0)
+                    & np.isfinite(snapshot.lat) & np.isfinite(snapshot.lng))
+        self.positions = np.flatnonzero(eligible)
+
+        # Equirectangular projection around the mean latitude, accurate to well under 1% within Czechia
+        self.ref_lat = float(snapshot.lat[self.positions].mean()) if len(self.positions) else 0.0
+        self.km_per_deg_lng = KM_PER_DEG_LNG_EQUATOR * np.cos(np.radians(self.ref_lat))
+        x = snapshot.lng[self.positions] * self.km_per_deg_lng
+        y = snapshot.lat[self.positions] * KM_PER_DEG_LAT
+
+        self.price_m2 = snapshot.total_price[self.positions] / snapshot.area[self.positions]
+        self.area = snapshot.area[self.positions]
+
+        self._disposition_lookup = {d: i for i, d in enumerate(snapshot.dispositions)}
+        codes = snapshot.disposition_code[self.positions]
+        self.searches = {None: (np.arange(len(self.positions)), NeighbourSearch(x, y))}
+        for code in np.unique(codes[codes >= 0]):
+            members = np.flatnonzero(codes == code)
+            self.searches[int(code)] = (members, NeighbourSearch(x[members], y[members]))
+
+        self.built_at = time.time()
+        print(f"✅ Fair-price estimator built over {len(self.positions)} listings "
+              f"({len(self.searches) - 1} dispositions) in {time.perf_counter() - started:.2f}s")
+
+    def comparables(self, lat, lng, area, disposition=None, k=DEFAULT_K):
+        """
+        Returns (distances in km, estimator positions) of the k nearest listings of the same disposition
+        whose area is within AREA_TOLERANCE of the requested area.
+        The neighbour query is widened until k listings pass the area filter or the disposition runs out.
+        """
+        code = self._disposition_lookup.get(disposition)
+        members, search = self.searches.get(code, self.searches[None])
+        x0 = lng * self.km_per_deg_lng
+        y0 = lat * KM_PER_DEG_LAT
+        area_min, area_max = area * (1 - AREA_TOLERANCE), area * (1 + AREA_TOLERANCE)
+
+        n_query = k * 4
+        while True:
+            distances, found = search.nearest(x0, y0, n_query)
+            positions = members[found]
+            matches = (self.area[positions] >= area_min) & (self.area[positions] <= area_max)
+            if matches.sum() >= k or n_query >= len(search):
+                return distances[matches][:k], positions[matches][:k]
+            n_query *= 4
+
+    def estimate(self, lat, lng, area, disposition=None, k=DEFAULT_K):
+        """Price distribution for a flat, None if no comparable listing exists"""
+        k = max(1, min(int(k), MAX_K))
+        distances, positions = self.comparables(lat, lng, area, disposition, k)
+        if len(positions) == 0:
+            return None
+
+        price_m2 = self.price_m2[positions]
+        prices = price_m2 * area
+        listing_positions = self.positions[positions]
+        snapshot = self.snapshot
+
+        return {
+            'price': {f'p{p}': int(round(v)) for p, v in zip(PERCENTILES, np.percentile(prices, PERCENTILES))},
+            'price_m2': {f'p{p}': round(float(v), 1) for p, v in zip(PERCENTILES, np.percentile(price_m2, PERCENTILES))},
+            'mean_price': int(round(prices.mean())),
+            'comparables': len(positions),
+            'radius_km': round(float(distances[-1]), 3),
+            'listings': [
+                {'id': int(lid), 'distance_km': round(float(d), 3), 'price': int(p), 'area': float(a)}
+                for lid, d, p, a in zip(snapshot.listing_id[listing_positions], distances,
+                                        snapshot.total_price[listing_positions], snapshot.area[listing_positions])
+            ]
+        }
@@ -0,0 +1,323 @@
+# Columnar in-memory snapshot of the properties table for the map API
+import os
+import sys
+import threading
+import time
+import numpy as np
+import pandas as pd
+from sqlalchemy import text, inspect
+
+try:
+    from stream_operations import read_sql_chunks
+except ImportError:
+    # Started from web/: the pipeline's shared helpers live in the repository root
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from stream_operations import read_sql_chunks
+
+
+# Description text lives once per distinct text in the pipeline's descriptions table,
+# rows loaded before that table existed still carry it in properties
+DESCRIPTION_SELECT = "COALESCE(p.Description, d.Description) AS Description"
+DESCRIPTION_JOIN = "LEFT JOIN descriptions d ON d.description_hash = p.`Description hash`"
+
+
+def description_sql(has_descriptions):
+    """
+    (select expression, join) for the Description of properties p. Until the pipeline has created the
+    descriptions table (first daily load or migrate_descriptions) the text is only in properties.
+    """
+    if has_descriptions:
+        return DESCRIPTION_SELECT, DESCRIPTION_JOIN
+    return "p.Description", ""
+
+# Cell size of the spatial grid in degrees (~1.1 km north-south, ~0.7 km east-west in Czechia)
+GRID_CELL_DEG = 0.01
+
+
+class GridIndex:
+    """
+    Uniform lat/lng grid over a set of points.
+    Point positions are sorted by cell key (row * n_cols + col), so the cells of one grid row
+    inside a viewport form a contiguous key range that is found with two binary searches.
+    Lookup cost is O(rows * log n + candidates) instead of a scan over all points.
+    """
+
+    def __init__(self, lat, lng, cell_deg=GRID_CELL_DEG):
+        self.cell_deg = cell_deg
+        self.lat = lat
+        self.lng = lng
+        self.lat0 = float(lat.min()) if len(lat) else 0.0
+        self.lng0 = float(lng.min()) if len(lng) else 0.0
+        rows = self._row(lat)
+        cols = self._col(lng)
+        self.n_rows = int(rows.max()) + 1 if len(rows) else 0
+        self.n_cols = int(cols.max()) + 1 if len(cols) else 0
+
+        keys = rows * self.n_cols + cols
+        self.order = np.argsort(keys, kind='stable')
+        self.keys = keys[self.order]
+
+    def _row(self, lat):
+        return np.floor((np.asarray(lat) - self.lat0) / self.cell_deg).astype(np.int64)
+
+    def _col(self, lng):
+        return np.floor((np.asarray(lng) - self.lng0) / self.cell_deg).astype(np.int64)
+
+    def lookup(self, lat_min, lat_max, lng_min, lng_max):
+        """Returns positions of points inside the bounding box (unordered)"""
+        r0 = max(int(self._row(lat_min)), 0)
+        r1 = min(int(self._row(lat_max)), self.n_rows - 1)
+        c0 = max(int(self._col(lng_min)), 0)
+        c1 = min(int(self._col(lng_max)), self.n_cols - 1)
+        if r0 > r1 or c0 > c1:
+            return np.empty(0, np.int64)
+
+        row_base = np.arange(r0, r1 + 1, dtype=np.int64) * self.n_cols
+        left = np.searchsorted(self.keys, row_base + c0, side='left')
+        right = np.searchsorted(self.keys, row_base + c1, side='right')
+        # Gather all row slices at once: index = slice start + offset within the slice
+        lengths = right - left
+        total = int(lengths.sum())
+        slice_starts = np.cumsum(lengths) - lengths
+        candidates = self.order[np.repeat(left - slice_starts, lengths) + np.arange(total)]
+
+        # Edge cells are only partly inside the box
+        inside = ((self.lat[candidates] >= lat_min) & (self.lat[candidates] <= lat_max)
+                  & (self.lng[candidates] >= lng_min) & (self.lng[candidates] <= lng_max))
+        return candidates[inside]
+
+
+def aggregate_grid(lat, lng, price, is_available, cell_deg):
+    """
+    Groups points into globally aligned grid cells of cell_deg degrees.
+    Returns a dict of columns with one element per non-empty cell: centroid (lat, lng),
+    listing count, number of available listings and median price.
+    """
+    if len(lat) == 0:
+        return {
+            'lat': np.empty(0, np.float64), 'lng': np.empty(0, np.float64),
+            'count': np.empty(0, np.int64), 'available': np.empty(0, np.int64),
+            'median_price': np.empty(0, np.int64)
+        }
+
+    rows = np.floor(lat / cell_deg).astype(np.int64)
+    cols = np.floor(lng / cell_deg).astype(np.int64)
+    _, cell, counts = np.unique(np.stack([rows, cols], axis=1), axis=0, return_inverse=True, return_counts=True)
+    cell = cell.ravel()
+
+    centroid_lat = np.bincount(cell, weights=lat) / counts
+    centroid_lng = np.bincount(cell, weights=lng) / counts
+    available = np.bincount(cell, weights=is_available.astype(np.float64)).astype(np.int64)
+
+    # Sort prices within each cell, the median sits in the middle of each cell's run
+    sorted_prices = price[np.lexsort((price, cell))]
+    starts = np.cumsum(counts) - counts
+    median = (sorted_prices[starts + (counts - 1) // 2] + sorted_prices[starts + counts // 2]) / 2
+
+    return {
+        'lat': np.round(centroid_lat, 5),
+        'lng': np.round(centroid_lng, 5),
+        'count': counts.astype(np.int64),
+        'available': available,
+        'median_price': median.astype(np.int64)
+    }
+
+
+class ListingSnapshot:
+    """
+    Latest state of every listing held in NumPy arrays (one element per listing),
+    plus the full price history in CSR layout: the history of listing i is
+    hist_dates[hist_offsets[i]:hist_offsets[i + 1]] (ascending by date).
+    """
+
+    def __init__(self, df, df_text, df_images):
+        # One row per observation, ordered so each listing's history is contiguous and ascending
+        df = df.sort_values(['listing_id', 'Date obtained'], kind='stable')
+
+        ids = df['listing_id'].to_numpy(np.int64)
+        n_rows = len(ids)
+        starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]]) if n_rows else np.empty(0, np.int64)
+        self.hist_offsets = np.r_[starts, n_rows].astype(np.int64)
+        last = self.hist_offsets[1:] - 1
+
+        dates = pd.to_datetime(df['Date obtained']).to_numpy('datetime64[D]')
+        totals = (df['Rent (CZK)'].fillna(0).to_numpy(np.float64)
+                  + df['Utilities (CZK)'].fillna(0).to_numpy(np.float64)
+                  + df['Services (CZK)'].fillna(0).to_numpy(np.float64))
+
+        self.hist_dates = dates
+        self.hist_prices = totals.astype(np.int64)
+
+        self.listing_id = ids[starts]
+        self.lat = df['Latitude'].to_numpy(np.float64)[last]
+        self.lng = df['Longitude'].to_numpy(np.float64)[last]
+        self.total_price = totals[last]
+        self.rent = df['Rent (CZK)'].to_numpy(np.float64, na_value=np.nan)[last]
+        self.utilities = df['Utilities (CZK)'].to_numpy(np.float64, na_value=np.nan)[last]
+        self.services = df['Services (CZK)'].to_numpy(np.float64, na_value=np.nan)[last]
+        self.area = df['Area (m2)'].to_numpy(np.float64, na_value=np.nan)[last]
+        self.fee = df['Fee'].to_numpy(np.float64, na_value=np.nan)[last]
+        self.first_seen = dates[starts]
+        self.last_seen = dates[last]
+
+        codes, categories = pd.factorize(df['Disposition'].iloc[last], sort=True)
+        self.disposition_code = codes.astype(np.int16)
+        self.dispositions = list(categories)
+        self._disposition_lookup = {d: i for i, d in enumerate(self.dispositions)}
+
+        # Text of the latest observation, aligned to the listing arrays
+        df_text = df_text.drop_duplicates('listing_id', keep='last').set_index('listing_id')
+        df_text = df_text.reindex(self.listing_id)
+        self.url = df_text['URL'].to_numpy(object)
+        self.address = df_text['Address'].to_numpy(object)
+        self.description = df_text['Description'].to_numpy(object)
+
+        self.images = {lid: group['object_name'].tolist() for lid, group in df_images.groupby('listing_id')}
+
+        self.grid = GridIndex(self.lat, self.lng)
+
+        self.n_rows = n_rows
+        self.loaded_at = time.time()
+
+    def __len__(self):
+        return len(self.listing_id)
+
+    def query(self, lat_min, lat_max, lng_min, lng_max, price_min=None, price_max=None,
+              area_min=None, area_max=None, fee_max=None, dispositions=None,
+              show_available=True, show_unavailable=True, today=None):
+        """
+        Returns positions of listings matching the viewport and filters, newest first.
+        The viewport is resolved through the grid index, filters only touch the listings inside it.
+        NaN values never pass a numeric filter, mirroring SQL NULL comparisons.
+        """
+        positions = np.sort(self.grid.lookup(lat_min, lat_max, lng_min, lng_max))
+        mask = np.ones(len(positions), dtype=bool)
+
+        if price_min is not None:
+            mask &= self.total_price[positions] >= price_min
+        if price_max is not None:
+            mask &= self.total_price[positions] <= price_max
+        if area_min is not None:
+            mask &= self.area[positions] >= area_min
+        if area_max is not None:
+            mask &= self.area[positions] <= area_max
+        if fee_max is not None:
+            mask &= self.fee[positions] <= fee_max
+        if dispositions:
+            codes = [self._disposition_lookup[d] for d in dispositions if d in self._disposition_lookup]
+            mask &= np.isin(self.disposition_code[positions], codes)
+
+        if not (show_available and show_unavailable):
+            is_available = self.last_seen[positions] == np.datetime64(today, 'D')
+            if not show_available:
+                mask &= ~is_available
+            if not show_unavailable:
+                mask &= is_available
+
+        positions = positions[mask]
+        # Newest first, matching ORDER BY `Date obtained` DESC of the SQL path
+        return positions[np.argsort(self.last_seen[positions], kind='stable')[::-1]]
+
+    def position(self, listing_id):
+        """Returns the array position of a listing, or None if it is not in the snapshot"""
+        pos = int(np.searchsorted(self.listing_id, listing_id))
+        if pos < len(self.listing_id) and self.listing_id[pos] == listing_id:
+            return pos
+        return None
+
+    def history(self, pos):
+        """Returns (dates, prices) arrays of one listing in ascending date order"""
+        start, end = self.hist_offsets[pos], self.hist_offsets[pos + 1]
+        return self.hist_dates[start:end], self.hist_prices[start:end]
+
+
+def load_snapshot(engine):
+    """Reads the properties and images tables into a new ListingSnapshot"""
+    history_query = text("""
+    SELECT
+        listing_id, Latitude, Longitude,
+        `Rent (CZK)`, `Utilities (CZK)`, `Services (CZK)`,
+        `Area (m2)`, Fee, Disposition, `Date obtained`
+    FROM properties
+    WHERE Latitude IS NOT NULL AND Longitude IS NOT NULL
+    """)
+    description_select, description_join = description_sql(inspect(engine).has_table('descriptions'))
+    text_query = text(f"""
+    SELECT p.listing_id, p.URL, p.Address, {description_select}
+    FROM properties p
+    {description_join}
+    INNER JOIN (
+        SELECT listing_id, MAX(`Date obtained`) AS last_date
+        FROM properties
+        GROUP BY listing_id
+    ) latest ON p.listing_id = latest.listing_id AND p.`Date obtained` = latest.last_date
+    """)
+    images_query = text("SELECT listing_id, object_name FROM images")
+
+    df = read_streamed(engine, history_query)
+    df_text = read_streamed(engine, text_query)
+    df_images = read_streamed(engine, images_query)
+
+    return ListingSnapshot(df, df_text, df_images)
+
+
+def _integer_ids(chunk):
+    """listing_id may be stored as text, the index works with integer ids"""
+    chunk['listing_id'] = pd.to_numeric(chunk['listing_id'], errors='coerce')
+    chunk = chunk.dropna(subset=['listing_id'])
+    chunk['listing_id'] = chunk['listing_id'].astype(np.int64)
+    return chunk
+
+
+def read_streamed(engine, query):
+    """
+    Reads a query with read_sql_chunks, converting each chunk before the next one is fetched,
+    so the driver never buffers the whole raw result next to the frame.
+    """
+    return pd.concat([_integer_ids(chunk) for chunk in read_sql_chunks(engine, query)], ignore_index=True)
+
+
+class ListingIndex:
+    """
+    Holds the current ListingSnapshot and rebuilds it in a background thread,
+    every refresh_seconds or as soon as refresh() is called.
+    Readers take self.snapshot once per request; a rebuild swaps the reference atomically.
+    """
+
+    def __init__(self, engine_getter, refresh_seconds=3600, on_refresh=None):
+        self.engine_getter = engine_getter
+        self.refresh_seconds = refresh_seconds
+        self.on_refresh = on_refresh
+        self.snapshot = None
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="listing-index", daemon=True)
+            self._thread.start()
+
+    def refresh(self):
+        """Asks the background thread to rebuild the snapshot now"""
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            self.rebuild()
+            self._wake.wait(self.refresh_seconds)
+
+    def rebuild(self):
+        engine = self.engine_getter()
+        if not engine:
+            print("Listing index: no database engine, keeping previous snapshot")
+            return
+        try:
+            started = time.perf_counter()
+            snapshot = load_snapshot(engine)
+            self.snapshot = snapshot
+            print(f"✅ Listing index loaded {len(snapshot)} listings ({snapshot.n_rows} rows) in {time.perf_counter() - started:.1f}s")
+            if self.on_refresh:
+                self.on_refresh()
+        except Exception as e:
+            print(f"❌ Listing index refresh failed: {e}")
@@ -0,0 +1,208 @@
+# Request latency and DB timing for the bottle app
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+import numpy as np
+from bottle import request, response
+from sqlalchemy.pool import QueuePool
+
+# Latency percentiles are computed over the most recent samples of each route
+SAMPLE_WINDOW = 2048
+QUANTILES = (0.5, 0.9, 0.99)
+# Requests slower than this are logged with their query string and phase breakdown
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 1000))
+
+
+class _Series:
+    """Running count/sum and a window of recent samples (seconds)"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.recent = deque(maxlen=SAMPLE_WINDOW)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.recent.append(seconds)
+
+    def quantiles(self):
+        if not self.recent:
+            return {q: 0.0 for q in QUANTILES}
+        values = np.quantile(np.fromiter(self.recent, dtype=np.float64), QUANTILES)
+        return dict(zip(QUANTILES, values.tolist()))
+
+
+class RequestMetrics:
+    """
+    Bottle plugin timing every route, labelled by its rule ('/api/property/<listing_id:int>').
+    Handlers mark where the time goes with `with request_metrics.phase('sql'):`; phase durations are
+    accumulated per request (thread-local) and per route. Pool checkout wait is recorded by TimedQueuePool.
+    """
+    name = 'request_metrics'
+    api = 2
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.routes = {}
+        self.phases = {}
+        self.errors = {}
+        self.pool_wait = _Series()
+        self.slow_requests = 0
+        self.started_at = time.time()
+
+    # --- Plugin interface ---
+
+    def apply(self, callback, route):
+        rule = route.rule
+
+        def wrapper(*args, **kwargs):
+            self._local.phases = {}
+            self._local.failed = False
+            start = time.perf_counter()
+            try:
+                return callback(*args, **kwargs)
+            except Exception:
+                self._local.failed = True
+                raise
+            finally:
+                elapsed = time.perf_counter() - start
+                self._record(rule, elapsed, self._local.phases, self._local.failed)
+                self._local.phases = None
+
+        return wrapper
+
+    # --- Recording ---
+
+    @contextmanager
+    def phase(self, name):
+        """Times a block as phase 'name' of the current request (no-op outside a request)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            phases = getattr(self._local, 'phases', None)
+            if phases is not None:
+                phases[name] = phases.get(name, 0.0) + time.perf_counter() - start
+
+    def timed(self, name):
+        """Decorator form of phase()"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.phase(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def mark_error(self):
+        """Counts the current request as failed (the API handlers answer errors with a JSON body)"""
+        self._local.failed = True
+
+    def record_pool_wait(self, seconds):
+        with self._lock:
+            self.pool_wait.add(seconds)
+        phases = getattr(self._local, 'phases', None)
+        if phases is not None:
+            phases['pool_wait'] = phases.get('pool_wait', 0.0) + seconds
+
+    def _record(self, rule, elapsed, phases, failed):
+        status = response.status_code
+        with self._lock:
+            self.routes.setdefault(rule, _Series()).add(elapsed)
+            for name, seconds in phases.items():
+                self.phases.setdefault((rule, name), _Series()).add(seconds)
+            if failed or status >= 500:
+                self.errors[rule] = self.errors.get(rule, 0) + 1
+            slow = elapsed * 1000 >= SLOW_REQUEST_MS
+            if slow:
+                self.slow_requests += 1
+        if slow:
+            breakdown = ', '.join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in phases.items())
+            print(f"🐢 Slow request {elapsed * 1000:.0f}ms {request.method} {request.path}?{request.query_string} "
+                  f"status={status} [{breakdown}]")
+
+    # --- Export ---
+
+    def snapshot(self, pool=None):
+        """Current metrics as a dict (latencies in milliseconds)"""
+        def summary(series):
+            return {
+                'count': series.count,
+                'mean_ms': round(series.total / series.count * 1000, 2) if series.count else 0.0,
+                **{f"p{int(q * 100)}_ms": round(v * 1000, 2) for q, v in series.quantiles().items()}
+            }
+
+        with self._lock:
+            routes = {}
+            for rule, series in self.routes.items():
+                routes[rule] = summary(series)
+                routes[rule]['errors'] = self.errors.get(rule, 0)
+                routes[rule]['phases'] = {name: summary(s) for (r, name), s in self.phases.items() if r == rule}
+            result = {
+                'uptime_seconds': round(time.time() - self.started_at),
+                'slow_request_ms': SLOW_REQUEST_MS,
+                'slow_requests': self.slow_requests,
+                'routes': routes,
+                'pool_wait': summary(self.pool_wait)
+            }
+        if pool is not None:
+            result['pool'] = {'size': pool.size(), 'checked_out': pool.checkedout(), 'overflow': pool.overflow()}
+        return result
+
+    def prometheus_text(self, pool=None):
+        """Prometheus text exposition: per-route latency and phase summaries, pool wait and pool state"""
+        lines = []
+        with self._lock:
+            lines.append("# TYPE housing_web_request_seconds summary")
+            for rule, series in self.routes.items():
+                for q, v in series.quantiles().items():
+                    lines.append(f'housing_web_request_seconds{{route="{rule}",quantile="{q}"}} {v:.6f}')
+                lines.append(f'housing_web_request_seconds_sum{{route="{rule}"}} {series.total:.6f}')
+                lines.append(f'housing_web_request_seconds_count{{route="{rule}"}} {series.count}')
+
+            lines.append("# TYPE housing_web_request_errors_total counter")
+            for rule, count in self.errors.items():
+                lines.append(f'housing_web_request_errors_total{{route="{rule}"}} {count}')
+
+            lines.append("# TYPE housing_web_phase_seconds summary")
+            for (rule, name), series in self.phases.items():
+                for q, v in series.quantiles().items():
+                    lines.append(f'housing_web_phase_seconds{{route="{rule}",phase="{name}",quantile="{q}"}} {v:.6f}')
+                lines.append(f'housing_web_phase_seconds_sum{{route="{rule}",phase="{name}"}} {series.total:.6f}')
+                lines.append(f'housing_web_phase_seconds_count{{route="{rule}",phase="{name}"}} {series.count}')
+
+            lines.append("# TYPE housing_web_pool_wait_seconds summary")
+            for q, v in self.pool_wait.quantiles().items():
+                lines.append(f'housing_web_pool_wait_seconds{{quantile="{q}"}} {v:.6f}')
+            lines.append(f'housing_web_pool_wait_seconds_sum {self.pool_wait.total:.6f}')
+            lines.append(f'housing_web_pool_wait_seconds_count {self.pool_wait.count}')
+
+            lines.append("# TYPE housing_web_slow_requests_total counter")
+            lines.append(f'housing_web_slow_requests_total {self.slow_requests}')
+
+        if pool is not None:
+            lines.append("# TYPE housing_web_pool_checked_out gauge")
+            lines.append(f'housing_web_pool_checked_out {pool.checkedout()}')
+            lines.append("# TYPE housing_web_pool_overflow gauge")
+            lines.append(f'housing_web_pool_overflow {pool.overflow()}')
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection (including opening a new one)"""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            request_metrics.record_pool_wait(time.perf_counter() - start)
@@ -0,0 +1,73 @@
+# In-process response cache for the map API
+import math
+import threading
+import time
+from collections import OrderedDict
+
+# Viewports are snapped outwards to a grid of power-of-two degree tiles.
+# Roughly this many tiles span the longer side of a viewport, so small pans stay inside the same tile range.
+TILES_PER_VIEWPORT = 4
+
+
+def snap_to_tiles(lat_min, lat_max, lng_min, lng_max):
+    """
+    Expands viewport bounds to the enclosing tile range.
+    Returns (tile_key, snapped_bounds) where tile_key identifies the tile range and
+    snapped_bounds is a (lat_min, lat_max, lng_min, lng_max) tuple aligned to the tile grid.
+    """
+    span = max(lat_max - lat_min, lng_max - lng_min, 1e-6)
+    level = math.ceil(math.log2(span / TILES_PER_VIEWPORT))
+    tile = 2.0 ** level
+
+    y0 = math.floor(lat_min / tile)
+    y1 = math.ceil(lat_max / tile)
+    x0 = math.floor(lng_min / tile)
+    x1 = math.ceil(lng_max / tile)
+
+    tile_key = (level, y0, y1, x0, x1)
+    snapped_bounds = (y0 * tile, y1 * tile, x0 * tile, x1 * tile)
+    return tile_key, snapped_bounds
+
+
+class ResponseCache:
+    """
+    Thread-safe LRU cache with a time-to-live per entry.
+    Values are stored as-is (the API stores already serialized JSON strings).
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=900):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, value = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
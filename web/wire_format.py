@@ -0,0 +1,105 @@
+# Response encodings for the map API
+import gzip
+import json
+import struct
+import numpy as np
+
+try:
+    import brotli
+except ImportError:
+    # Optional, gzip is used when brotli is not installed
+    brotli = None
+
+FORMATS = ('json', 'columnar', 'binary')
+
+# Bodies smaller than this are not worth compressing
+MIN_COMPRESS_BYTES = 1024
+
+
+def to_records(columns):
+    """Column dict of arrays -> list of row dicts with native Python values"""
+    names = list(columns)
+    values = [np.asarray(columns[name]).tolist() for name in names]
+    return [dict(zip(names, row)) for row in zip(*values)]
+
+
+def _wire_array(values):
+    """Converts a column to a little-endian dtype that maps onto a JavaScript typed array"""
+    values = np.asarray(values)
+    if values.dtype == np.bool_:
+        return values.astype('<u1'), 'uint8'
+    if np.issubdtype(values.dtype, np.integer):
+        if len(values) == 0 or (values.min() >= np.iinfo(np.int32).min and values.max() <= np.iinfo(np.int32).max):
+            return values.astype('<i4'), 'int32'
+        return values.astype('<f8'), 'float64'
+    return values.astype('<f8'), 'float64'
+
+
+def pack_columns(key, columns, meta):
+    """
+    Binary layout:
+        uint32 little-endian header length
+        UTF-8 JSON header {"key", "count", "columns": [{"name", "dtype", "offset"}], "meta"}
+        column buffers, each starting at an 8-byte aligned offset from the end of the (padded) header
+    Aligned buffers let the browser wrap them in typed arrays without copying.
+    """
+    count = len(next(iter(columns.values()))) if columns else 0
+    buffers = []
+    descriptors = []
+    offset = 0
+    for name, values in columns.items():
+        array, dtype = _wire_array(values)
+        descriptors.append({'name': name, 'dtype': dtype, 'offset': offset})
+        data = array.tobytes()
+        padding = -len(data) % 8
+        buffers.append(data + b'\0' * padding)
+        offset += len(data) + padding
+
+    header = json.dumps({'key': key, 'count': count, 'columns': descriptors, 'meta': meta}).encode('utf-8')
+    header_padding = -(4 + len(header)) % 8
+    return struct.pack('<I', len(header)) + header + b' ' * header_padding + b''.join(buffers)
+
+
+def encode_payload(result, key, fmt):
+    """
+    Serializes an API result whose `key` entry is a dict of NumPy columns.
+    Returns (body bytes, content type).
+    json:     {"<key>": [{column: value, ...}, ...], ...meta}  (the original row format)
+    columnar: {"<key>": {column: [values...], ...}, ...meta}
+    binary:   see pack_columns
+    """
+    columns = result[key]
+    meta = {k: v for k, v in result.items() if k != key}
+
+    if fmt == 'binary':
+        return pack_columns(key, columns, meta), 'application/octet-stream'
+    if fmt == 'columnar':
+        body = {key: {name: np.asarray(values).tolist() for name, values in columns.items()}, **meta}
+    else:
+        body = {key: to_records(columns), **meta}
+    return json.dumps(body).encode('utf-8'), 'application/json'
+
+
+def negotiate_encoding(accept_encoding):
+    """Picks brotli or gzip from an Accept-Encoding header, None if neither is accepted"""
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        name, _, params = part.strip().partition(';')
+        if params.replace(' ', '') in ('q=0', 'q=0.0'):
+            continue
+        accepted.add(name.strip().lower())
+
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+def compress(body, encoding):
+    """Returns (body, encoding actually applied)"""
+    if encoding is None or len(body) < MIN_COMPRESS_BYTES:
+        return body, None
+    if encoding == 'br':
+        return brotli.compress(body, quality=5), 'br'
+    return gzip.compress(body, compresslevel=6), 'gzip'